@@ -1,27 +1,40 @@
 #Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# Very basic stats for a project from its classifications export: how many classifications,
+# subjects and classifiers, how classified the subjects are, the most prolific classifiers and
+# how unequal the classifiers' contributions are. Run it without any inputs to see the usage.
+#
+# Everything it does is also here as functions, which don't print anything and return what
+# they work out, so it can be used from a notebook or a long-running process without parsing
+# the export (or starting python) again each time, e.g.
+#   import panoptes_io, basic_project_stats
+#   classifications = panoptes_io.read_classifications('classifications.csv', basic_project_stats.cols_read)
+#   the_results = basic_project_stats.analyze_frame(classifications)
+#   the_results['overall']['nclass_gini']
+# analyze_compact() does the same from panoptes_io.read_compact() (or the cache), and
+# counts_from_chunks() and sketch_chunks() from a file read a chunk at a time. main() is the
+# command line version.
 import sys
 
-# file with raw classifications (csv)
-# put this way up here so if there are no inputs we exit quickly before even trying to load everything else
-try:
-    classfile_in = sys.argv[1]
-except:
-    #classfile_in = 'data/2e3d12a2-56ca-4d1f-930a-9ecc7fd39885.csv'
-    print "\nUsage: "+sys.argv[0]+" classifications_infile"
-    print "      classifications_infile is a Zooniverse (Panoptes) classifications data export CSV."
-    print "\nAll output will be to stdout (about a paragraph worth).\n"
-    sys.exit(0)
-
-
-
 import numpy as np  # using 1.10.1
 import pandas as pd  # using 0.13.1
 #import datetime
 #import dateutil.parser
-import json
+from collections import Counter
 
+from cmdline_flags import pop_flag, pop_option
+from panoptes_io import read_classifications, read_compact, day_string, encode_subjects, subject_counts, is_registered
+from sketches import hash_strings, hash_ints, new_hll, hll_add, hll_count, new_sample, sample_add, sample_is_complete, sample_quantile, \
+    sample_fraction, normal_quantile, default_confidence
+from topk import top_k_series, new_space_saving, space_saving_add, space_saving_top, default_capacity_per_k, default_k
+from partitions import partition_columns, encode_partitions, partition_label, partition_sort_key, counts_by_partition, partition_slices
+from export_cache import read_compact_cached
+from inequality import inequality_stats, top_share_lines, write_lorenz_csv
+from stage_profiler import new_profile, stage, format_profile, write_profile_json, progress_printer
 
 
+# --stream reads the file a chunk at a time instead of all at once (see counts_from_chunks())
+default_chunksize = 500000
 
 
 # columns currently in an exported Panoptes classification file:
@@ -49,13 +62,15 @@ import json
 #       here we will ignore this too, except to count subjects once.
 # we'll also ignore classification_id, user_ip, workflow information, gold_standard, and expert.
 #
-# some of these will be defined further down, but before we actually use this list.
-#cols_used = ["created_at_ts", "user_name", "user_id", "created_at", "started_at", "finished_at"]
+# these are the only columns we need to read from the file; the rest (including the
+# metadata and annotations JSON, which are most of the file) are skipped while reading it
+cols_read = ["user_name", "created_at", "subject_data"]
 
 
-# Print out the input parameters just as a sanity check
-print "Computing project stats using:"
-print "   infile:",classfile_in
+
+# (and with --by, the workflow columns; see partitions.py)
+def columns_to_read(partition_by=None):
+    return cols_read if partition_by is None else cols_read + partition_columns[partition_by]
 
 
 
@@ -65,44 +80,8 @@ print "   infile:",classfile_in
 #################################################################################
 
 
-# Get the Gini coefficient - https://en.wikipedia.org/wiki/Gini_coefficient
-#
-# The Gini coefficient measures inequality in distributions of things.
-# It was originally conceived for economics (e.g. where is the wealth in a country?
-#  in the hands of many citizens or a few?), but it's just as applicable to many
-#  other fields. In this case we'll use it to see how classifications are
-#  distributed among classifiers.
-# G = 0 is a completely even distribution (everyone does the same number of
-#  classifications), and ~1 is uneven (~all the classifications are done
-#  by one classifier).
-# Typical values of the Gini for healthy Zooniverse projects (Cox et al. 2015) are
-#  in the range of 0.7-0.9.
-#  That range is generally indicative of a project with a loyal core group of
-#    volunteers who contribute the bulk of the classification effort, but balanced
-#    out by a regular influx of new classifiers trying out the project, from which
-#    you continue to draw to maintain a core group of prolific classifiers.
-# Once your project is fairly well established, you can compare it to past Zooniverse
-#  projects to see how you're doing.
-#  If your G is << 0.7, you may be having trouble recruiting classifiers into a loyal
-#    group of volunteers. People are trying it, but not many are staying.
-#  If your G is > 0.9, it's a little more complicated. If your total classification
-#    count is lower than you'd like it to be, you may be having trouble recruiting
-#    classifiers to the project, such that your classification counts are
-#    dominated by a few people.
-#  But if you have G > 0.9 and plenty of classifications, this may be a sign that your
-#    loyal users are -really- committed, so a very high G is not necessarily a bad thing.
-#
-# Of course the Gini coefficient is a simplified measure that doesn't always capture
-#  subtle nuances and so forth, but it's still a useful broad metric.
-
-def gini(list_of_values):
-    sorted_list = sorted(list_of_values)
-    height, area = 0, 0
-    for value in sorted_list:
-        height += value
-        area += height - value / 2.
-    fair_area = height * len(list_of_values) / 2
-    return (fair_area - area) / fair_area
+# The Gini coefficient, Lorenz curve and top classifiers' shares are in inequality.py,
+# along with some notes on how to interpret them.
 
 
 
@@ -113,84 +92,526 @@ def gini(list_of_values):
 
 
 
+# Everything below works from the same counts, whichever way the file was read:
+#   nclass_byuser   - a Series of the classification count of each user, indexed by user
+#                     name and sorted by it
+#   subj_class      - the classification count of each subject
+#   user_registered - which of the users in nclass_byuser are logged in
+#   all_users       - the user names
+#   first_class_day, last_class_day - YYYY-MM-DD
+# and with --by (partition_by), partition_keys, partition_users and partition_subjects, which
+# are the arrays from counts_by_partition() (see partitions.py).
+
+
+# The counts from the dict panoptes_io.read_compact() returns (e.g. from the cache, which is
+# shared with sessions_inproj_byuser.py; see export_cache.py). It has the user names and
+# subjects as integer codes, so the counts are just bincounts.
+def counts_from_compact(compact, partition_by=None, profile=None):
+    counts = {'first_class_day': day_string(np.min(compact['created_at'])),
+              'last_class_day':  day_string(np.max(compact['created_at'])),
+              'all_users':       compact['user_names'],
+              'user_registered': compact['user_registered']}
+
+    with stage(profile, 'groupby', len(compact['user_code'])):
+        counts['nclass_byuser'] = pd.Series(np.bincount(compact['user_code'], minlength=len(compact['user_names'])),
+                                            index=pd.Index(compact['user_names'], name='user_name'))
+        counts['subj_class']    = subject_counts(compact['subject_code'])
+        if partition_by is not None:
+            # (the cache has a code for each (workflow_id, workflow_version) pair)
+            partition_code, counts['partition_keys'] = encode_partitions(compact['workflow_ids'], compact['workflow_versions'], partition_by)
+            partition_code = partition_code[compact['workflow_code']]
+            counts['partition_users']    = counts_by_partition(partition_code, compact['user_code'], len(compact['user_names']))
+            counts['partition_subjects'] = counts_by_partition(partition_code, compact['subject_code'], len(compact['subject_ids']))
+    return counts
+
+
+
+# The counts from a DataFrame of the whole file, with (at least) the columns_to_read(partition_by)
+def counts_from_frame(classifications, partition_by=None, profile=None):
+    created_day = [q[:10] for q in classifications.created_at]
+    counts = {'first_class_day': min(created_day).replace(' ', ''),
+              'last_class_day':  max(created_day).replace(' ', '')}
+
+    with stage(profile, 'groupby', len(classifications)):
+        # The users and subjects as integer codes (see panoptes_io.py): the subjects by their
+        # subject id rather than the whole subject_data string, and the users in name order,
+        # same as a groupby. Then all the counting is just bincounts.
+        user_code, all_users = pd.factorize(classifications.user_name.values, sort=True)
+        subject_code, subject_ids, n_subject_fallback = encode_subjects(classifications.subject_data.values)
+        counts['all_users'] = all_users
+        counts['user_registered'] = is_registered(all_users)
+
+        # grab the subject counts
+        counts['subj_class'] = subject_counts(subject_code)
+
+        # for the leaderboard, which I recommend project builders never make public because
+        # Just Say No to gamification
+        # But it's still interesting to see who your most prolific classifiers are, and
+        # e.g. whether they're also your most prolific Talk users
+        counts['nclass_byuser'] = pd.Series(np.bincount(user_code, minlength=len(all_users)), index=pd.Index(all_users, name='user_name'))
+
+        # and the same again for each partition, with the partition as part of the key
+        if partition_by is not None:
+            partition_code, counts['partition_keys'] = encode_partitions(classifications.workflow_id.values, classifications.get('workflow_version'), partition_by)
+            counts['partition_users']    = counts_by_partition(partition_code, user_code, len(all_users))
+            counts['partition_subjects'] = counts_by_partition(partition_code, subject_code, len(subject_ids))
+    return counts
+
+
+
+# The counts from the file a chunk at a time (the_chunks, e.g. from read_classifications()
+# with a chunksize), keeping running counts per user and per subject, which is all the report
+# needs. Peak memory is then about 1 chunk plus the count tables, however big the file is.
+# If progress is given, it's called with the number of rows read so far.
+def counts_from_chunks(the_chunks, partition_by=None, profile=None, progress=None):
+    nclass_byuser_count = Counter()
+    subj_class_count    = Counter()
+    # with --by, keyed by (partition, user name) and (partition, subject id)
+    partition_user_count    = Counter()
+    partition_subject_count = Counter()
+    first_class_day = None
+    last_class_day  = None
+
+    n_rows_read = 0
+    the_chunks = iter(the_chunks)
+    while True:
+        with stage(profile, 'read') as the_stage:
+            chunk = next(the_chunks, None)
+            the_stage['rows'] = 0 if chunk is None else len(chunk)
+        if chunk is None:
+            break
+
+        with stage(profile, 'groupby', len(chunk)):
+            # count with integer codes (see panoptes_io.py) and only then go back to names/ids
+            user_code, chunk_users = pd.factorize(chunk.user_name.values)
+            nclass_byuser_count.update(dict(zip(chunk_users, np.bincount(user_code, minlength=len(chunk_users)))))
+            subject_code, subject_ids, n_subject_fallback = encode_subjects(chunk.subject_data.values)
+            # (subjects with no id are counted together, as -1; zip() drops it if there aren't any)
+            subj_class_count.update(dict(zip(list(subject_ids) + [-1], subject_counts(subject_code))))
+
+            if partition_by is not None:
+                partition_code, chunk_keys = encode_partitions(chunk.workflow_id.values, chunk.get('workflow_version'), partition_by)
+                the_parts, the_users, the_counts = counts_by_partition(partition_code, user_code, len(chunk_users))
+                partition_user_count.update(dict(zip([(chunk_keys[p], chunk_users[u]) for p, u in zip(the_parts, the_users)], the_counts)))
+                the_parts, the_subjects, the_counts = counts_by_partition(partition_code, subject_code, len(subject_ids))
+                the_ids = np.r_[subject_ids, -1]
+                partition_subject_count.update(dict(zip([(chunk_keys[p], the_ids[q]) for p, q in zip(the_parts, the_subjects)], the_counts)))
+
+            chunk_days = chunk.created_at.str[:10]
+            if first_class_day is None:
+                first_class_day = min(chunk_days)
+                last_class_day  = max(chunk_days)
+            else:
+                first_class_day = min(first_class_day, min(chunk_days))
+                last_class_day  = max(last_class_day,  max(chunk_days))
+
+        n_rows_read += len(chunk)
+        if progress is not None:
+            progress(n_rows_read)
+    if progress is not None:
+        progress(n_rows_read, n_rows_read)
+
+    counts = {'first_class_day': first_class_day.replace(' ', ''),
+              'last_class_day':  last_class_day.replace(' ', '')}
+
+    # sorted by user name, same as a groupby would give
+    nclass_byuser = pd.Series(nclass_byuser_count).sort_index()
+    nclass_byuser.index.name = 'user_name'
+    counts['nclass_byuser'] = nclass_byuser
+    counts['subj_class']    = np.array(list(subj_class_count.values()))
+
+    all_users = nclass_byuser.index.values
+    counts['all_users'] = all_users
+    counts['user_registered'] = is_registered(all_users)
+
+    if partition_by is not None:
+        # the same arrays as counts_by_partition() gives, sorted by partition and user
+        partition_keys = sorted(set(q[0] for q in partition_user_count), key=partition_sort_key)
+        partition_index = dict((q, i) for i, q in enumerate(partition_keys))
+        the_pairs = list(partition_user_count.keys())
+        the_parts = np.array([partition_index[q[0]] for q in the_pairs], dtype=np.int64)
+        the_users = np.searchsorted(all_users, np.array([q[1] for q in the_pairs], dtype=object))
+        the_counts = np.array([partition_user_count[q] for q in the_pairs], dtype=np.int64)
+        order = np.lexsort((the_users, the_parts))
+        counts['partition_keys']  = partition_keys
+        counts['partition_users'] = (the_parts[order], the_users[order], the_counts[order])
+        # (the subjects' ids don't matter after this, only how many classifications each has)
+        the_pairs = list(partition_subject_count.keys())
+        the_parts = np.array([partition_index[q[0]] for q in the_pairs], dtype=np.int64)
+        the_counts = np.array([partition_subject_count[q] for q in the_pairs], dtype=np.int64)
+        order = np.argsort(the_parts, kind='mergesort')
+        counts['partition_subjects'] = (the_parts[order], None, the_counts[order])
+    return counts
+
+
+
+# For --approx: read the file a chunk at a time like counts_from_chunks(), but instead of a
+# count per user and per subject, keep HyperLogLogs of the users (registered and not) and the
+# subjects, and a random sample of each with their counts (see sketches.py). The sketch of each
+# chunk is merged into the running one, so memory use doesn't depend on the file at all.
+# Returns a dict of the sketches, plus n_class_tot.
+def sketch_chunks(the_chunks, top_n=default_k, profile=None, progress=None):
+    user_hll    = new_hll()
+    subj_hll    = new_hll()
+    user_sample = new_sample()
+    subj_sample = new_sample()
+    # and the most prolific users (see topk.py)
+    user_top    = new_space_saving(default_capacity_per_k * top_n)
+    n_class_tot = 0
+
+    the_chunks = iter(the_chunks)
+    while True:
+        with stage(profile, 'read') as the_stage:
+            chunk = next(the_chunks, None)
+            the_stage['rows'] = 0 if chunk is None else len(chunk)
+        if chunk is None:
+            break
+
+        with stage(profile, 'sketch', len(chunk)):
+            # each distinct user and subject in the chunk is only hashed once
+            user_code, chunk_users = pd.factorize(chunk.user_name.values)
+            user_hashes = hash_strings(chunk_users)
+            hll_add(user_hll, user_hashes)
+            chunk_nclass = np.bincount(user_code, minlength=len(chunk_users))
+            # (the sample keeps which of its users are registered, for the registered/unregistered split)
+            user_sample = sample_add(user_sample, user_hashes, chunk_nclass, is_registered(chunk_users))
+            user_top = space_saving_add(user_top, chunk_users, chunk_nclass)
+
+            # (subjects with no id are counted together, as -1, same as the exact counts)
+            subject_code, subject_ids, n_subject_fallback = encode_subjects(chunk.subject_data.values)
+            chunk_subj_class = subject_counts(subject_code)
+            subj_hashes = hash_ints(np.r_[subject_ids, -1][:len(chunk_subj_class)])
+            hll_add(subj_hll, subj_hashes)
+            subj_sample = sample_add(subj_sample, subj_hashes, chunk_subj_class)
+
+        n_class_tot += len(chunk)
+        if progress is not None:
+            progress(n_class_tot)
+    if progress is not None:
+        progress(n_class_tot, n_class_tot)
+
+    return {'n_class_tot': n_class_tot, 'user_hll': user_hll, 'subj_hll': subj_hll,
+            'user_sample': user_sample, 'subj_sample': subj_sample, 'user_top': user_top}
+
+
+
+# All the stats below, for the counts of classifications by each user (nclass_byuser, a Series
+# indexed by user name) and of each subject (subj_class). Returns a dict, with the inequality
+# stats (see inequality.py) as nclass_ineq.
+def project_stats(nclass_byuser, subj_class, user_registered, top_n=default_k):
+    the_stats = {}
+    the_stats['n_class_tot'] = nclass_byuser.sum()
+    the_stats['n_subj_tot']  = len(subj_class)
+
+    # basic stats on how classified the subjects are
+    the_stats['subj_class_mean'] = np.mean(subj_class)
+    the_stats['subj_class_med']  = np.median(subj_class)
+    the_stats['subj_class_min']  = np.min(subj_class)
+    the_stats['subj_class_max']  = np.max(subj_class)
+
+    # get total user counts
+    the_stats['n_users_tot'] = len(nclass_byuser)
+
+    the_stats['n_reg']   = int(np.sum(user_registered))
+    the_stats['n_unreg'] = the_stats['n_users_tot'] - the_stats['n_reg']
+
+    # the leaderboard (without sorting everyone; see topk.py)
+    the_stats['nclass_byuser_ranked'] = top_k_series(nclass_byuser, top_n)
+
+    # very basic stats
+    the_stats['nclass_med']  = np.median(nclass_byuser)
+    the_stats['nclass_mean'] = np.mean(nclass_byuser)
+
+    # Gini coefficient - see the comments in inequality.py for more notes
+    # (the Lorenz curve and the top classifiers' shares come from the same sort of the counts)
+    the_stats['nclass_ineq'] = inequality_stats(nclass_byuser.values)
+    the_stats['nclass_gini'] = the_stats['nclass_ineq']['gini']
+    return the_stats
+
+
+
+# The project_stats() of each partition (with --by): each partition's counts are a slice of the
+# arrays from counts_by_partition(). Returns a list of (label, stats) pairs.
+def partition_stats(counts, partition_by, top_n=default_k):
+    the_parts, the_users, the_counts = counts['partition_users']
+    the_subject_counts = counts['partition_subjects'][2]
+    all_users = counts['all_users']
+    the_results = []
+    for the_key, the_slice, the_subject_slice in zip(counts['partition_keys'], partition_slices(the_parts, len(counts['partition_keys'])),
+                                                     partition_slices(counts['partition_subjects'][0], len(counts['partition_keys']))):
+        the_results.append((partition_label(the_key, partition_by),
+                            project_stats(pd.Series(the_counts[the_slice], index=pd.Index(all_users[the_users[the_slice]], name='user_name')),
+                                          the_subject_counts[the_subject_slice], counts['user_registered'][the_users[the_slice]], top_n)))
+    return the_results
+
+
+
+# Everything the script works out, from the counts (see above): a dict with overall (from
+# project_stats()), first_class_day and last_class_day, and with partition_by, partitions
+# (from partition_stats()).
+def analyze(counts, partition_by=None, top_n=default_k):
+    the_results = {'first_class_day': counts['first_class_day'],
+                   'last_class_day':  counts['last_class_day'],
+                   'overall': project_stats(counts['nclass_byuser'], counts['subj_class'], counts['user_registered'], top_n)}
+    if partition_by is not None:
+        the_results['partitions'] = partition_stats(counts, partition_by, top_n)
+    return the_results
+
+
+
+# The same as analyze(), from a DataFrame that's already been read (with at least the
+# columns_to_read(partition_by)), or from the dict panoptes_io.read_compact() returns
+def analyze_frame(classifications, partition_by=None, top_n=default_k):
+    return analyze(counts_from_frame(classifications, partition_by), partition_by, top_n)
+
+def analyze_compact(compact, partition_by=None, top_n=default_k):
+    return analyze(counts_from_compact(compact, partition_by), partition_by, top_n)
+
+
+
+def print_stats(title, the_stats, top_n=default_k, with_shares=False):
+    print "\n"+title+":\n\n",the_stats['n_class_tot'],"classifications of",the_stats['n_subj_tot'],"subjects by",the_stats['n_users_tot'],"classifiers,"
+    print the_stats['n_reg'],"registered and",the_stats['n_unreg'],"unregistered.\n"
+    print "That's %.2f classifications per subject on average (median = %.1f)." % (the_stats['subj_class_mean'], the_stats['subj_class_med'])
+    print "The most classified subject has ",the_stats['subj_class_max'],"classifications; the least-classified subject has",the_stats['subj_class_min'],".\n"
+    print "Median number of classifications per user:",the_stats['nclass_med']
+    print "Mean number of classifications per user: %.2f" % the_stats['nclass_mean']
+    print "\nTop %d most prolific classifiers:\n" % top_n,the_stats['nclass_byuser_ranked']
+    print "\n\nGini coefficient for classifications by user: %.2f\n" % the_stats['nclass_gini']
+    if with_shares:
+        for the_line in top_share_lines(the_stats['nclass_ineq'], the_stats['n_users_tot']):
+            print the_line
+        print ""
+
+
+# The same, as far as it can be, from the sketches that --approx keeps (see sketches.py), with
+# the 95% error bounds.
+# the number of distinct things in an HLL and its 95% relative error (1.96 standard errors),
+# unless the sample of them has everything in it, in which case it's exact
+def approx_distinct(hll, sample):
+    if sample_is_complete(sample):
+        return len(sample['counts']), 0.
+    the_count, the_err = hll_count(hll)
+    return the_count, 1.96 * the_err
+
+def approx_range(is_exact, lo, hi):
+    return "exact" if is_exact else "95%%: %g to %g" % (lo, hi)
+
+# The numbers of registered and unregistered users, with their 95% ranges: exact if the sample
+# has every user in it, and otherwise the fraction of the sample that's registered times the
+# number of users. The range takes in both the sample's and the HLL's errors, each at 97.5%,
+# so that both are in their ranges at least 95% of the time.
+def approx_registered(user_hll, user_sample):
+    if sample_is_complete(user_sample):
+        n_reg = int(np.sum(user_sample['flags']))
+        n_unreg = len(user_sample['flags']) - n_reg
+        return {'n_reg': n_reg, 'n_unreg': n_unreg, 'reg_lo': n_reg, 'reg_hi': n_reg, 'unreg_lo': n_unreg, 'unreg_hi': n_unreg}
+    the_confidence = 1. - (1. - default_confidence) / 2.
+    n_users, users_se = hll_count(user_hll)
+    users_err = normal_quantile(0.5 + the_confidence / 2.) * users_se
+    p, p_lo, p_hi = sample_fraction(user_sample, the_confidence)
+    return {'n_reg': p * n_users, 'reg_lo': p_lo * n_users * (1. - users_err), 'reg_hi': p_hi * n_users * (1. + users_err),
+            'n_unreg': (1. - p) * n_users, 'unreg_lo': (1. - p_hi) * n_users * (1. - users_err), 'unreg_hi': (1. - p_lo) * n_users * (1. + users_err)}
+
+# the estimates from the dict sketch_chunks() returns
+def approx_stats(sketches, top_n=default_k):
+    the_stats = {}
+    the_stats['n_users_tot'], the_stats['users_err'] = approx_distinct(sketches['user_hll'], sketches['user_sample'])
+    the_stats['n_subj_tot'], the_stats['subj_err']   = approx_distinct(sketches['subj_hll'], sketches['subj_sample'])
+    the_stats.update(approx_registered(sketches['user_hll'], sketches['user_sample']))
+    the_stats['n_class_tot'] = float(sketches['n_class_tot'])
+
+    # the medians come from the samples
+    the_stats['subj_class_med'], the_stats['subj_class_lo'], the_stats['subj_class_hi'] = sample_quantile(sketches['subj_sample'], 0.5)
+    the_stats['nclass_med'], the_stats['nclass_lo'], the_stats['nclass_hi'] = sample_quantile(sketches['user_sample'], 0.5)
+
+    # the Gini coefficient of the sample is only a rough guide: the few most prolific users,
+    # who make the biggest difference to it, are unlikely to be in the sample
+    the_stats['nclass_gini'] = inequality_stats(sketches['user_sample']['counts'])['gini']
+
+    the_stats['top'], the_stats['n_top_certain'] = space_saving_top(sketches['user_top'], top_n)
+    the_stats['is_exact'] = sample_is_complete(sketches['user_sample'])
+    the_stats['subj_is_exact'] = sample_is_complete(sketches['subj_sample'])
+    the_stats['n_sample'] = len(sketches['user_sample']['counts'])
+    return the_stats
+
+def print_approx_stats(title, the_stats, top_n=default_k):
+    n_class_tot, n_subj_tot, n_users_tot = the_stats['n_class_tot'], the_stats['n_subj_tot'], the_stats['n_users_tot']
+    subj_err, users_err = the_stats['subj_err'], the_stats['users_err']
+    print "\n"+title+" (approximate):\n\n","%d classifications of about %.0f subjects (+/- %.1f%%) by about %.0f classifiers (+/- %.1f%%)," % (n_class_tot, n_subj_tot, 100. * subj_err, n_users_tot, 100. * users_err)
+    if the_stats['is_exact']:
+        print "%d registered and %d unregistered (exact).\n" % (the_stats['n_reg'], the_stats['n_unreg'])
+    else:
+        print "about %.0f registered (95%%: %.0f to %.0f) and %.0f unregistered (95%%: %.0f to %.0f).\n" % (the_stats['n_reg'],
+                    the_stats['reg_lo'], the_stats['reg_hi'], the_stats['n_unreg'], the_stats['unreg_lo'], the_stats['unreg_hi'])
+    print "That's %.2f classifications per subject on average (%.2f to %.2f), median = %.1f (%s)." % (n_class_tot / n_subj_tot,
+                n_class_tot / (n_subj_tot * (1. + subj_err)), n_class_tot / (n_subj_tot * (1. - subj_err)), the_stats['subj_class_med'],
+                approx_range(the_stats['subj_is_exact'], the_stats['subj_class_lo'], the_stats['subj_class_hi']))
+    print "Median number of classifications per user: %.1f (%s)" % (the_stats['nclass_med'],
+                approx_range(the_stats['is_exact'], the_stats['nclass_lo'], the_stats['nclass_hi']))
+    print "Mean number of classifications per user: %.2f (%.2f to %.2f)" % (n_class_tot / n_users_tot,
+                n_class_tot / (n_users_tot * (1. + users_err)), n_class_tot / (n_users_tot * (1. - users_err)))
+
+    print "\nTop %d most prolific classifiers (each did between at_least and n_class classifications):\n" % top_n,the_stats['top']
+    if the_stats['n_top_certain'] < len(the_stats['top']):
+        print "(only %d of them are certainly in the real top %d)" % (the_stats['n_top_certain'], top_n)
+    if the_stats['is_exact']:
+        print "\nGini coefficient for classifications by user: %.2f\n" % the_stats['nclass_gini']
+    else:
+        print "\nGini coefficient for classifications by user, from a sample of %d classifiers: %.2f (rough)\n" % (the_stats['n_sample'], the_stats['nclass_gini'])
+
+
+
+def print_usage(script_name):
+    print "\nUsage: "+script_name+" classifications_infile [--stream [--chunksize N]] [--cache] [--lorenz lorenz_outfile] [--shares] [--profile] [--profile-json json_outfile] [--progress] [--by workflow_id|workflow_version] [--approx] [--top K] [--workers N]"
+    print "      classifications_infile is a Zooniverse (Panoptes) classifications data export CSV."
+    print "      --stream reads the classifications file in chunks of N rows (default "+str(default_chunksize)+")"
+    print "           and keeps only running totals, so memory use depends on the chunk size and"
+    print "           the number of users and subjects, not on the size of the file."
+    print "      --cache keeps a parsed copy of classifications_infile so it loads much faster next time"
+    print "           (see export_cache.py to list or clear the cache)."
+    print "      --lorenz writes the Lorenz curve of classifications by user (the fraction of all"
+    print "           classifications done by the least prolific fraction of classifiers) to lorenz_outfile."
+    print "      --shares also prints the share of the classifications done by the top 1%, 10% and 50% of"
+    print "           classifiers."
+    print "      --profile prints the wall time, CPU time, memory and rows/s of each stage at the end;"
+    print "           --profile-json also saves them to json_outfile."
+    print "      --progress shows a running count of the rows read so far (with --stream)."
+    print "      --by workflow_id (or workflow_version) prints the stats for each workflow (or each version"
+    print "           of each workflow) as well as for the whole project, all from one read of the file."
+    print "      --approx is a quick check of huge exports: it reads the file in chunks of N rows, like"
+    print "           --stream, but memory use doesn't grow with the number of users or subjects either."
+    print "           The numbers of users and subjects and the medians are estimates, printed with their"
+    print "           95% error bounds (the top classifiers too). Not with --cache, --by, --lorenz or --shares."
+    print "      --top K lists the K most prolific classifiers (default 10). With --approx they're"
+    print "           estimates too, with a lower bound on each count."
+    print "      --workers N parses classifications_infile in N processes at once (default 1; not with"
+    print "           --stream or --approx, or for compressed files)."
+    print "\nAll output will be to stdout (about a paragraph worth).\n"
 
-# Begin the main stuff
-
-
-print "Reading classifications from "+classfile_in
-
-classifications = pd.read_csv(classfile_in)
-
-# first, extract the started_at and finished_at from the annotations column
-classifications['meta_json'] = [json.loads(q) for q in classifications.metadata]
-
-
-classifications['started_at_str']  = [q['started_at']  for q in classifications.meta_json]
-classifications['finished_at_str'] = [q['finished_at'] for q in classifications.meta_json]
-
-classifications['created_day'] = [q[:10] for q in classifications.created_at]
-
-first_class_day = min(classifications.created_day).replace(' ', '')
-last_class_day  = max(classifications.created_day).replace(' ', '')
-
-
-
-# grab the subject counts
-n_subj_tot  = len(classifications.subject_data.unique())
-by_subject = classifications.groupby('subject_data')
-subj_class = by_subject.created_at.aggregate('count')
-
-# basic stats on how classified the subjects are
-subj_class_mean = np.mean(subj_class)
-subj_class_med  = np.median(subj_class)
-subj_class_min  = np.min(subj_class)
-subj_class_max  = np.max(subj_class)
-
-# save processing time and memory in the groupby.apply(); only keep the columns we're going to use
-#classifications = classifications[cols_used]
-
-# index by created_at as a timeseries
-# note: this means things might not be uniquely indexed
-# but it makes a lot of things easier and faster.
-# update: it's not really needed in the main bit, but will do it on each group later.
-#classifications.set_index('created_at_ts', inplace=True)
-
-
-all_users = classifications.user_name.unique()
-by_user = classifications.groupby('user_name')
-
-
-# get total classification and user counts
-n_class_tot = len(classifications)
-n_users_tot = len(all_users)
-
-unregistered = [q.startswith("not-logged-in") for q in all_users]
-n_unreg = sum(unregistered)
-n_reg   = n_users_tot - n_unreg
-
-# for the leaderboard, which I recommend project builders never make public because
-# Just Say No to gamification
-# But it's still interesting to see who your most prolific classifiers are, and
-# e.g. whether they're also your most prolific Talk users
-nclass_byuser = by_user.created_at.aggregate('count')
-nclass_byuser_ranked = nclass_byuser.copy()
-nclass_byuser_ranked.sort(ascending=False)
-
-# very basic stats
-nclass_med    = np.median(nclass_byuser)
-nclass_mean   = np.mean(nclass_byuser)
 
-# Gini coefficient - see the comments above the gini() function for more notes
-nclass_gini   = gini(nclass_byuser)
 
-print "\nOverall:\n\n",n_class_tot,"classifications of",n_subj_tot,"subjects by",n_users_tot,"classifiers,"
-print n_reg,"registered and",n_unreg,"unregistered.\n"
-print "That's %.2f classifications per subject on average (median = %.1f)." % (subj_class_mean, subj_class_med)
-print "The most classified subject has ",subj_class_max,"classifications; the least-classified subject has",subj_class_min,".\n"
-print "Median number of classifications per user:",nclass_med
-print "Mean number of classifications per user: %.2f" % nclass_mean
-print "\nTop 10 most prolific classifiers:\n",nclass_byuser_ranked.head(10)
-print "\n\nGini coefficient for classifications by user: %.2f\n" % nclass_gini
+# The command line version (argv is sys.argv, or the same kind of list). It prints the stats
+# and returns the dict from analyze() (or, with --approx, a dict with overall from
+# approx_stats()). Without a classifications_infile it prints the usage and returns None.
+# If the options don't make sense it raises ValueError, saying why, before reading anything.
+def main(argv=None):
+    argv = list(sys.argv if argv is None else argv)
+
+    # optional flags can go anywhere on the command line, so take them out first
+    # --stream reads the file a chunk at a time instead of all at once
+    stream_mode = pop_flag(argv, '--stream')
+    # --cache keeps a parsed copy of the file so the next run (of this or sessions_inproj_byuser.py) is faster
+    use_cache   = pop_flag(argv, '--cache')
+    chunksize   = pop_option(argv, '--chunksize', default_chunksize, int)
+    # --lorenz file.csv writes the Lorenz curve of classifications by user
+    lorenz_out  = pop_option(argv, '--lorenz')
+    # --shares also prints the share of the classifications done by the top 1%, 10% and 50% of classifiers
+    show_shares = pop_flag(argv, '--shares')
+    # --profile prints the time, memory etc. of each stage at the end, and --profile-json file saves it
+    # --progress shows how much of the file has been read so far (with --stream)
+    profile_json  = pop_option(argv, '--profile-json')
+    show_profile  = pop_flag(argv, '--profile') or profile_json is not None
+    show_progress = pop_flag(argv, '--progress')
+    # --by workflow_id (or workflow_version) also gives all the stats for each workflow (or version)
+    partition_by  = pop_option(argv, '--by')
+    # --approx reads the file in chunks like --stream, but only keeps fixed-size sketches of the
+    # users and subjects, and prints estimates (with error bounds) instead of exact numbers
+    approx_mode   = pop_flag(argv, '--approx')
+    # --top K lists the K most prolific classifiers instead of 10
+    top_n         = pop_option(argv, '--top', default_k, int)
+    # --workers N parses the file in N processes at once
+    workers       = pop_option(argv, '--workers', 1, int)
+
+    # file with raw classifications (csv)
+    try:
+        classfile_in = argv[1]
+    except:
+        #classfile_in = 'data/2e3d12a2-56ca-4d1f-930a-9ecc7fd39885.csv'
+        print_usage(argv[0])
+        return None
+
+    if partition_by is not None and partition_by not in partition_columns:
+        raise ValueError("--by can only be " + ' or '.join(sorted(partition_columns)))
+
+    if approx_mode and (use_cache or partition_by is not None or lorenz_out is not None or show_shares):
+        raise ValueError("--approx can't be used with --cache, --by, --lorenz or --shares.")
+
+    if workers > 1 and (stream_mode or approx_mode):
+        raise ValueError("--workers can't be used with --stream or --approx.")
+
+
+    # Print out the input parameters just as a sanity check
+    print "Computing project stats using:"
+    print "   infile:",classfile_in
+    if partition_by is not None:
+        print "   split by",partition_by
+
+
+    # Begin the main stuff
+
+    # the time & memory used by each stage, if we're keeping track (see stage_profiler.py)
+    profile = new_profile(argv[0]) if show_profile else None
+
+    print "Reading classifications from "+classfile_in
+
+    progress = progress_printer('reading', 'rows') if show_progress else None
+    if approx_mode:
+        sketches = sketch_chunks(read_classifications(classfile_in, cols_read, chunksize=chunksize), top_n, profile, progress)
+    elif use_cache:
+        # the parsed copy of the file that's shared with sessions_inproj_byuser.py (see export_cache.py)
+        classifications, from_cache = read_compact_cached(classfile_in, profile, workers)
+        if from_cache:
+            print "  (read from the cache)"
+        counts = counts_from_compact(classifications, partition_by, profile)
+    elif stream_mode:
+        counts = counts_from_chunks(read_classifications(classfile_in, columns_to_read(partition_by), chunksize=chunksize),
+                                    partition_by, profile, progress)
+    elif workers > 1:
+        # each worker turns its part of the file into user and subject codes itself, so only
+        # those come back (see panoptes_io.read_compact())
+        counts = counts_from_compact(read_compact(classfile_in, profile, workers), partition_by, profile)
+    else:
+        with stage(profile, 'read') as the_stage:
+            classifications = read_classifications(classfile_in, columns_to_read(partition_by))
+            the_stage['rows'] = len(classifications)
+        counts = counts_from_frame(classifications, partition_by, profile)
+
+
+    if approx_mode:
+        the_results = {'overall': approx_stats(sketches, top_n)}
+        print_approx_stats("Overall", the_results['overall'], top_n)
+    else:
+        the_results = analyze(counts, partition_by, top_n)
+        print_stats("Overall", the_results['overall'], top_n, show_shares)
+
+    if lorenz_out is not None:
+        print "Writing the Lorenz curve of classifications by user to",lorenz_out
+        write_lorenz_csv(lorenz_out, the_results['overall']['nclass_ineq'])
+
+    if partition_by is not None:
+        for the_label, the_stats in the_results['partitions']:
+            print_stats(the_label, the_stats, top_n, show_shares)
+
+
+    if profile is not None:
+        print "\nTime and memory used by each stage:\n"
+        print format_profile(profile)
+        if profile_json is not None:
+            write_profile_json(profile, profile_json)
+            print "\n(saved to",profile_json+")"
+
+    return the_results
+
+
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except ValueError as the_error:
+        print "\n%s\n" % the_error
+        sys.exit(1)
 
 
 # That's it. This program is very basic.
@@ -0,0 +1,235 @@
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# The session stats for a whole batch of project exports at once (e.g. every project, every
+# night), plus a summary of all of them side by side.
+#
+# Running sessions_inproj_byuser.py once per export means starting python and importing
+# numpy and pandas (and everything here) every time, which for small projects takes longer
+# than the stats themselves. Here everything is imported once, the worker processes are forked
+# from this one with it all already loaded, and each runs the script's main() for one export
+# after another. The exports are handed out biggest first: the run can't
+# finish before the biggest one does, so starting it last would leave the other workers idle
+# at the end.
+#
+# Each project gets a directory of its own in out_dir, named after the export, holding the
+# usual session_stats_[date]_to_[date].csv and a log of what the script printed. The summary
+# has one row per project with the totals, medians and Gini coefficient that
+# basic_project_stats.py prints, and an "All projects" row with everything put together
+# (classifiers are matched up by user name across projects). It's printed and also written to
+# out_dir/batch_summary.csv.
+#
+# A project that fails doesn't stop the others; its row just has the error.
+#
+# Usage:
+#   python batch_stats.py exports out_dir [--workers N] [--break minutes]
+# where exports is a directory of exports (anything ending in .csv, or .csv.gz etc., or .zip)
+# or a text file listing them, one per line (blank lines and lines starting with # are
+# skipped; relative paths are relative to the list).
+
+import sys
+import os
+import time
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from cmdline_flags import pop_option
+from panoptes_io import subject_counts, is_registered
+from inequality import inequality_stats
+from stage_profiler import progress_printer
+import sessions_inproj_byuser
+
+
+default_break = sessions_inproj_byuser.default_break
+
+# what counts as an export in a directory (see compressed_input.py)
+export_suffixes = ('.csv', '.csv.gz', '.csv.bz2', '.csv.xz', '.csv.zst', '.zip')
+
+summary_columns = ['file', 'n_class', 'n_subjects', 'n_users', 'n_registered', 'n_unregistered',
+                   'subj_class_mean', 'subj_class_median', 'nclass_median', 'nclass_mean', 'gini',
+                   'first_day', 'last_day', 'statsfile', 'wall_s', 'error']
+
+
+
+# The exports listed in the_exports (a directory, or a file listing them; see above), as
+# absolute paths.
+def list_exports(the_exports):
+    if os.path.isdir(the_exports):
+        the_names = sorted(q for q in os.listdir(the_exports) if q.lower().endswith(export_suffixes))
+        return [os.path.abspath(os.path.join(the_exports, q)) for q in the_names]
+
+    list_dir = os.path.dirname(os.path.abspath(the_exports))
+    the_files = []
+    with open(the_exports) as f:
+        for the_line in f:
+            the_line = the_line.strip()
+            if the_line and not the_line.startswith('#'):
+                the_files.append(os.path.abspath(os.path.join(list_dir, the_line)))
+    return the_files
+
+
+
+# A name for each export's project (its file name without .csv, .gz etc.), with _2, _3, ...
+# added to any that turn up more than once.
+def project_names(the_files):
+    the_names = []
+    n_seen = {}
+    for the_file in the_files:
+        the_name = os.path.basename(the_file)
+        for the_suffix in export_suffixes:
+            if the_name.lower().endswith(the_suffix):
+                the_name = the_name[:-len(the_suffix)]
+                break
+        n_seen[the_name] = n_seen.get(the_name, 0) + 1
+        the_names.append(the_name if n_seen[the_name] == 1 else '%s_%d' % (the_name, n_seen[the_name]))
+    return the_names
+
+
+
+# Run sessions_inproj_byuser.main() on one export, in this process, with what it prints going to
+# a log in project_dir. Returns the project's row of the summary, plus its classification
+# count for each user and for each subject (for the "All projects" row).
+def run_export(the_args):
+    classfile_in, project_dir, session_break = the_args
+    if not os.path.isdir(project_dir):
+        os.makedirs(project_dir)
+    # (named as the script names it when no stats_outfile is given)
+    statsfile_out = os.path.join(project_dir, sessions_inproj_byuser.default_statsfile)
+    the_row = {'file': classfile_in, 'error': ''}
+
+    old_stdout = sys.stdout
+    t0 = time.time()
+    try:
+        with open(os.path.join(project_dir, 'log.txt'), 'w') as the_log:
+            sys.stdout = the_log
+            try:
+                the_run = sessions_inproj_byuser.main(sessions_inproj_byuser.main_args(classfile_in, statsfile_out, True, session_break))
+            except Exception as the_error:
+                the_run = None
+                the_row['error'] = "%s: %s" % (type(the_error).__name__, the_error)
+    finally:
+        sys.stdout = old_stdout
+    the_row['wall_s'] = round(time.time() - t0, 3)
+    if the_run is None:
+        return the_row, None, None
+
+    overall = the_run['overall']
+    subj_class = subject_counts(the_run['classifications']['subject_code'])
+    the_row.update({'n_class': overall['n_class_tot'],
+                    'n_subjects': overall['n_subj_tot'],
+                    'n_users': overall['n_users_tot'],
+                    'n_registered': overall['n_reg'],
+                    'n_unregistered': overall['n_unreg'],
+                    'subj_class_mean': np.mean(subj_class),
+                    'subj_class_median': np.median(subj_class),
+                    'nclass_median': overall['nclass_med'],
+                    'nclass_mean': overall['nclass_mean'],
+                    'gini': overall['nclass_gini'],
+                    'first_day': the_run['first_class_day'],
+                    'last_day': the_run['last_class_day'],
+                    'statsfile': the_run['statsfile_out']})
+    return the_row, overall['nclass_byuser'], subj_class
+
+
+
+# The "All projects" row: the same stats over every project's classifications at once, with
+# each classifier counted once however many projects they classified on.
+def combined_row(all_nclass, all_subj_class):
+    nclass_byuser = pd.concat(all_nclass).groupby(level=0).sum()
+    subj_class = np.concatenate(all_subj_class)
+    n_reg = int(np.sum(is_registered(nclass_byuser.index)))
+    return {'file': '',
+            'n_class': int(nclass_byuser.sum()),
+            'n_subjects': len(subj_class),
+            'n_users': len(nclass_byuser),
+            'n_registered': n_reg,
+            'n_unregistered': len(nclass_byuser) - n_reg,
+            'subj_class_mean': np.mean(subj_class),
+            'subj_class_median': np.median(subj_class),
+            'nclass_median': np.median(nclass_byuser.values),
+            'nclass_mean': np.mean(nclass_byuser.values),
+            'gini': inequality_stats(nclass_byuser.values)['gini'],
+            'error': ''}
+
+
+
+# Run all the exports in the_files on workers processes (or in this one, for 1), biggest first,
+# with the output for each in a directory of out_dir named after it. Returns the summary as a
+# DataFrame (see above), indexed by project, in the same order as the_files.
+def run_batch(the_files, out_dir, workers, session_break=default_break, progress=None):
+    the_names = project_names(the_files)
+    the_args = [(q, os.path.join(out_dir, r), session_break) for q, r in zip(the_files, the_names)]
+    biggest_first = sorted(range(len(the_files)), key=lambda i: -os.path.getsize(the_files[i]))
+
+    the_results = {}
+    def add_result(i, the_result):
+        the_results[i] = the_result
+        if progress is not None:
+            progress(len(the_results), len(the_files))
+
+    if workers <= 1:
+        for i in biggest_first:
+            add_result(i, run_export(the_args[i]))
+    else:
+        # (one export at a time each, so the next biggest goes to whichever worker is free first)
+        pool = multiprocessing.Pool(workers)
+        try:
+            the_jobs = [(i, pool.apply_async(run_export, (the_args[i],))) for i in biggest_first]
+            for i, the_job in the_jobs:
+                add_result(i, the_job.get())
+        finally:
+            pool.close()
+            pool.join()
+
+    the_rows = [the_results[i][0] for i in range(len(the_files))]
+    the_index = list(the_names)
+    all_nclass = [the_results[i][1] for i in range(len(the_files)) if the_results[i][1] is not None]
+    if len(all_nclass) > 0:
+        the_rows.append(combined_row(all_nclass, [the_results[i][2] for i in range(len(the_files)) if the_results[i][2] is not None]))
+        the_index.append('All projects')
+    return pd.DataFrame(the_rows, index=pd.Index(the_index, name='project'), columns=summary_columns)
+
+
+
+
+if __name__ == '__main__':
+    workers       = pop_option(sys.argv, '--workers', multiprocessing.cpu_count(), int)
+    session_break = pop_option(sys.argv, '--break', default_break, float)
+    try:
+        the_exports = sys.argv[1]
+        out_dir     = sys.argv[2]
+    except:
+        print "\nUsage: " + sys.argv[0] + " exports out_dir [--workers N] [--break minutes]"
+        print "      exports is a directory of Zooniverse (Panoptes) classification exports (.csv, or"
+        print "           compressed), or a text file listing them, one per line."
+        print "      out_dir gets a directory for each export with its session stats (named as"
+        print "           sessions_inproj_byuser.py names them) and log, and batch_summary.csv, the"
+        print "           totals, medians and Gini coefficient of each project and of all of them together."
+        print "      --workers N runs N exports at once (default: the number of CPUs), biggest first."
+        print "      --break is the session break in minutes (default %g), passed on to" % default_break
+        print "           sessions_inproj_byuser.py as it is (e.g. 0.5), so it means the same there."
+        sys.exit(0)
+
+    the_files = list_exports(the_exports)
+    if len(the_files) == 0:
+        print "\nNo exports found in %s\n" % the_exports
+        sys.exit(1)
+    the_missing = [q for q in the_files if not os.path.isfile(q)]
+    if len(the_missing) > 0:
+        print "\nCan't find %s\n" % ', '.join(the_missing)
+        sys.exit(1)
+
+    print "Computing session stats for %d exports with %d worker processes, into %s" % (len(the_files), workers, out_dir)
+    t0 = time.time()
+    summary = run_batch(the_files, out_dir, workers, session_break, progress_printer('exports', 'exports'))
+    print "\nAll done in %.1f s.\n" % (time.time() - t0)
+
+    summary_out = os.path.join(out_dir, 'batch_summary.csv')
+    summary.to_csv(summary_out)
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        print summary[['n_class', 'n_subjects', 'n_users', 'n_registered', 'subj_class_median', 'nclass_median', 'gini', 'wall_s']]
+    for the_project, the_error in zip(summary.index, summary['error']):
+        if isinstance(the_error, str) and the_error:
+            print "\n%s failed: %s" % (the_project, the_error)
+    print "\nWrote the summary to %s" % summary_out
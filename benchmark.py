@@ -0,0 +1,273 @@
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# Benchmarks for basic_project_stats.py and sessions_inproj_byuser.py, so we can tell whether
+# a change made them faster or slower (and on what size of file).
+#
+# For each export (either given with --input, or made by synthetic_export.py at each of the
+# sizes in --rows and kept in --workdir for next time) this:
+#   1. runs each stage of the scripts' work (reading the CSV, decoding the metadata, parsing
+#      the timestamps, coding the users & subjects, the session stats, writing the output,
+#      and the per-user counts & Gini) one after another in a fresh python process, recording
+#      the wall time, CPU time, resident memory afterwards, peak memory so far and rows/s
+#      for each
+#   2. runs the scripts themselves, start to finish, recording their wall time and peak memory
+# and appends one JSON line per export to results_file, with the git commit, python/numpy/pandas
+# versions and the machine, so results from different versions of the code can be compared.
+# It then prints each timing next to the previous result in the file for the same export
+# size (if there is one), with the ratio.
+#
+# Usage:
+#   python benchmark.py results_file [--rows 1e5,1e6] [--input export.csv] [--workdir dir]
+#                       [--label text] [--workers N]
+
+import sys
+import os
+import json
+import time
+import socket
+import tempfile
+import platform
+import subprocess
+
+import numpy as np
+import pandas as pd
+
+from cmdline_flags import pop_flag, pop_option
+from stage_profiler import current_rss_mb, maxrss_mb, peak_rss_mb
+
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+default_rows = '1e5,1e6'
+
+
+
+# Run the_function() and return what it returns, plus a dict of how long it took etc.
+def measure(name, n_rows, the_function, *args):
+    cpu0 = sum(os.times()[:2])
+    t0 = time.time()
+    the_result = the_function(*args)
+    wall = time.time() - t0
+    cpu = sum(os.times()[:2]) - cpu0
+    the_stage = {'stage': name,
+                 'wall_s': round(wall, 4),
+                 'cpu_s': round(cpu, 4),
+                 'rss_mb': current_rss_mb(),
+                 'peak_rss_mb': peak_rss_mb(),
+                 'rows_per_s': round(n_rows / wall, 1) if wall > 0 else None}
+    return the_result, the_stage
+
+
+
+# what each stage does, for stages() below
+def write_output(session_stats, user_names, the_outfile):
+    import session_engine
+    session_engine.sessionstats_to_frame(session_stats, user_names).to_csv(the_outfile)
+
+def user_inequality(user_code):
+    from inequality import inequality_stats
+    return inequality_stats(np.bincount(user_code))
+
+# the stages panoptes_io.compact_from_frame() records in its profile, and what they're called here
+compact_stages = [('metadata decode', 'metadata'), ('timestamp parse', 'timestamps'), ('factorize', 'factorize')]
+
+
+
+# The stages of the two scripts, one after the other, on classfile_in. Each stage is the
+# scripts' own code (reading, panoptes_io.compact_from_frame(), which decodes the metadata,
+# parses the timestamps and codes the users and subjects, the session engine, ...), so this
+# times what they really do.
+# (This is what the child process runs; see run_stages().)
+def stages(classfile_in):
+    from panoptes_io import read_classifications, compact_from_frame, compact_cols_read
+    from stage_profiler import new_profile
+    import session_engine
+    import basic_project_stats
+
+    results = []
+    # basic_project_stats.py reads fewer columns and just counts things
+    basic, the_stage = measure('basic:read', 0, read_classifications, classfile_in, basic_project_stats.columns_to_read())
+    n_rows = len(basic)
+    the_stage['rows_per_s'] = round(n_rows / the_stage['wall_s'], 1) if the_stage['wall_s'] > 0 else None
+    results.append(the_stage)
+    _, the_stage = measure('basic:count', n_rows, basic_project_stats.counts_from_frame, basic)
+    results.append(the_stage)
+    del basic
+
+    classifications, the_stage = measure('read', n_rows, read_classifications, classfile_in, compact_cols_read)
+    results.append(the_stage)
+    # (compact_from_frame() times its own stages)
+    profile = new_profile()
+    compact = compact_from_frame(classifications, profile)
+    for the_name, our_name in compact_stages:
+        the_stage = [q for q in profile['stages'] if q['stage'] == the_name][0]
+        results.append({'stage': our_name,
+                        'wall_s': round(the_stage['wall_s'], 4),
+                        'cpu_s': round(the_stage['cpu_s'], 4),
+                        'rss_mb': the_stage['rss_mb'],
+                        'peak_rss_mb': the_stage['peak_rss_mb'],
+                        'rows_per_s': round(the_stage['rows_per_s'], 1) if the_stage['rows_per_s'] is not None else None})
+    del classifications
+
+    # (the user id is only kept once per user, as in sessions_inproj_byuser.session_stats())
+    session_stats, the_stage = measure('sessions', n_rows, session_engine.sessionstats_arrays,
+                                       compact['user_code'], compact['created_at'], compact['started_at'], compact['finished_at'], None, 60.)
+    session_stats['user_id'] = compact['user_ids'][session_stats['user_code']]
+    results.append(the_stage)
+    the_outfile = tempfile.mktemp(suffix='.csv')
+    try:
+        _, the_stage = measure('write', n_rows, write_output, session_stats, compact['user_names'], the_outfile)
+    finally:
+        if os.path.exists(the_outfile):
+            os.remove(the_outfile)
+    results.append(the_stage)
+    _, the_stage = measure('inequality', n_rows, user_inequality, compact['user_code'])
+    results.append(the_stage)
+
+    return n_rows, results
+
+
+
+# Run stages() in a new python process, so each export starts from the same (empty) memory
+def run_stages(classfile_in):
+    the_output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--run-stages', classfile_in], cwd=script_dir)
+    if not isinstance(the_output, str):
+        the_output = the_output.decode('utf-8')
+    return json.loads(the_output.strip().splitlines()[-1])
+
+
+
+# Run one of the scripts start to finish and return its wall time and peak memory
+def run_script(name, the_args):
+    with open(os.devnull, 'w') as devnull:
+        t0 = time.time()
+        the_process = subprocess.Popen([sys.executable] + the_args, cwd=script_dir, stdout=devnull, stderr=devnull)
+        if hasattr(os, 'wait4'):
+            _, the_status, the_usage = os.wait4(the_process.pid, 0)
+            peak = maxrss_mb(the_usage)
+        else:
+            the_status = the_process.wait()
+            peak = None
+        wall = time.time() - t0
+    return {'script': name, 'wall_s': round(wall, 4), 'peak_rss_mb': peak, 'ok': the_status == 0}
+
+
+
+def git_commit():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            the_commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=script_dir, stderr=devnull)
+        return the_commit.decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+
+def benchmark_file(classfile_in, label, workers):
+    # (the scripts are run from their own directory)
+    classfile_in = os.path.abspath(classfile_in)
+    n_rows, the_stages = run_stages(classfile_in)
+
+    the_outfile = tempfile.mktemp(suffix='.csv')
+    try:
+        the_scripts = [run_script('basic_project_stats', ['basic_project_stats.py', classfile_in]),
+                       run_script('basic_project_stats --stream', ['basic_project_stats.py', classfile_in, '--stream']),
+                       run_script('sessions_inproj_byuser', ['sessions_inproj_byuser.py', classfile_in, the_outfile, '0', '60'])]
+        if workers > 1:
+            the_scripts.append(run_script('sessions_inproj_byuser --workers %d' % workers,
+                                          ['sessions_inproj_byuser.py', classfile_in, the_outfile, '0', '60', '--workers', str(workers)]))
+    finally:
+        if os.path.exists(the_outfile):
+            os.remove(the_outfile)
+
+    return {'when': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'label': label,
+            'commit': git_commit(),
+            'host': socket.gethostname(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'input': os.path.abspath(classfile_in),
+            'file_mb': round(os.path.getsize(classfile_in) / 1048576., 1),
+            'n_rows': n_rows,
+            'stages': the_stages,
+            'scripts': the_scripts}
+
+
+
+# the last result in results_file for the same number of rows (None if there isn't one)
+def previous_result(results_file, n_rows):
+    the_previous = None
+    if os.path.isfile(results_file):
+        with open(results_file) as f:
+            for the_line in f:
+                if the_line.strip():
+                    the_result = json.loads(the_line)
+                    if the_result['n_rows'] == n_rows:
+                        the_previous = the_result
+    return the_previous
+
+
+
+def print_comparison(the_result, the_previous):
+    print "\n%d rows (%.1f MB), commit %s:" % (the_result['n_rows'], the_result['file_mb'], the_result['commit'])
+    if the_previous is not None:
+        print "  compared with commit %s (%s, %s)" % (the_previous['commit'], the_previous['when'], the_previous['label'] or 'no label')
+    old_times = {}
+    if the_previous is not None:
+        old_times = dict([(q['stage'], q['wall_s']) for q in the_previous['stages']] + [(q['script'], q['wall_s']) for q in the_previous['scripts']])
+    print "  %-40s %10s %10s %10s %7s" % ('', 'wall (s)', 'peak (MB)', 'was (s)', 'ratio')
+    for name, wall, peak in [(q['stage'], q['wall_s'], q['peak_rss_mb']) for q in the_result['stages']] + \
+                            [(q['script'], q['wall_s'], q['peak_rss_mb']) for q in the_result['scripts']]:
+        old = old_times.get(name)
+        print "  %-40s %10.3f %10s %10s %7s" % (name, wall, '%.0f' % peak if peak is not None else '-',
+                                                 '%.3f' % old if old is not None else '-',
+                                                 '%.2f' % (wall / old) if old else '-')
+
+
+
+
+if __name__ == '__main__':
+    if pop_flag(sys.argv, '--run-stages'):
+        n_rows, the_stages = stages(sys.argv[1])
+        print json.dumps([n_rows, the_stages])
+        sys.exit(0)
+
+    the_rows   = pop_option(sys.argv, '--rows', default_rows)
+    the_input  = pop_option(sys.argv, '--input')
+    workdir    = pop_option(sys.argv, '--workdir', 'benchmark_data')
+    label      = pop_option(sys.argv, '--label', '')
+    workers    = pop_option(sys.argv, '--workers', 1, int)
+    try:
+        results_file = sys.argv[1]
+    except:
+        print "\nUsage: " + sys.argv[0] + " results_file [--rows 1e5,1e6] [--input export.csv] [--workdir dir] [--label text] [--workers N]"
+        print "      results_file gets one line of JSON added to it per export benchmarked."
+        print "      --rows is a comma-separated list of sizes of synthetic exports to make and time (default " + default_rows + ")"
+        print "      --input times a real export instead."
+        print "      --workdir is where the synthetic exports are kept between runs (default benchmark_data)."
+        print "      --label is a note to save with the results, e.g. what you changed."
+        print "      --workers N also times sessions_inproj_byuser.py --workers N.\n"
+        sys.exit(0)
+
+    if the_input is not None:
+        the_files = [the_input]
+    else:
+        from synthetic_export import write_export
+        if not os.path.isdir(workdir):
+            os.makedirs(workdir)
+        the_files = []
+        for n_rows in [int(float(q)) for q in the_rows.split(',')]:
+            the_file = os.path.join(workdir, 'synthetic_%d.csv' % n_rows)
+            if not os.path.isfile(the_file):
+                print "Making a synthetic export with %d classifications: %s" % (n_rows, the_file)
+                write_export(the_file + '.tmp', n_rows)
+                os.rename(the_file + '.tmp', the_file)
+            the_files.append(the_file)
+
+    for the_file in the_files:
+        print "Benchmarking " + the_file + " ..."
+        the_result = benchmark_file(the_file, label, workers)
+        the_previous = previous_result(results_file, the_result['n_rows'])
+        with open(results_file, 'a') as f:
+            f.write(json.dumps(the_result, sort_keys=True) + '\n')
+        print_comparison(the_result, the_previous)
@@ -0,0 +1,29 @@
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# The scripts here take their main inputs as positional command-line arguments
+# (sys.argv[1], sys.argv[2], ...). Optional extras are given as "--flag" or "--option value"
+# and can go anywhere on the command line; these pull them out of argv before the
+# positional inputs are read, so the positional inputs stay where they always were.
+
+
+# Remove "--flag" from argv if it's there; returns True if it was.
+def pop_flag(argv, flag):
+    if flag in argv:
+        argv.remove(flag)
+        return True
+    return False
+
+
+
+# Remove "--option value" from argv if it's there, and return value (converted with
+# convert, e.g. int or float); returns default if the option isn't there.
+def pop_option(argv, flag, default=None, convert=str):
+    if flag not in argv:
+        return default
+    i = argv.index(flag)
+    try:
+        value = argv[i+1]
+    except IndexError:
+        raise ValueError("%s needs a value" % flag)
+    del argv[i:i+2]
+    return convert(value)
@@ -0,0 +1,347 @@
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# Reading compressed exports (.csv.gz, .csv.bz2, .csv.xz, .csv.zst, or a .zip download with
+# the CSV in it) directly, without unzipping them to disk first (see
+# panoptes_io.read_classifications()).
+#
+# The format is worked out from the first few bytes of the file, not its name. The
+# decompression runs in the background and the decompressed bytes go down an OS pipe to the
+# CSV parser, which just sees an ordinary file. So the parser never waits on the
+# decompression unless the decompression can't keep up, and the pipe (which blocks when it's
+# full) stops the decompression running too far ahead and filling up memory.
+#   gzip, bz2, zip  - a background thread (zlib and bz2 let go of the GIL while they work)
+#   xz              - the same with the lzma module if there is one (python 3, or
+#                     backports.lzma), or else the xz program in a separate process
+#   zstd            - the zstandard module if there is one, or else the zstd program in a
+#                     separate process
+# gzip files made of lots of separate members (e.g. from bgzip, which says how big each one
+# is in its header, so they can be found without decompressing anything) and zstd files made
+# of lots of frames (e.g. from zstd -T0 or pzstd) are decompressed a batch of members/frames
+# at a time by a pool of threads, in order.
+# (bz2 files from pbzip2 are lots of streams too, but their ends can't be found without
+# decompressing them, so they're done one after another.)
+
+import os
+import bz2
+import zlib
+import struct
+import zipfile
+import threading
+import subprocess
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# how much to read or decompress at a time
+block_size = 1 << 20
+
+# threads for gzip members and zstd frames (the parser has a core to itself)
+default_workers = max(1, min(4, multiprocessing.cpu_count() - 1))
+
+# the magic numbers at the start of each kind of file
+magic_numbers = [('gzip', b'\x1f\x8b'), ('bz2', b'BZh'), ('xz', b'\xfd7zXZ\x00'),
+                 ('zstd', b'\x28\xb5\x2f\xfd'), ('zip', b'PK\x03\x04')]
+
+# Linux's F_SETPIPE_SZ, to make the pipe bigger than the default 64 kB
+F_SETPIPE_SZ = 1031
+
+
+
+# 'gzip', 'bz2', 'xz', 'zstd' or 'zip' (or None if it's not compressed)
+def compression_of(classfile_in):
+    with open(classfile_in, 'rb') as f:
+        the_start = f.read(8)
+    for the_name, the_magic in magic_numbers:
+        if the_start.startswith(the_magic):
+            return the_name
+    return None
+
+
+
+# Open classfile_in for reading, decompressing it in the background if it's compressed.
+# Returns None if it isn't (so it can just be read as it is), or else a dict with
+#   file        - a file object to read the decompressed CSV from
+#   compression - which kind of compression it was
+# and the thread or process doing the decompression. Pass it to close_export() afterwards.
+def open_export(classfile_in, workers=default_workers):
+    compression = compression_of(classfile_in)
+    if compression is None:
+        return None
+    the_source = {'compression': compression, 'error': None, 'thread': None, 'process': None}
+
+    if compression == 'xz' and lzma is None:
+        the_source['process'] = decompress_process(['xz', '-dc', classfile_in], compression)
+    elif compression == 'zstd' and zstandard is None:
+        the_source['process'] = decompress_process(['zstd', '-dcq', classfile_in], compression)
+    if the_source['process'] is not None:
+        the_source['file'] = the_source['process'].stdout
+        return the_source
+
+    if compression == 'gzip':
+        the_blocks = gzip_blocks(classfile_in, workers)
+    elif compression == 'bz2':
+        the_blocks = bz2_blocks(classfile_in)
+    elif compression == 'xz':
+        the_blocks = file_blocks(lzma.open(classfile_in, 'rb'))
+    elif compression == 'zstd':
+        the_blocks = zstd_blocks(classfile_in, workers)
+    else:
+        the_blocks = file_blocks(zip_member(classfile_in))
+
+    read_fd, write_fd = os.pipe()
+    try:
+        import fcntl
+        fcntl.fcntl(write_fd, F_SETPIPE_SZ, 4 * block_size)
+    except (ImportError, IOError, OSError):
+        pass
+    the_source['file'] = os.fdopen(read_fd, 'rb')
+    the_source['thread'] = threading.Thread(target=feed_pipe, args=(the_blocks, write_fd, the_source))
+    # (so that a parser that gives up part way through doesn't leave it hanging on to the process)
+    the_source['thread'].daemon = True
+    the_source['thread'].start()
+    return the_source
+
+
+
+# Close what open_export() opened and wait for the decompression to stop.
+# Raises IOError if the decompression went wrong (e.g. the file is corrupt or cut short), which
+# the parser can't tell from the file just ending. (If the parser stopped before the end, the
+# decompression fails when the pipe is closed, but that doesn't matter.)
+def close_export(the_source):
+    read_to_end = len(the_source['file'].read(1)) == 0
+    the_source['file'].close()
+    if the_source['thread'] is not None:
+        the_source['thread'].join()
+    if the_source['process'] is not None:
+        the_returncode = the_source['process'].wait()
+        the_message = the_source['process'].stderr.read().decode('utf-8', 'replace').strip()
+        the_source['process'].stderr.close()
+        if the_returncode != 0:
+            the_source['error'] = the_message or "exit status %d" % the_returncode
+    if the_source['error'] is not None and read_to_end:
+        raise IOError("couldn't decompress the %s file: %s" % (the_source['compression'], the_source['error']))
+
+
+
+# The thread in open_export(): write the decompressed blocks into the pipe until they run out
+# (or the other end is closed).
+def feed_pipe(the_blocks, write_fd, the_source):
+    with os.fdopen(write_fd, 'wb') as f:
+        try:
+            for the_block in the_blocks:
+                f.write(the_block)
+        # (including the pipe being closed if the parser stops early: see close_export())
+        except Exception as e:
+            the_source['error'] = str(e)
+
+
+
+def decompress_process(the_command, compression):
+    try:
+        return subprocess.Popen(the_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                bufsize=block_size, close_fds=True)
+    except OSError:
+        raise IOError("reading %s files needs the %s python module or the %s program" %
+                      (compression, {'xz': 'lzma', 'zstd': 'zstandard'}[compression], the_command[0]))
+
+
+
+# the contents of a file object, a block at a time (and then it's closed)
+def file_blocks(f):
+    with f:
+        while True:
+            the_block = f.read(block_size)
+            if not the_block:
+                return
+            yield the_block
+
+
+
+# The only CSV file in a zip file (e.g. a downloaded export), as a file object.
+def zip_member(classfile_in):
+    the_zip = zipfile.ZipFile(classfile_in)
+    the_csvs = [q for q in the_zip.namelist() if q.lower().endswith('.csv') and not q.startswith('__MACOSX/')]
+    if len(the_csvs) != 1:
+        raise IOError("%s should have exactly 1 CSV file in it, but it has %d" % (classfile_in, len(the_csvs)))
+    return the_zip.open(the_csvs[0])
+
+
+
+# Run decompress on each of the_pieces (in order) with a pool of threads, keeping at most
+# 2 per thread in hand at once, and yield what comes out, in order. (With 1 worker they're
+# just done one after another.)
+def decompress_in_order(the_pieces, decompress, workers):
+    if workers <= 1:
+        for the_piece in the_pieces:
+            yield decompress(the_piece)
+        return
+    pool = ThreadPool(workers)
+    try:
+        pending = []
+        for the_piece in the_pieces:
+            pending.append(pool.apply_async(decompress, (the_piece,)))
+            if len(pending) >= 2 * workers:
+                yield pending.pop(0).get()
+        for the_result in pending:
+            yield the_result.get()
+    finally:
+        pool.terminate()
+
+
+
+# Read the (offset, length) pieces of a file (in order) in batches of about block_size bytes,
+# yielding a list of the pieces' bytes for each batch.
+def read_batches(classfile_in, the_pieces):
+    with open(classfile_in, 'rb') as f:
+        the_batch = []
+        for i, (the_offset, the_length) in enumerate(the_pieces):
+            the_batch.append((the_offset, the_length))
+            if i == len(the_pieces) - 1 or the_pieces[i+1][0] + the_pieces[i+1][1] - the_batch[0][0] > block_size:
+                f.seek(the_batch[0][0])
+                the_data = f.read(the_offset + the_length - the_batch[0][0])
+                yield [the_data[q - the_batch[0][0]:q - the_batch[0][0] + r] for q, r in the_batch]
+                the_batch = []
+
+
+
+# The gzip members of a file as (offset, length), from the block sizes bgzip puts in their
+# headers; None if any of them doesn't have one (e.g. an ordinary gzip file, which is almost
+# always just 1 member). Only the headers are read.
+def bgzf_members(classfile_in):
+    the_size = os.path.getsize(classfile_in)
+    the_members = []
+    with open(classfile_in, 'rb') as f:
+        the_offset = 0
+        while the_offset < the_size:
+            f.seek(the_offset)
+            the_header = f.read(12)
+            # FLG.FEXTRA, then the length of the extra field
+            if len(the_header) < 12 or the_header[:2] != b'\x1f\x8b' or not (bytearray(the_header)[3] & 4):
+                return None
+            the_extra = f.read(struct.unpack('<H', the_header[10:12])[0])
+            the_length = None
+            i = 0
+            while i + 4 <= len(the_extra):
+                sub_id, sub_length = the_extra[i:i+2], struct.unpack('<H', the_extra[i+2:i+4])[0]
+                if sub_id == b'BC' and sub_length == 2:
+                    the_length = struct.unpack('<H', the_extra[i+4:i+6])[0] + 1
+                i += 4 + sub_length
+            if the_length is None:
+                return None
+            the_members.append((the_offset, the_length))
+            the_offset += the_length
+    return the_members
+
+
+
+# Everything in a batch of gzip members, one after another
+def gunzip_members(the_members):
+    return b''.join(zlib.decompress(q, 16 + zlib.MAX_WBITS) for q in the_members)
+
+
+
+# The decompressed contents of a gzip file, a block at a time: members in parallel if their
+# sizes are in their headers (see bgzf_members()), otherwise one after another.
+def gzip_blocks(classfile_in, workers=default_workers):
+    the_members = bgzf_members(classfile_in)
+    if the_members is not None and len(the_members) > 1:
+        return decompress_in_order(read_batches(classfile_in, the_members), gunzip_members, workers)
+
+    import gzip
+    # (GzipFile reads all the members, one after another)
+    return file_blocks(gzip.GzipFile(classfile_in, 'rb'))
+
+
+
+# The decompressed contents of a bz2 file, a block at a time, including every stream in it
+# (python 2's BZ2File stops after the first one).
+def bz2_blocks(classfile_in):
+    with open(classfile_in, 'rb') as f:
+        d = bz2.BZ2Decompressor()
+        for the_data in file_blocks(f):
+            while the_data:
+                try:
+                    the_output = d.decompress(the_data)
+                except EOFError:
+                    # the last stream ended right at the end of the previous block
+                    d = bz2.BZ2Decompressor()
+                    the_output = d.decompress(the_data)
+                if the_output:
+                    yield the_output
+                the_data = d.unused_data
+                if the_data:
+                    d = bz2.BZ2Decompressor()
+
+
+
+# The zstd frames of a file as (offset, length), found from the frame and block headers
+# without decompressing anything (see RFC 8878 section 3.1), leaving out skippable frames;
+# None if the file doesn't look like a zstd file all the way through.
+def zstd_frames(classfile_in):
+    the_size = os.path.getsize(classfile_in)
+    the_frames = []
+    with open(classfile_in, 'rb') as f:
+        the_offset = 0
+        while the_offset < the_size:
+            f.seek(the_offset)
+            the_magic = f.read(4)
+            if len(the_magic) < 4:
+                return None
+            if bytearray(the_magic)[1:] == bytearray(b'\x2a\x4d\x18') and bytearray(the_magic)[0] & 0xf0 == 0x50:
+                # a skippable frame
+                the_offset += 8 + struct.unpack('<I', f.read(4))[0]
+                continue
+            if the_magic != b'\x28\xb5\x2f\xfd':
+                return None
+
+            the_descriptor = bytearray(f.read(1))[0]
+            single_segment = (the_descriptor >> 5) & 1
+            the_position = the_offset + 5 + (1 - single_segment) + [0, 1, 2, 4][the_descriptor & 3] + \
+                           [single_segment, 2, 4, 8][the_descriptor >> 6]
+            while True:
+                f.seek(the_position)
+                the_block = bytearray(f.read(3))
+                if len(the_block) < 3:
+                    return None
+                the_header = the_block[0] | (the_block[1] << 8) | (the_block[2] << 16)
+                # (an RLE block is 1 byte, whatever size it decompresses to)
+                the_position += 3 + (1 if (the_header >> 1) & 3 == 1 else the_header >> 3)
+                if the_header & 1:
+                    break
+            # the checksum
+            the_position += 4 * ((the_descriptor >> 2) & 1)
+            the_frames.append((the_offset, the_position - the_offset))
+            the_offset = the_position
+    return the_frames
+
+
+
+# Everything in a batch of zstd frames (with a decompressor of its own, as they can't be
+# shared between threads, and a decompressobj for each frame, as not every frame says how
+# big it is when it's decompressed)
+def unzstd_frames(the_frames):
+    the_decompressor = zstandard.ZstdDecompressor()
+    return b''.join(the_decompressor.decompressobj().decompress(q) for q in the_frames)
+
+
+
+# The decompressed contents of a zstd file, a block at a time: frames in parallel if there
+# are several, otherwise as one stream.
+def zstd_blocks(classfile_in, workers=default_workers):
+    the_frames = zstd_frames(classfile_in)
+    if the_frames is not None and len(the_frames) > 1:
+        return decompress_in_order(read_batches(classfile_in, the_frames), unzstd_frames, workers)
+    return file_blocks(zstandard.ZstdDecompressor().stream_reader(open(classfile_in, 'rb')))
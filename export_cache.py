@@ -0,0 +1,209 @@
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# A cache of parsed classification exports, shared by basic_project_stats.py and
+# sessions_inproj_byuser.py (with --cache).
+#
+# Parsing a big export (reading the CSV, pulling started_at/finished_at out of the metadata
+# and parsing all the timestamps) takes far longer than anything we do with it afterwards,
+# and we often rerun the same file many times, e.g. with different session breaks. So the
+# first time a file is read with --cache, the arrays from panoptes_io.read_compact() are
+# saved as .npy files, and next time they're memory-mapped straight back in without any
+# parsing at all.
+#
+# Entries are keyed on the export's full path, size and modification time, plus a hash of
+# some of its contents: the first and last MB and 16 small blocks spread through the middle.
+# (Hashing the whole of a multi-GB file would take almost as long as parsing it.)
+# If any of that changes, it's a different entry, and the old one is just never used again
+# until it's cleared out.
+#
+# The cache lives in $PANOPTES_CACHE_DIR, or ~/.cache/panoptes_analysis if that isn't set.
+#
+# To see what's in the cache or clear it out:
+#   python export_cache.py list
+#   python export_cache.py clear [classifications_infile]
+# (with no file, clear removes everything)
+
+import sys
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import datetime
+
+import numpy as np
+
+from panoptes_io import read_compact
+from stage_profiler import stage
+
+
+# bump this if what's stored changes, so old entries aren't read as if they were new ones
+cache_version = 4
+
+# the arrays of strings, which are saved as fixed-width UTF-8 so they can be memory-mapped too
+# (a missing one, e.g. a blank workflow_version, is saved as '', which read_csv never gives)
+string_arrays = ('user_names', 'workflow_versions')
+
+sample_block = 1024 * 1024
+n_middle_blocks = 16
+
+
+
+def cache_dir():
+    return os.environ.get('PANOPTES_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'panoptes_analysis'))
+
+
+
+# hash of the first & last MB of the file and n_middle_blocks 64 kB blocks in between
+# (or the whole thing, if it's small)
+def content_hash(classfile_in):
+    the_size = os.path.getsize(classfile_in)
+    the_hash = hashlib.sha1()
+    with open(classfile_in, 'rb') as f:
+        if the_size <= 4 * sample_block:
+            the_hash.update(f.read())
+        else:
+            the_hash.update(f.read(sample_block))
+            for the_offset in np.linspace(sample_block, the_size - 2*sample_block, n_middle_blocks).astype(np.int64):
+                f.seek(int(the_offset))
+                the_hash.update(f.read(sample_block // 16))
+            f.seek(the_size - sample_block)
+            the_hash.update(f.read(sample_block))
+    return the_hash.hexdigest()
+
+
+
+def cache_key(classfile_in):
+    the_path = os.path.abspath(classfile_in)
+    the_stat = os.stat(the_path)
+    the_key = "%d|%s|%d|%d|%s" % (cache_version, the_path, the_stat.st_size, int(the_stat.st_mtime), content_hash(the_path))
+    return hashlib.sha1(the_key.encode('utf-8')).hexdigest()
+
+
+
+def save_compact(entry_dir, compact, classfile_in):
+    # write everything somewhere else first and then move it into place, so a run that's
+    # interrupted halfway through saving never leaves a broken entry behind
+    parent = os.path.dirname(entry_dir)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix='.tmp_')
+
+    manifest = {'source': os.path.abspath(classfile_in),
+                'size': os.path.getsize(classfile_in),
+                'mtime': int(os.path.getmtime(classfile_in)),
+                'saved': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'n_class': len(compact['user_code']),
+                'arrays': [],
+                'values': {}}
+    for the_key, the_value in compact.items():
+        if the_key in string_arrays:
+            np.save(os.path.join(tmp_dir, the_key + '.npy'), np.array([string_bytes(q) for q in the_value], dtype=bytes))
+            manifest['arrays'].append(the_key)
+        elif isinstance(the_value, np.ndarray):
+            np.save(os.path.join(tmp_dir, the_key + '.npy'), the_value)
+            manifest['arrays'].append(the_key)
+        else:
+            manifest['values'][the_key] = the_value
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # someone else saved the same entry at the same time; theirs is just as good
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+
+def load_compact(entry_dir):
+    with open(os.path.join(entry_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+    compact = dict(manifest['values'])
+    for the_key in manifest['arrays']:
+        compact[the_key] = np.load(os.path.join(entry_dir, the_key + '.npy'), mmap_mode='r')
+    # (python 2 strings are already bytes)
+    for the_key in string_arrays:
+        if str is bytes:
+            compact[the_key] = np.array(compact[the_key], dtype=object)
+        else:
+            compact[the_key] = np.array([q.decode('utf-8') for q in compact[the_key]], dtype=object)
+        compact[the_key][compact[the_key] == ''] = np.nan
+    return compact
+
+
+
+# one element of a string array as UTF-8 (see string_arrays)
+def string_bytes(the_string):
+    if isinstance(the_string, bytes):
+        return the_string
+    if the_string is None or (isinstance(the_string, float) and np.isnan(the_string)):
+        return b''
+    return the_string.encode('utf-8')
+
+
+
+# Same as panoptes_io.read_compact(classfile_in, profile, workers), but from the cache if it's
+# there (and saved to the cache if it isn't). Also returns whether it came from the cache.
+def read_compact_cached(classfile_in, profile=None, workers=1):
+    with stage(profile, 'cache lookup'):
+        entry_dir = os.path.join(cache_dir(), cache_key(classfile_in))
+        is_cached = os.path.isfile(os.path.join(entry_dir, 'manifest.json'))
+    if is_cached:
+        with stage(profile, 'read from cache') as the_stage:
+            compact = load_compact(entry_dir)
+            the_stage['rows'] = len(compact['user_code'])
+        return compact, True
+
+    compact = read_compact(classfile_in, profile, workers)
+    with stage(profile, 'write cache', len(compact['user_code'])):
+        save_compact(entry_dir, compact, classfile_in)
+    return compact, False
+
+
+
+# the manifests of everything in the cache
+def list_entries():
+    the_entries = []
+    if not os.path.isdir(cache_dir()):
+        return the_entries
+    for the_key in sorted(os.listdir(cache_dir())):
+        the_manifest = os.path.join(cache_dir(), the_key, 'manifest.json')
+        if os.path.isfile(the_manifest):
+            with open(the_manifest) as f:
+                manifest = json.load(f)
+            manifest['key'] = the_key
+            the_entries.append(manifest)
+    return the_entries
+
+
+
+# Remove the cache entries for classfile_in (any version of it), or everything if it's None.
+# Returns the number of entries removed.
+def invalidate(classfile_in=None):
+    n_removed = 0
+    for manifest in list_entries():
+        if classfile_in is None or manifest['source'] == os.path.abspath(classfile_in):
+            shutil.rmtree(os.path.join(cache_dir(), manifest['key']), ignore_errors=True)
+            n_removed += 1
+    return n_removed
+
+
+
+
+if __name__ == '__main__':
+    try:
+        the_command = sys.argv[1]
+        assert the_command in ('list', 'clear')
+    except:
+        print "\nUsage: "+sys.argv[0]+" list|clear [classifications_infile]"
+        print "      list shows what's in the cache ("+cache_dir()+")"
+        print "      clear removes the cached copies of classifications_infile, or everything if no file is given.\n"
+        sys.exit(0)
+
+    if the_command == 'list':
+        for manifest in list_entries():
+            print "%s  %s  (%d bytes, %d classifications, saved %s)" % (manifest['key'][:12], manifest['source'], manifest['size'], manifest['n_class'], manifest['saved'])
+    else:
+        the_file = sys.argv[2] if len(sys.argv) > 2 else None
+        print "Removed %d cache entries." % invalidate(the_file)
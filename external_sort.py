@@ -0,0 +1,232 @@
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# Session stats for exports too big to fit in memory, for sessions_inproj_byuser.py --out-of-core.
+#
+# The in-memory version needs every classification's user, created_at, started_at and
+# finished_at at once (and on the way there, pandas' object columns of the whole file, which
+# are far bigger). For the biggest projects that's more memory than we have. But the session
+# stats of each user only depend on that user's own classifications, so all we really need
+# is to see them one user at a time, in time order. So this is an external sort:
+#   1. read the file a chunk at a time, and for each chunk parse what we need and write out
+#      (user, created_at, started_at, finished_at) records, sorted by user and time,
+#      as a "run" file on local disk
+#   2. merge the runs back together a block at a time from each (a k-way merge), which gives
+#      everyone's classifications in (user, created_at) order
+#   3. as soon as all of a set of users' classifications have come out of the merge, compute
+#      their session stats (with the same code as the in-memory version) and drop them
+# Memory use then depends on the chunk size, the number of users and the classifications of
+# the single most prolific user, but not on the size of the file.
+#
+# The output is exactly the same as the in-memory version: users are ordered by name, and
+# classifications with the same user and created_at stay in the order they were in the file.
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from panoptes_io import read_classifications, compact_from_frame, compact_cols_read, is_registered
+from session_engine import sessionstats_arrays, concat_stats, take_users
+from stage_profiler import stage
+
+
+# what's in the run files
+record_dtype = np.dtype([('user', np.int32), ('created_at', np.int64), ('row', np.int64),
+                         ('started_at', np.int64), ('finished_at', np.int64)])
+
+default_chunksize = 1000000
+
+
+
+# Read classfile_in chunksize rows at a time and write the sorted runs into run_dir.
+#
+# Returns a dict with
+#   run_files       - the run files
+#   user_names      - the distinct user names, sorted (same as read_compact())
+#   user_rank       - the position in user_names of each of the user codes in the run files
+#                     (which are numbered in the order the users first turn up in the file)
+#   n_class_byuser  - the number of classifications of each user (in user_names order)
+#   user_ids, user_registered - as in read_compact() (in user_names order)
+#   n_class, n_subjects, first_created_at, last_created_at,
+#   user_id_is_float (if any user didn't have a user_id),
+#   n_meta_fallback, n_slow_timestamps (as in read_compact())
+def spill_runs(classfile_in, run_dir, chunksize=default_chunksize, profile=None, progress=None):
+    user_codes = {}
+    n_class_bycode = np.zeros(0, dtype=np.int64)
+    ids_bycode = []
+    subject_ids = set()
+    any_blank_subject = False
+    info = {'run_files': [], 'n_class': 0, 'first_created_at': None, 'last_created_at': None,
+            'user_id_is_float': False, 'n_meta_fallback': 0,
+            'n_slow_timestamps': {'created_at': 0, 'started_at': 0, 'finished_at': 0}}
+
+    the_chunks = iter(read_classifications(classfile_in, compact_cols_read, chunksize=chunksize))
+    while True:
+        with stage(profile, 'read') as the_stage:
+            chunk = next(the_chunks, None)
+            the_stage['rows'] = 0 if chunk is None else len(chunk)
+        if chunk is None:
+            break
+
+        compact = compact_from_frame(chunk, profile)
+        n_rows = len(chunk)
+
+        # (the rows were already counted in compact_from_frame())
+        with stage(profile, 'factorize'):
+            # this chunk's user codes -> codes for the whole file
+            chunk_to_file = np.zeros(len(compact['user_names']), dtype=np.int32)
+            for i, the_name in enumerate(compact['user_names']):
+                chunk_to_file[i] = user_codes.setdefault(the_name, len(user_codes))
+                # (each user's user_id is the one from their first chunk)
+                if chunk_to_file[i] == len(ids_bycode):
+                    ids_bycode.append(compact['user_ids'][i])
+            user_code = chunk_to_file[compact['user_code']]
+            if len(user_codes) > len(n_class_bycode):
+                n_class_bycode = np.r_[n_class_bycode, np.zeros(len(user_codes) - len(n_class_bycode), dtype=np.int64)]
+            n_class_bycode += np.bincount(user_code, minlength=len(n_class_bycode))
+
+            # (the subject ids, rather than the whole JSON strings)
+            any_blank_subject = any_blank_subject or bool(np.any(compact['subject_code'] < 0))
+            subject_ids.update(compact['subject_ids'].tolist())
+
+        with stage(profile, 'spill', n_rows):
+            records = np.empty(n_rows, dtype=record_dtype)
+            records['user']        = user_code
+            records['created_at']  = compact['created_at']
+            records['row']         = np.arange(info['n_class'], info['n_class'] + n_rows)
+            records['started_at']  = compact['started_at']
+            records['finished_at'] = compact['finished_at']
+            records = records[np.lexsort((records['row'], records['created_at'], records['user']))]
+            the_file = os.path.join(run_dir, 'run_%06d.npy' % len(info['run_files']))
+            np.save(the_file, records)
+            info['run_files'].append(the_file)
+            del records
+
+        info['n_class'] += n_rows
+        info['n_meta_fallback'] += compact['n_meta_fallback']
+        for the_col in info['n_slow_timestamps']:
+            info['n_slow_timestamps'][the_col] += compact['n_slow_timestamps'][the_col]
+        the_min, the_max = np.min(compact['created_at']), np.max(compact['created_at'])
+        info['first_created_at'] = the_min if info['first_created_at'] is None else min(info['first_created_at'], the_min)
+        info['last_created_at']  = the_max if info['last_created_at']  is None else max(info['last_created_at'],  the_max)
+        if progress is not None:
+            progress(info['n_class'])
+
+    if progress is not None:
+        progress(info['n_class'], info['n_class'])
+
+    # put the users in name order, as a groupby would
+    names_bycode = np.empty(len(user_codes), dtype=object)
+    for the_name, the_code in user_codes.items():
+        names_bycode[the_code] = the_name
+    by_name = np.argsort(names_bycode, kind='mergesort')
+    info['user_names'] = names_bycode[by_name]
+    info['user_rank'] = np.empty(len(by_name), dtype=np.int64)
+    info['user_rank'][by_name] = np.arange(len(by_name))
+    info['n_class_byuser'] = n_class_bycode[by_name]
+    ids_bycode = np.array(ids_bycode, dtype=object)
+    info['user_id_is_float'] = bool(np.any(pd.isnull(ids_bycode)))
+    info['user_ids'] = ids_bycode[by_name].astype(np.float64 if info['user_id_is_float'] else np.int64)
+    info['user_registered'] = is_registered(info['user_names'])
+    info['n_subjects'] = len(subject_ids) + int(any_blank_subject)
+    return info
+
+
+
+# Merge the sorted runs, yielding blocks of records in (user, created_at, row) order.
+# Each block has all of the classifications of the users in it.
+#
+# Each run is read block_rows records at a time. Every run has got at least as far as the
+# smallest of the last users in each run's current block, so all the records of users
+# before that one are already in hand, and can be sorted and handed on together. (If one
+# user has more classifications than fit in a block, that run's blocks are made bigger
+# until they do.)
+def merge_runs(run_files, block_rows):
+    runs = [np.load(q, mmap_mode='r') for q in run_files]
+    run_length = np.array([len(q) for q in runs], dtype=np.int64)
+    pos = np.zeros(len(runs), dtype=np.int64)
+    block = np.zeros(len(runs), dtype=np.int64) + block_rows
+
+    while True:
+        active = np.flatnonzero(pos < run_length)
+        if len(active) == 0:
+            return
+        end = np.minimum(pos + block, run_length)
+
+        # the user every run has got to (runs that are finished don't hold anyone back)
+        not_done = active[end[active] < run_length[active]]
+        if len(not_done) > 0:
+            last_user = np.array([runs[r]['user'][end[r] - 1] for r in not_done])
+            bound = last_user.min()
+        else:
+            bound = None
+
+        pieces = []
+        for r in active:
+            if bound is None:
+                n_take = end[r] - pos[r]
+            else:
+                n_take = np.searchsorted(np.asarray(runs[r]['user'][pos[r]:end[r]]), bound)
+            if n_take > 0:
+                pieces.append(np.array(runs[r][pos[r]:pos[r] + n_take]))
+                pos[r] += n_take
+
+        if len(pieces) == 0:
+            # the runs that are holding things up have nothing but user bound in their blocks
+            block[not_done[last_user == bound]] *= 2
+            continue
+
+        merged = np.concatenate(pieces)
+        yield merged[np.lexsort((merged['row'], merged['created_at'], merged['user']))]
+
+
+
+# The session stats of every user, computed from the run files as they're merged.
+# Returns the same as session_engine.sessionstats_arrays() (in user_names order, i.e. with
+# user_code being the position in info['user_names']); with_sessions is as there.
+def sessionstats_out_of_core(info, session_break, block_rows, profile=None, progress=None, with_sessions=False):
+    n_users = len(info['user_names'])
+    results = []
+    n_users_done = 0
+
+    the_blocks = merge_runs(info['run_files'], block_rows)
+    while True:
+        with stage(profile, 'merge') as the_stage:
+            records = next(the_blocks, None)
+            the_stage['rows'] = 0 if records is None else len(records)
+        if records is None:
+            break
+
+        with stage(profile, 'per-user stats', len(records)):
+            the_stats = sessionstats_arrays(records['user'], records['created_at'], records['started_at'],
+                                            records['finished_at'], None, session_break, with_sessions)
+        results.append(the_stats)
+        n_users_done += len(the_stats['user_code'])
+        if progress is not None:
+            progress(n_users_done, n_users)
+
+    session_stats = concat_stats(results)
+    # back to name order
+    session_stats['user_code'] = info['user_rank'][session_stats['user_code']]
+    session_stats = take_users(session_stats, np.argsort(session_stats['user_code'], kind='mergesort'))
+    session_stats['user_id'] = info['user_ids'][session_stats['user_code']]
+    return session_stats
+
+
+
+# Run the whole thing, with the runs in a temporary directory under tmp_dir (or the system's
+# default temporary directory), which is removed afterwards.
+# Returns the session stats (see sessionstats_out_of_core()) and the info from spill_runs().
+def sessionstats_from_file(classfile_in, session_break, chunksize=default_chunksize, tmp_dir=None,
+                           profile=None, progress=None, read_progress=None, with_sessions=False):
+    run_dir = tempfile.mkdtemp(dir=tmp_dir, prefix='panoptes_runs_')
+    try:
+        info = spill_runs(classfile_in, run_dir, chunksize, profile, read_progress)
+        # keep the merge buffers to about the size of one chunk in all
+        block_rows = max(1000, chunksize // max(1, len(info['run_files'])))
+        session_stats = sessionstats_out_of_core(info, session_break, block_rows, profile, progress, with_sessions)
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+    return session_stats, info
@@ -0,0 +1,163 @@
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# The distribution of the gaps between consecutive classifications by the same classifier,
+# for choosing session_break in sessions_inproj_byuser.py (see --gaps there).
+#
+# Plotted on a log scale, the gaps are usually bimodal: a peak at tens of seconds (the gaps
+# between classifications in the same session) and a broad one at hours to days (the gaps
+# between sessions). A session break anywhere in the valley between the two splits them up
+# about the same way, and one right at the bottom of the valley is the least arbitrary.
+#
+# Everything comes from one sort of the classifications by (user, created_at) and one
+# bincount: each gap's log bin and whether its classifier is registered are packed into a
+# single integer, so the histograms for registered and unregistered classifiers come out
+# of the same pass.
+
+import numpy as np
+
+from session_engine import sort_by_user, group_starts
+
+
+ns_per_s = 10**9
+
+# 10 bins per factor of 10 in the gap, from 1 second up
+default_bins_per_decade = 10
+
+# peaks closer together than this (in decades) are counted as the same peak
+min_peak_separation = 1.
+
+
+
+# Every within-user gap between consecutive classifications (by created_at), in nanoseconds,
+# and the user_code of the classifier each gap belongs to.
+def within_user_gaps(user_code, created_at):
+    order = sort_by_user(user_code, created_at)
+    u  = np.asarray(user_code)[order]
+    ts = np.asarray(created_at, dtype=np.int64)[order]
+    # (the first classification of each user has no gap before it)
+    is_gap = np.ones(len(u), dtype=bool)
+    is_gap[group_starts(u)] = False
+    is_gap = is_gap[1:]
+    return (ts[1:] - ts[:-1])[is_gap], u[1:][is_gap]
+
+
+
+# The lower edges (in seconds) of the log bins, for gaps up to max_gap_s.
+# The first bin is everything under 1 second (including gaps of 0, which happen when two
+# classifications are recorded in the same second), so its lower edge is 0.
+def log_bin_edges(max_gap_s, bins_per_decade=default_bins_per_decade):
+    n_bins = int(np.floor(np.log10(max(max_gap_s, 1.)) * bins_per_decade)) + 1
+    return np.r_[0., 10. ** (np.arange(n_bins) / float(bins_per_decade))]
+
+
+
+# The gap histograms, and a suggested session break.
+#
+# user_code, created_at are per classification (as in session_engine.sessionize()), and
+# user_registered is per user_code.
+# Returns a dict with
+#   bin_lo_s, bin_hi_s - the edges of each bin, in seconds (the last bin_hi_s is the biggest gap)
+#   n_all, n_registered, n_unregistered - the number of gaps in each bin
+#   n_gaps, n_gaps_registered
+#   suggested_break_min - the middle of the valley between the peaks of n_all, in whole minutes
+#                         (None if there aren't 2 peaks far enough apart to have a valley)
+#   peaks_s - the 2 peaks, in seconds
+def gap_histograms(user_code, created_at, user_registered, bins_per_decade=default_bins_per_decade):
+    gaps, gap_user = within_user_gaps(user_code, created_at)
+    max_gap_s = gaps.max() / float(ns_per_s) if len(gaps) > 0 else 1.
+    bin_lo = log_bin_edges(max_gap_s, bins_per_decade)
+    n_bins = len(bin_lo)
+
+    # which bin each gap is in: bin 0 is < 1s, then bins_per_decade per decade
+    with np.errstate(divide='ignore'):
+        the_bin = np.floor(np.log10(gaps / float(ns_per_s)) * bins_per_decade).astype(np.int64) + 1
+    the_bin = np.clip(the_bin, 0, n_bins - 1)
+
+    # one bincount for both kinds of classifier: even for unregistered, odd for registered
+    is_reg = np.asarray(user_registered, dtype=np.int64)[gap_user]
+    the_counts = np.bincount(2 * the_bin + is_reg, minlength=2 * n_bins)
+
+    report = {}
+    report['bin_lo_s'] = bin_lo
+    report['bin_hi_s'] = np.r_[bin_lo[1:], max(max_gap_s, bin_lo[-1])]
+    report['n_unregistered'] = the_counts[0::2]
+    report['n_registered']   = the_counts[1::2]
+    report['n_all']          = report['n_registered'] + report['n_unregistered']
+    report['n_gaps']            = len(gaps)
+    report['n_gaps_registered'] = int(report['n_registered'].sum())
+    report['bins_per_decade']   = bins_per_decade
+    report['suggested_break_min'], report['peaks_s'] = suggest_break(report['n_all'], bin_lo, report['bin_hi_s'], bins_per_decade)
+    return report
+
+
+
+# The bottom of the valley between the within-session peak of counts (a log-binned histogram),
+# which is its highest, and the highest peak after it that's at least min_peak_separation
+# decades further on (the between-session one), in whole minutes, plus the 2 peaks (in
+# seconds); (None, None) if there's no such pair of peaks.
+# Only peaks after the highest one are looked at because created_at is only to the second, so
+# the first few bins (1-10s) can be lumpy: some are narrower than a second and hold no gaps at
+# all. The histogram is also smoothed over half a decade first so that noise doesn't make
+# extra peaks.
+def suggest_break(counts, bin_lo, bin_hi, bins_per_decade=default_bins_per_decade):
+    # (the < 1s bin isn't on the log scale, so it's left out)
+    n_smooth = max(1, bins_per_decade // 2)
+    smooth = np.convolve(np.asarray(counts[1:], dtype=np.float64), np.ones(n_smooth) / n_smooth, mode='same')
+    if len(smooth) < 3 or smooth.max() <= 0:
+        return None, None
+
+    is_peak = (smooth > 0) & (smooth >= np.r_[0., smooth[:-1]]) & (smooth >= np.r_[smooth[1:], 0.])
+    peaks = np.flatnonzero(is_peak)
+    first = peaks[np.argmax(smooth[peaks])]
+    far = peaks[peaks - first >= min_peak_separation * bins_per_decade]
+    if len(far) == 0:
+        return None, None
+    second = far[np.argmax(smooth[far])]
+
+    valley = first + np.argmin(smooth[first:second + 1])
+    # the middle of each bin on the log scale (again leaving out the < 1s bin)
+    bin_mid_s = np.sqrt(bin_lo[1:] * bin_hi[1:])
+    # (session breaks are whole minutes)
+    return max(1, int(round(bin_mid_s[valley] / 60.))), (bin_mid_s[first], bin_mid_s[second])
+
+
+
+# Write the histograms from gap_histograms() to a CSV file, one bin per line, with columns
+# gap_lo_s, gap_hi_s, n_all, n_registered, n_unregistered.
+def write_gap_csv(filename, report):
+    with open(filename, 'w') as f:
+        f.write("gap_lo_s,gap_hi_s,n_all,n_registered,n_unregistered\n")
+        for i in range(len(report['bin_lo_s'])):
+            f.write("%.6g,%.6g,%d,%d,%d\n" % (report['bin_lo_s'][i], report['bin_hi_s'][i], report['n_all'][i],
+                                             report['n_registered'][i], report['n_unregistered'][i]))
+
+
+
+# the fraction of the gaps in counts that are at least break_min minutes (i.e. that would
+# start a new session), to the nearest bin
+def fraction_at_least(report, counts, break_min):
+    total = counts.sum()
+    if total == 0:
+        return 0.
+    return counts[report['bin_lo_s'] >= 60. * int(break_min)].sum() / float(total)
+
+
+
+# Lines of text summarising the report, e.g. the suggested break and what share of the gaps
+# it (and session_break) would make into session breaks.
+def gap_report_lines(report, session_break):
+    n_unreg = report['n_gaps'] - report['n_gaps_registered']
+    the_lines = ["%d gaps between consecutive classifications by the same classifier (%d by registered, %d by unregistered classifiers)." %
+                 (report['n_gaps'], report['n_gaps_registered'], n_unreg)]
+    if report['suggested_break_min'] is None:
+        the_lines.append("The gaps don't have 2 separate peaks, so there's no obvious session break to suggest.")
+    else:
+        the_lines.append("The gaps peak at about %.3g seconds (within sessions) and %.3g hours (between sessions)." %
+                         (report['peaks_s'][0], report['peaks_s'][1] / 3600.))
+        the_lines.append("Suggested session break (the bottom of the valley between them): %d minutes." % report['suggested_break_min'])
+    for the_break in ([] if report['suggested_break_min'] is None else [report['suggested_break_min']]) + [session_break]:
+        the_lines.append("A break of %d minutes starts a new session at %.1f%% of the gaps (%.1f%% for registered, %.1f%% for unregistered classifiers)." %
+                         (int(the_break), 100. * fraction_at_least(report, report['n_all'], the_break),
+                          100. * fraction_at_least(report, report['n_registered'], the_break),
+                          100. * fraction_at_least(report, report['n_unregistered'], the_break)))
+    return the_lines
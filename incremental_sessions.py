@@ -0,0 +1,408 @@
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# Incremental updates of the per-user session stats, for sessions_inproj_byuser.py --incremental.
+#
+# Panoptes exports only ever grow, and if we rerun the session stats every day on the whole
+# file then nearly all of the work is redoing the sessions of people who haven't classified
+# since yesterday. So after a run we save enough about every user to carry on from where
+# we left off:
+#   - per user: the things that only depend on their first/last classification (first day,
+#     first started_at, user_id, last created_at, ...) and running totals (n_class, n_days,
+#     the sum of their classification lengths)
+#   - every session (classification count, summed classification length, start & end), so
+#     the last, still-open one can be extended and the stats over sessions recomputed
+#   - every classification length, since the median over all of a user's classifications
+#     can't be updated any other way
+#   - the output line for every user
+# The next run only looks at the rows of the export after the ones we've already seen (the
+# state keeps how many that was, n_class_tot), works out their sessions, joins each user's
+# first new session onto their last old one if the gap between them is shorter than the
+# session break, and recomputes the output rows for just the users who have new
+# classifications. Everyone else's output line is copied over as it was.
+#
+# This gives exactly the same numbers as a full run, as long as the export only ever has
+# classifications added to the end of it, and none of them has a created_at before that of the
+# same user's last classification in the previous run. (A created_at can't be the checkpoint:
+# they only go down to the second, so the last second of one export can have more
+# classifications in the next one.)
+#
+# The sessions and classification lengths are the bulk of the state, and grow with the
+# whole history of the project, so they're kept in logs that are only ever added to: each
+# user's are one contiguous block of the log, and the per-user arrays say where it starts.
+# A user with new classifications gets their whole block (old and new) added to the end of
+# the log and their start moved there; nobody else's is read or written. When more than half
+# of a log is blocks that have been moved on from, it's written out again with just the
+# live ones. So an update costs the new classifications plus the history of the users who
+# made them, and the per-user arrays and the output lines (which are rewritten every time,
+# as the output file is).
+#
+# The state is kept in a directory:
+#   state.json                  - the session break, n_class_tot, the length of each log and
+#                                 which users_N.npz goes with them
+#   users_N.npz                 - the per-user arrays, in user name order, and the output lines
+#   session_*.bin, class_lengths.bin
+#                               - the logs, raw little-endian int64
+# A run adds to the end of the logs, then writes a new users_N.npz and finally replaces
+# state.json, so if it's interrupted the old state.json still describes a complete state
+# (anything past the lengths it gives is cut off next time).
+#
+# If the session break changes, or the export has fewer rows than the state has seen, it's
+# started again from scratch.
+
+import os
+import json
+import shutil
+import tempfile
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import numpy as np
+import pandas as pd
+
+import session_engine
+from session_engine import sessionize, userstats_from_sessions, is_session_break, grouped_median, col_order, \
+    offsets_from_counts, range_rows
+
+
+# bump this if what's saved changes
+state_version = 3
+
+# per-user arrays in the state (all in user_names order)
+user_keys = ['user_id', 'n_class', 'n_days', 'first_day', 'last_day', 'first_started_at',
+             'last_finished_at', 'last_created_at', 'class_length_sum', 'n_sessions']
+# per-session arrays (grouped by user)
+session_keys = ['session_n_class', 'session_class_length', 'session_start', 'session_end']
+
+# the logs: the arrays in each, and the per-user arrays with the start and length of each
+# user's block
+logs = {'sessions':      (session_keys, 'session_offset', 'n_sessions'),
+        'class_lengths': (['class_lengths'], 'class_offset', 'n_class')}
+log_dtype = np.dtype('<i8')
+
+
+
+def load_state(state_dir):
+    the_file = os.path.join(state_dir, 'state.json')
+    if not os.path.isfile(the_file):
+        return None
+    with open(the_file) as f:
+        state = json.load(f)
+    if state.get('state_version') != state_version:
+        return None
+    with np.load(os.path.join(state_dir, state['users_file'])) as the_arrays:
+        for the_key in the_arrays.files:
+            state[the_key] = the_arrays[the_key]
+    state['user_names'] = np.array(state['user_names'].tolist(), dtype=object)
+    if str is not bytes:
+        state['user_names'] = np.array([q.decode('utf-8') for q in state['user_names']], dtype=object)
+    state['stats_lines'] = state['stats_lines'].tostring()
+
+    # the logs are only mapped: an update just reads the blocks of the users it changes
+    for the_log in logs:
+        n_rows = state['log_rows'][the_log]
+        for the_key in logs[the_log][0]:
+            if n_rows == 0:
+                state[the_key] = np.zeros(0, dtype=log_dtype)
+            else:
+                state[the_key] = np.memmap(os.path.join(state_dir, the_key + '.bin'), dtype=log_dtype, mode='r', shape=(n_rows,))
+    state['log_dir'] = os.path.abspath(state_dir)
+    state['log_added'] = empty_logs()
+    return state
+
+
+
+def save_state(state_dir, state):
+    if state['log_dir'] == os.path.abspath(state_dir) and os.path.isdir(state_dir):
+        # add to the logs that are there (cutting off anything an interrupted run left)
+        for the_log in logs:
+            n_rows = state['log_rows'][the_log]
+            for the_key in logs[the_log][0]:
+                with open(os.path.join(state_dir, the_key + '.bin'), 'r+b') as f:
+                    f.truncate(n_rows * log_dtype.itemsize)
+                    f.seek(0, os.SEEK_END)
+                    f.write(state['log_added'][the_key].astype(log_dtype).tostring())
+        save_users(state_dir, state, state['users_gen'] + 1)
+        return
+
+    # a new state: write it all somewhere else and then swap it in, so an interrupted run
+    # can't leave a state that's half old and half new
+    parent = os.path.dirname(os.path.abspath(state_dir))
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix='.tmp_state_')
+    for the_log in logs:
+        for the_key in logs[the_log][0]:
+            with open(os.path.join(tmp_dir, the_key + '.bin'), 'wb') as f:
+                f.write(state[the_key].astype(log_dtype).tostring())
+                f.write(state['log_added'][the_key].astype(log_dtype).tostring())
+    save_users(tmp_dir, state, 1)
+
+    if os.path.isdir(state_dir):
+        old_dir = state_dir.rstrip(os.sep) + '.old'
+        shutil.rmtree(old_dir, ignore_errors=True)
+        os.rename(state_dir, old_dir)
+        os.rename(tmp_dir, state_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+    else:
+        os.rename(tmp_dir, state_dir)
+
+
+
+# Write the per-user arrays to users_[the_gen].npz in state_dir and then replace state.json
+# with one that points to them (and to the logs as they are once the new rows are added).
+def save_users(state_dir, state, the_gen):
+    users_file = 'users_%d.npz' % the_gen
+    the_arrays = dict((q, state[q]) for q in user_keys + ['session_offset', 'class_offset', 'line_offset'])
+    the_arrays['user_names'] = np.array([q if isinstance(q, bytes) else q.encode('utf-8') for q in state['user_names']], dtype=bytes)
+    the_arrays['stats_lines'] = np.frombuffer(state['stats_lines'], dtype=np.uint8)
+    np.savez(os.path.join(state_dir, users_file), **the_arrays)
+
+    log_rows = dict((q, len(state[logs[q][0][0]]) + len(state['log_added'][logs[q][0][0]])) for q in logs)
+    with open(os.path.join(state_dir, 'state.json.tmp'), 'w') as f:
+        json.dump({'state_version': state_version,
+                   'session_break': state['session_break'],
+                   'n_class_tot':   state['n_class_tot'],
+                   'users_file':    users_file,
+                   'users_gen':     the_gen,
+                   'log_rows':      log_rows}, f, indent=1, sort_keys=True)
+    os.rename(os.path.join(state_dir, 'state.json.tmp'), os.path.join(state_dir, 'state.json'))
+
+    for the_name in os.listdir(state_dir):
+        if the_name.startswith('users_') and the_name.endswith('.npz') and the_name != users_file:
+            os.remove(os.path.join(state_dir, the_name))
+
+
+
+# the output file's header line
+def stats_header():
+    return (','.join(['user_name'] + col_order) + '\n').encode('utf-8')
+
+
+
+# the output file's lines for some users (as bytes, 1 line per user)
+def format_stats_lines(session_stats, user_names):
+    the_frame = session_engine.sessionstats_to_frame(session_stats, user_names)
+    the_buffer = StringIO()
+    the_frame.to_csv(the_buffer, header=False)
+    the_lines = the_buffer.getvalue()
+    if not isinstance(the_lines, bytes):
+        the_lines = the_lines.encode('utf-8')
+    return the_lines.splitlines(True)
+
+
+
+# The rows of the_key's log (including what's been added since it was loaded) at positions rows
+def log_take(state, the_key, rows):
+    n_saved = len(state[the_key])
+    if len(state['log_added'][the_key]) == 0 or (len(rows) > 0 and np.max(rows) < n_saved):
+        return np.array(state[the_key][rows])
+    return np.r_[state[the_key], state['log_added'][the_key]][rows]
+
+
+
+# Add the classifications in compact (a dict from panoptes_io.read_compact(); see there)
+# after the first state['n_class_tot'] rows to state. state can be None to start from scratch.
+#
+# Returns the new state, the number of new classifications and the number of users whose
+# stats changed. The new output file is stats_header() + state['stats_lines'].
+def update_state(state, compact, session_break):
+    created_at = np.asarray(compact['created_at'])
+    if not state_matches(state, len(created_at), session_break):
+        state = empty_state(session_break)
+    n_new = len(created_at) - state['n_class_tot']
+    if n_new == 0:
+        return state, 0, 0
+
+    # sessions of the new classifications only
+    new_rows = np.arange(state['n_class_tot'], len(created_at))
+    new = sessionize(np.asarray(compact['user_code'])[new_rows], created_at[new_rows],
+                     np.asarray(compact['started_at'])[new_rows], np.asarray(compact['finished_at'])[new_rows],
+                     session_break)
+    new['user_names'] = np.asarray(compact['user_names'], dtype=object)[new['user_code']]
+    new['user_id'] = np.asarray(compact['user_ids'])[new['user_code']]
+    new['class_lengths'] = (np.asarray(compact['finished_at'])[new_rows] - np.asarray(compact['started_at'])[new_rows])[new['order']]
+
+    # Everyone, old and new, in name order. Both lists are in name order already, so the
+    # users who weren't in the state before are slotted in between the old ones.
+    old_names = state['user_names']
+    n_old = len(old_names)
+    old_idx = pd.Index(old_names).get_indexer(new['user_names'])   # -1 if they're not in the old state
+    in_old = old_idx >= 0
+    insert_at = np.searchsorted(old_names, new['user_names'][~in_old])
+    all_names = np.insert(old_names, insert_at, new['user_names'][~in_old])
+    n_users = len(all_names)
+    # where each old user and each user with new classifications is in all_names
+    old_to_all = np.arange(n_old) + np.searchsorted(insert_at, np.arange(n_old), side='right')
+    new_to_all = np.zeros(len(old_idx), dtype=np.int64)
+    new_to_all[in_old] = old_to_all[old_idx[in_old]]
+    new_to_all[~in_old] = insert_at + np.arange(len(insert_at))
+    all_to_old = -np.ones(n_users, dtype=np.int64)
+    all_to_old[old_to_all] = np.arange(n_old)
+    all_to_new = -np.ones(n_users, dtype=np.int64)
+    all_to_new[new_to_all] = np.arange(len(new_to_all))
+
+    # per-user values: old ones by default, then update the users with new classifications
+    merged = {}
+    for the_key in user_keys + ['session_offset', 'class_offset']:
+        the_dtype = np.result_type(state[the_key].dtype, np.asarray(new.get(the_key, state[the_key])).dtype)
+        merged[the_key] = np.zeros(n_users, dtype=the_dtype)
+        merged[the_key][old_to_all] = state[the_key]
+    for the_key in ['n_class', 'n_days', 'class_length_sum', 'n_sessions']:
+        merged[the_key][new_to_all] += new[the_key]
+    for the_key in ['last_day', 'last_finished_at', 'last_created_at']:
+        merged[the_key][new_to_all] = new[the_key]
+    # these come from the user's first classification, so only for users who weren't there before
+    for the_key in ['user_id', 'first_day', 'first_started_at']:
+        merged[the_key][new_to_all[~in_old]] = new[the_key][~in_old]
+
+    # the first new day is the same as the last old one: don't count it twice
+    both_old = old_idx[in_old]
+    merged['n_days'][new_to_all[in_old]] -= (new['first_day'][in_old] == state['last_day'][both_old])
+
+    # does the user's first new session carry on their last old one?
+    new_soff = offsets_from_counts(new['n_sessions'])
+    gap = new['session_start'][new_soff[:-1][in_old]] - state['last_created_at'][both_old]
+    joined = np.zeros(n_users, dtype=bool)
+    joined[new_to_all[in_old]] = ~is_session_break(gap, session_break)
+    merged['n_sessions'][joined] -= 1
+
+    # If user_id has gone from int to float (the first not-logged-in user turned up), every
+    # line of the output changes, not just the ones with new classifications (so this once,
+    # everyone's blocks are read and moved)
+    if n_old > 0 and merged['user_id'].dtype != state['user_id'].dtype:
+        the_users = np.arange(n_users)
+    else:
+        the_users = np.sort(new_to_all)
+    users_old = all_to_old[the_users]
+    users_new = all_to_new[the_users]
+    users_joined = joined[the_users].astype(np.int64)
+
+    # Their sessions: each user's old block from the log, with the last session extended if
+    # the first new one carries it on, and then the rest of their new ones.
+    n_old_sessions = take_found(state['n_sessions'], users_old)
+    old_rows = range_rows(take_found(state['session_offset'], users_old), n_old_sessions)
+    old_sessions = dict((q, log_take(state, q, old_rows)) for q in session_keys)
+    last_old = offsets_from_counts(n_old_sessions)[1:][users_joined == 1] - 1
+    first_new = new_soff[users_new[users_joined == 1]]
+    for the_key in ['session_n_class', 'session_class_length']:
+        old_sessions[the_key][last_old] += new[the_key][first_new]
+    old_sessions['session_end'][last_old] = new['session_end'][first_new]
+    new_starts = take_found(new_soff[:-1], users_new) + users_joined
+    n_new_sessions = take_found(new['n_sessions'], users_new) - users_joined
+    spliced = splice_rows(offsets_from_counts(n_old_sessions)[:-1], n_old_sessions, len(old_rows) + new_starts, n_new_sessions)
+
+    sessions = dict((q, merged[q][the_users]) for q in user_keys)
+    sessions['user_code'] = the_users
+    for the_key in session_keys:
+        sessions[the_key] = np.r_[old_sessions[the_key], new[the_key]][spliced]
+
+    # and all their classification lengths, old ones first
+    new_coff = offsets_from_counts(new['n_class'])
+    n_old_class = take_found(state['n_class'], users_old)
+    old_rows = range_rows(take_found(state['class_offset'], users_old), n_old_class)
+    spliced = splice_rows(offsets_from_counts(n_old_class)[:-1], n_old_class,
+                          len(old_rows) + take_found(new_coff[:-1], users_new),
+                          take_found(new['n_class'], users_new))
+    class_lengths = np.r_[log_take(state, 'class_lengths', old_rows), new['class_lengths']][spliced]
+
+    # now recompute their stats
+    user_n_class = merged['n_class'][the_users]
+    sessions['class_length_median'] = grouped_median(class_lengths, np.repeat(np.arange(len(the_users)), user_n_class),
+                                                     offsets_from_counts(user_n_class)[:-1], user_n_class)
+    session_stats = userstats_from_sessions(sessions)
+    session_stats['user_id'] = merged['user_id'][the_users]
+    new_lines = format_stats_lines(session_stats, all_names)
+
+    # their blocks go on the end of the logs
+    merged['log_added'] = {}
+    for the_key in session_keys:
+        merged[the_key] = state[the_key]
+        merged['log_added'][the_key] = np.r_[state['log_added'][the_key], sessions[the_key]]
+    merged['session_offset'][the_users] = len(state['session_start']) + len(state['log_added']['session_start']) + \
+        offsets_from_counts(sessions['n_sessions'])[:-1]
+    merged['class_lengths'] = state['class_lengths']
+    merged['log_added']['class_lengths'] = np.r_[state['log_added']['class_lengths'], class_lengths]
+    merged['class_offset'][the_users] = len(state['class_lengths']) + len(state['log_added']['class_lengths']) + \
+        offsets_from_counts(user_n_class)[:-1]
+
+    # The output lines: the new ones for the users we just did, and the old ones for everyone
+    # else (as one gather of the bytes of both, rather than line by line)
+    new_line_offset = offsets_from_counts([len(q) for q in new_lines])
+    old_line_offset = state['line_offset']
+    the_starts = take_found(old_line_offset[:-1], all_to_old)
+    the_counts = take_found(np.diff(old_line_offset), all_to_old)
+    the_starts[the_users] = len(state['stats_lines']) + new_line_offset[:-1]
+    the_counts[the_users] = np.diff(new_line_offset)
+    the_bytes = np.r_[np.frombuffer(state['stats_lines'], dtype=np.uint8), np.frombuffer(b''.join(new_lines), dtype=np.uint8)]
+    merged['stats_lines'] = the_bytes[range_rows(the_starts, the_counts)].tostring()
+    merged['line_offset'] = offsets_from_counts(the_counts)
+
+    merged['user_names']    = all_names
+    merged['session_break'] = session_break
+    merged['n_class_tot']   = int(state['n_class_tot'] + n_new)
+    merged['log_dir']       = state['log_dir']
+    merged['log_rows']      = state['log_rows']
+    merged['users_gen']     = state['users_gen']
+    compact_logs(merged)
+
+    return merged, n_new, len(the_users)
+
+
+
+# values[the_idx], with 0 where the_idx is -1
+def take_found(values, the_idx):
+    the_values = np.zeros(len(the_idx), dtype=np.int64)
+    the_values[the_idx >= 0] = values[the_idx[the_idx >= 0]]
+    return the_values
+
+
+
+# The rows that put two lists of blocks together, block i of the first and then block i of the
+# second for each i, when the second's rows come after the first's
+def splice_rows(starts_1, counts_1, starts_2, counts_2):
+    return range_rows(np.column_stack((starts_1, starts_2)).ravel(), np.column_stack((counts_1, counts_2)).ravel())
+
+
+
+# If more than half of either log is blocks nobody's pointing to any more, make a new one with
+# just the live blocks (and then the whole state is saved from scratch next time)
+def compact_logs(state):
+    for the_log in logs:
+        the_keys, offset_key, count_key = logs[the_log]
+        if len(state[the_keys[0]]) + len(state['log_added'][the_keys[0]]) <= 2 * np.sum(state[count_key]):
+            continue
+        the_rows = range_rows(state[offset_key], state[count_key])
+        for the_key in the_keys:
+            state['log_added'][the_key] = log_take(state, the_key, the_rows)
+            state[the_key] = np.zeros(0, dtype=log_dtype)
+        state[offset_key] = offsets_from_counts(state[count_key])[:-1]
+        state['log_dir'] = None
+
+
+
+# Can state (None for none) carry on with an export of n_rows rows, with this session break?
+def state_matches(state, n_rows, session_break):
+    return state is not None and state['session_break'] == session_break and state['n_class_tot'] <= n_rows
+
+
+
+def empty_logs():
+    return dict((q, np.zeros(0, dtype=log_dtype)) for the_log in logs for q in logs[the_log][0])
+
+
+
+def empty_state(session_break):
+    state = {}
+    for the_key in user_keys + ['session_offset', 'class_offset']:
+        state[the_key] = np.zeros(0, dtype=np.int64)
+    state.update(empty_logs())
+    state['log_added']     = empty_logs()
+    state['log_dir']       = None
+    state['log_rows']      = dict((q, 0) for q in logs)
+    state['users_gen']     = 0
+    state['user_names']    = np.zeros(0, dtype=object)
+    state['line_offset']   = np.zeros(1, dtype=np.int64)
+    state['stats_lines']   = b''
+    state['session_break'] = session_break
+    state['n_class_tot']   = 0
+    return state
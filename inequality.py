@@ -0,0 +1,121 @@
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# How evenly the classifications are spread among the classifiers: the Gini coefficient,
+# the Lorenz curve it comes from, and what share of the classifications the most prolific
+# classifiers did. Used by basic_project_stats.py and sessions_inproj_byuser.py.
+#
+# Get the Gini coefficient - https://en.wikipedia.org/wiki/Gini_coefficient
+#
+# The Gini coefficient measures inequality in distributions of things.
+# It was originally conceived for economics (e.g. where is the wealth in a country?
+#  in the hands of many citizens or a few?), but it's just as applicable to many
+#  other fields. In this case we'll use it to see how classifications are
+#  distributed among classifiers.
+# G = 0 is a completely even distribution (everyone does the same number of
+#  classifications), and ~1 is uneven (~all the classifications are done
+#  by one classifier).
+# Typical values of the Gini for healthy Zooniverse projects (Cox et al. 2015) are
+#  in the range of 0.7-0.9.
+#  That range is generally indicative of a project with a loyal core group of
+#    volunteers who contribute the bulk of the classification effort, but balanced
+#    out by a regular influx of new classifiers trying out the project, from which
+#    you continue to draw to maintain a core group of prolific classifiers.
+# Once your project is fairly well established, you can compare it to past Zooniverse
+#  projects to see how you're doing.
+#  If your G is << 0.7, you may be having trouble recruiting classifiers into a loyal
+#    group of volunteers. People are trying it, but not many are staying.
+#  If your G is > 0.9, it's a little more complicated. If your total classification
+#    count is lower than you'd like it to be, you may be having trouble recruiting
+#    classifiers to the project, such that your classification counts are
+#    dominated by a few people.
+#  But if you have G > 0.9 and plenty of classifications, this may be a sign that your
+#    loyal users are -really- committed, so a very high G is not necessarily a bad thing.
+#
+# Of course the Gini coefficient is a simplified measure that doesn't always capture
+#  subtle nuances and so forth, but it's still a useful broad metric.
+#
+# The scripts used to compute this with a python loop over sorted(counts):
+#     height += value
+#     area += height - value / 2.
+# and then G = (fair_area - area) / fair_area with fair_area = height * n / 2.
+# Here it's the same thing with one np.sort and one cumulative sum, which is what
+# the Lorenz curve is anyway, so that and the top shares come for free.
+# (fair_area is always a float here; with integer counts in python 2 the old version
+# rounded it down, which made G slightly off when height * n was odd.)
+
+import numpy as np
+
+
+# the shares of the most prolific classifiers to report by default: top 1%, 10%, 50%
+default_top_fractions = (0.01, 0.1, 0.5)
+
+
+
+# Everything from a single sort of counts (e.g. the number of classifications per user).
+# Returns a dict with
+#   gini         - the Gini coefficient
+#   lorenz_x     - cumulative fraction of the classifiers, least prolific first (starting at 0)
+#   lorenz_y     - cumulative fraction of the classifications they did (starting at 0)
+#   top_fractions, top_shares - for each fraction f in top_fractions, the fraction of all the
+#                  classifications done by the top f of the classifiers (rounded up to a whole
+#                  number of classifiers, but at least 1)
+def inequality_stats(counts, top_fractions=default_top_fractions):
+    sorted_counts = np.sort(np.asarray(counts, dtype=np.float64))
+    n = len(sorted_counts)
+    height = np.cumsum(sorted_counts)
+    total = height[-1] if n > 0 else 0.
+
+    stats = {}
+    if total > 0:
+        area = np.sum(height) - total / 2.
+        fair_area = total * n / 2.
+        stats['gini'] = (fair_area - area) / fair_area
+        stats['lorenz_y'] = np.r_[0., height / total]
+    else:
+        stats['gini'] = np.nan
+        stats['lorenz_y'] = np.zeros(n + 1)
+    stats['lorenz_x'] = np.arange(n + 1) / float(max(n, 1))
+
+    # the top k are the last k of the sorted counts
+    top_fractions = np.asarray(top_fractions, dtype=np.float64)
+    n_top = np.clip(np.ceil(top_fractions * n).astype(np.int64), min(1, n), n)
+    stats['top_fractions'] = top_fractions
+    stats['top_shares'] = 1. - stats['lorenz_y'][n - n_top]
+
+    return stats
+
+
+
+# The Gini coefficient of counts (see above)
+def gini(counts):
+    return inequality_stats(counts, top_fractions=())['gini']
+
+
+
+# Write the Lorenz curve from inequality_stats() to a CSV file, with columns
+# frac_classifiers, frac_classifications.
+# With millions of users the full curve is far more points than anyone needs to plot it,
+# so by default it's thinned out to at most max_points points, evenly spaced in the fraction
+# of classifiers (always including both ends); max_points=None writes every point.
+def write_lorenz_csv(filename, stats, max_points=1001):
+    x = stats['lorenz_x']
+    y = stats['lorenz_y']
+    if max_points is not None and len(x) > max_points:
+        the_points = np.unique(np.round(np.linspace(0, len(x) - 1, max_points)).astype(np.int64))
+        x = x[the_points]
+        y = y[the_points]
+    with open(filename, 'w') as f:
+        f.write("frac_classifiers,frac_classifications\n")
+        for the_x, the_y in zip(x, y):
+            f.write("%.8f,%.8f\n" % (the_x, the_y))
+
+
+
+# Lines of text saying what share of the classifications the top classifiers did,
+# e.g. "The top 1% of classifiers (12 people) did 35.2% of the classifications."
+def top_share_lines(stats, n_users):
+    the_lines = []
+    for the_fraction, the_share in zip(stats['top_fractions'], stats['top_shares']):
+        n_top = int(np.clip(np.ceil(the_fraction * n_users), min(1, n_users), n_users))
+        the_lines.append("The top %g%% of classifiers (%d people) did %.1f%% of the classifications." % (100. * the_fraction, n_top, 100. * the_share))
+    return the_lines
@@ -0,0 +1,386 @@
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# Reading Panoptes classification exports.
+#
+# An export has these columns:
+# classification_id,user_name,user_id,user_ip,workflow_id,workflow_name,workflow_version,created_at,gold_standard,expert,metadata,annotations,subject_data
+# (newer exports also have subject_ids at the end)
+#
+# The annotations column (and to a lesser extent metadata and subject_data) is JSON and is
+# usually most of the bytes in the file, but none of the scripts here use it. So rather than
+# reading everything and throwing most of it away afterwards, the scripts say which columns
+# they need and the rest are skipped by the CSV parser, which never makes python strings
+# out of them.
+
+import re
+import json
+
+import numpy as np
+import pandas as pd
+
+from stage_profiler import stage
+from partitions import encode_partitions
+from compressed_input import open_export, close_export, compression_of
+from parallel_csv import read_csv_parallel, map_csv_ranges
+
+
+# The dtypes to read each column as. Strings have to be objects, but anything numeric is
+# read as the smallest type that's safe for it.
+# user_id isn't in here on purpose: it's blank for not-logged-in users, so it comes out as
+# float if there are any of those and int if there aren't, and the output files keep
+# whichever it was.
+classification_dtypes = {
+    'classification_id': np.int64,
+    'user_name':         object,
+    'user_ip':           object,
+    'workflow_id':       np.int32,
+    'workflow_name':     object,
+    'workflow_version':  object,   # as a string, so e.g. 12.10 doesn't turn into 12.1
+    'created_at':        object,
+    'gold_standard':     object,
+    'expert':            object,
+    'metadata':          object,
+    'annotations':       object,
+    'subject_data':      object,
+    'subject_ids':       object,
+}
+
+
+
+# the read_csv arguments for reading just the columns in columns, with the dtypes above
+def read_csv_args(columns):
+    columns = list(columns)
+    return {'usecols': columns, 'dtype': dict((q, classification_dtypes[q]) for q in columns if q in classification_dtypes)}
+
+
+
+# Read the classifications file, keeping only the columns in columns (any iterable of column
+# names; they're kept in the order they're in the file).
+# If chunksize is given, this returns an iterator over DataFrames of that many rows instead.
+# The file can be compressed (gzip, bz2, xz, zstd or zip; see compressed_input.py), in which
+# case it's decompressed in the background as it's read.
+# With workers > 1, an uncompressed file read all at once is parsed by that many processes
+# (see parallel_csv.py).
+def read_classifications(classfile_in, columns, chunksize=None, workers=1):
+    the_args = read_csv_args(columns)
+    columns, the_dtypes = the_args['usecols'], the_args['dtype']
+    the_source = open_export(classfile_in)
+    if the_source is None:
+        if workers > 1 and chunksize is None:
+            return read_csv_parallel(classfile_in, workers, the_args)
+        return pd.read_csv(classfile_in, usecols=columns, dtype=the_dtypes, chunksize=chunksize)
+
+    if chunksize is not None:
+        return chunks_then_close(pd.read_csv(the_source['file'], usecols=columns, dtype=the_dtypes, chunksize=chunksize), the_source)
+    # (if the file is cut short, the parser will probably complain first, but the real problem
+    # is the one close_export() raises)
+    try:
+        return pd.read_csv(the_source['file'], usecols=columns, dtype=the_dtypes)
+    finally:
+        close_export(the_source)
+
+
+
+# the chunks from a read_csv() of a compressed file, and then close it (which is when we
+# find out if it was all there; see above)
+def chunks_then_close(the_reader, the_source):
+    try:
+        for chunk in the_reader:
+            yield chunk
+    finally:
+        close_export(the_source)
+
+
+
+# Pull some fields out of the metadata column (by default started_at and finished_at,
+# which are what we use to work out how long each classification took).
+#
+# json.loads on every row makes a whole python dict per classification just so we can
+# take 2 strings out of it, and on a big export it's the slowest thing we do before we even
+# get to the sessions. The fields we want are plain strings, so instead we find them with a
+# regular expression, which is several times faster. Anything the regex can't handle
+# (e.g. the value has escaped characters in it, or isn't a string) falls back to a full
+# json.loads for just those rows.
+#
+# Returns a DataFrame with one column per key (with the same index as metadata; NaN if the
+# key isn't there at all) and the number of rows that needed the full JSON decoding.
+def extract_metadata_fields(metadata, keys=('started_at', 'finished_at')):
+    metadata = pd.Series(metadata)
+    the_strings = metadata.fillna('').values
+
+    fields = {}
+    for key in keys:
+        the_regex = re.compile(r'"%s"\s*:\s*"([^"\\]*)"' % re.escape(key))
+        found = [the_regex.search(q) for q in the_strings]
+        fields[key] = np.array([q.group(1) if q is not None else np.nan for q in found], dtype=object)
+
+    # the rows where we didn't get everything
+    missed = metadata.notnull().values & np.any([pd.isnull(fields[key]) for key in keys], axis=0)
+    n_fallback = int(missed.sum())
+    if n_fallback > 0:
+        the_json = [json.loads(q) for q in the_strings[missed]]
+        for key in keys:
+            fields[key][missed] = [np.nan if q.get(key) is None else q.get(key) for q in the_json]
+
+    return pd.DataFrame(fields, index=metadata.index, columns=list(keys)), n_fallback
+
+
+
+# Parse a column of timestamp strings (created_at, or started_at/finished_at from the metadata)
+# into int64 nanoseconds since 1970 (UTC), with missing values as NaT.
+#
+# The exports use a few ISO-8601-like formats:
+#   created_at:               2016-01-01 12:34:56 UTC
+#   started_at, finished_at:  2016-01-01T12:34:55.123Z
+# Trying pd.to_datetime with one format after another means parsing the whole column again
+# every time a format doesn't work, and the last resort (no format at all) is very slow.
+# Instead:
+#   - each distinct string is only parsed once (created_at only has 1-second resolution,
+#     so lots of classifications share the same one)
+#   - a sample of the strings is checked to see if the column is in one of the formats above;
+#     if it is, the strings are rewritten in the form numpy parses directly and converted all
+#     in one go
+#   - anything that isn't (in the sample or afterwards) is handed to pd.Timestamp one
+#     string at a time, which can cope with nearly anything but is slow
+#
+# Returns the array of timestamps and the number of rows that had to take the slow path.
+iso_timestamp = re.compile(r'^(\d{4}-\d{2}-\d{2})[ T](\d{2}:\d{2}:\d{2}(?:\.\d{1,9})?)(?: ?UTC|Z| ?\+00:?00)?$')
+
+def parse_timestamps(the_strings, sample_size=1000):
+    the_codes, the_uniques = pd.factorize(np.asarray(the_strings, dtype=object))
+    the_uniques = np.asarray(the_uniques, dtype=object)
+    n_uniques = len(the_uniques)
+    unique_ts = np.empty(n_uniques, dtype='datetime64[ns]')
+    unique_ts[:] = np.datetime64('NaT')
+
+    # check a sample of the strings to see if we can use the fast path at all
+    sample = the_uniques[np.linspace(0, n_uniques-1, min(sample_size, n_uniques)).astype(int)] if n_uniques > 0 else the_uniques
+    fast_format = all(iso_timestamp.match(q) is not None for q in sample)
+
+    slow = np.ones(n_uniques, dtype=bool)
+    if fast_format:
+        matched = [iso_timestamp.match(q) for q in the_uniques]
+        slow = np.array([q is None for q in matched], dtype=bool)
+        unique_ts[~slow] = np.array([q.group(1) + 'T' + q.group(2) for q in matched if q is not None], dtype='datetime64[ns]')
+
+    for i in np.flatnonzero(slow):
+        try:
+            unique_ts[i] = pd.Timestamp(the_uniques[i]).value
+        except (ValueError, TypeError):
+            pass
+
+    # back to 1 value per row
+    timestamps = unique_ts.view(np.int64)[the_codes]
+    timestamps[the_codes < 0] = np.datetime64('NaT').view(np.int64)
+    n_fallback = int(np.sum(np.bincount(the_codes[the_codes >= 0], minlength=n_uniques)[slow])) if n_uniques > 0 else 0
+
+    return timestamps, n_fallback
+
+
+
+# Who's logged in: a not-logged-in user's user_name is "not-logged-in-" + a hash of their IP
+# (and they have no user_id). Returns a bool array, True for each registered user.
+unregistered_prefix = "not-logged-in"
+
+def is_registered(user_names):
+    return np.array([not q.startswith(unregistered_prefix) for q in user_names], dtype=bool)
+
+
+
+# Integer codes for the subjects.
+#
+# subject_data is a whole JSON blob per classification, e.g.
+#   {"1234567": {"retired": null, "Filename": "image_0001.jpg"}}
+# but all we ever do with it is count the distinct subjects, and it's the same subject whatever
+# else is in the blob (which can change, e.g. once a subject is retired). The subject id is the
+# key, so: each distinct string is looked at once (pd.factorize hashes them in C), its id is
+# pulled off the front with a regular expression (or json.loads, if that doesn't work), and the
+# ids are what's coded.
+#
+# Returns
+#   subject_code - int32 code of each classification's subject (-1 if subject_data is blank
+#                  or has no numeric key)
+#   subject_ids  - the subject id of each code
+#   n_fallback   - the number of distinct subject_data strings that needed json.loads
+subject_id_regex = re.compile(r'^\s*\{\s*"(\d+)"\s*:')
+
+def encode_subjects(subject_data):
+    string_code, the_strings = pd.factorize(np.asarray(subject_data, dtype=object))
+    string_ids = np.zeros(len(the_strings), dtype=np.int64) - 1
+    n_fallback = 0
+    for i, the_string in enumerate(the_strings):
+        found = subject_id_regex.match(the_string)
+        if found is not None:
+            string_ids[i] = int(found.group(1))
+            continue
+        n_fallback += 1
+        try:
+            the_keys = [q for q in json.loads(the_string) if q.isdigit()]
+        except (ValueError, TypeError, AttributeError):
+            the_keys = []
+        if len(the_keys) > 0:
+            string_ids[i] = int(the_keys[0])
+
+    # strings with no id aren't a subject; the extra -1 on the end is for the blank ones
+    has_id = string_ids >= 0
+    id_code = np.zeros(len(string_ids) + 1, dtype=np.int32) - 1
+    id_code[np.flatnonzero(has_id)], subject_ids = pd.factorize(string_ids[has_id])
+
+    return id_code[string_code], np.asarray(subject_ids, dtype=np.int64), n_fallback
+
+
+
+# The number of classifications of each subject, from the subject codes above.
+# (classifications with no subject count as one more subject, same as .unique() would count them)
+def subject_counts(subject_code):
+    subj_class = np.bincount(subject_code[subject_code >= 0])
+    if np.any(subject_code < 0):
+        subj_class = np.append(subj_class, np.sum(subject_code < 0))
+    return subj_class
+
+
+
+# The columns read_compact() needs from the file
+compact_cols_read = ["user_name", "user_id", "workflow_id", "workflow_version", "created_at", "metadata", "subject_data"]
+
+# Read a classifications file into the handful of arrays the analysis scripts actually use,
+# with 1 element per classification (in the order they're in the file):
+#   user_code    - int32 index into user_names (which is sorted, same order as a groupby)
+#   created_at   - int64 nanoseconds
+#   started_at   - int64 nanoseconds, from the metadata
+#   finished_at  - int64 nanoseconds, from the metadata
+#   subject_code - int32 code for each distinct subject (-1 if blank); see encode_subjects()
+#   workflow_code - int32 code for each distinct (workflow_id, workflow_version) pair
+# plus, once per user (in user_names order)
+#   user_names      - the distinct user names
+#   user_ids        - the Zooniverse user id as read from the file (NaN if not logged in),
+#                     from the user's first classification in the file
+#   user_registered - whether they're logged in
+# and
+#   subject_ids  - the subject id of each subject_code
+#   workflow_ids, workflow_versions - the workflow_id and workflow_version of each workflow_code
+#                  (sorted; see partitions.py)
+#   n_subjects   - the number of distinct subjects
+#   n_meta_fallback, n_slow_timestamps, n_subject_fallback - how many rows (or distinct
+#                  subject_data strings) needed the slow paths above
+# Returns a dict with those keys.
+# If profile is given (see stage_profiler.py), the time etc. for each step is recorded in it.
+# With workers > 1, an uncompressed file is split into that many ranges (see parallel_csv.py),
+# and each worker parses its range and turns it into these arrays itself, so only the arrays
+# come back; they're put together with merge_compact(). (The profile then just has the read,
+# which includes all of that, and the merge.)
+def read_compact(classfile_in, profile=None, workers=1):
+    if workers > 1 and compression_of(classfile_in) is None:
+        with stage(profile, 'read') as the_stage:
+            the_parts = map_csv_ranges(classfile_in, workers, read_csv_args(compact_cols_read), compact_from_frame)
+            the_stage['rows'] = sum(len(q['user_code']) for q in the_parts)
+        with stage(profile, 'merge', the_stage['rows']):
+            return merge_compact(the_parts)
+
+    with stage(profile, 'read') as the_stage:
+        classifications = read_classifications(classfile_in, compact_cols_read)
+        the_stage['rows'] = len(classifications)
+
+    return compact_from_frame(classifications, profile)
+
+
+
+# The same as read_compact(), from a DataFrame of (at least) the compact_cols_read columns
+# that's already been read, e.g. one chunk of a file.
+def compact_from_frame(classifications, profile=None):
+    n_rows = len(classifications)
+    with stage(profile, 'metadata decode', n_rows):
+        meta_fields, n_meta_fallback = extract_metadata_fields(classifications.metadata, ('started_at', 'finished_at'))
+
+    compact = {}
+    n_slow_timestamps = {}
+    with stage(profile, 'timestamp parse', n_rows):
+        for the_col, the_strings in [('created_at',  classifications['created_at']),
+                                     ('started_at',  meta_fields['started_at']),
+                                     ('finished_at', meta_fields['finished_at'])]:
+            compact[the_col], n_slow_timestamps[the_col] = parse_timestamps(the_strings)
+
+    with stage(profile, 'factorize', n_rows):
+        user_code, user_names = pd.factorize(classifications.user_name.values, sort=True)
+        subject_code, subject_ids, n_subject_fallback = encode_subjects(classifications.subject_data.values)
+        workflow_code, workflow_keys = encode_partitions(classifications.workflow_id.values, classifications.workflow_version.values, 'workflow_version')
+
+        # the position of each user's first classification: assigning in reverse means the
+        # first one is the one that's left
+        first_row = np.zeros(len(user_names), dtype=np.int64)
+        first_row[user_code[::-1]] = np.arange(n_rows - 1, -1, -1)
+
+    compact['user_code']       = user_code.astype(np.int32)
+    compact['user_names']      = np.asarray(user_names, dtype=object)
+    compact['user_ids']        = classifications.user_id.values[first_row]
+    compact['user_registered'] = is_registered(compact['user_names'])
+    compact['subject_code']    = subject_code
+    compact['subject_ids']     = subject_ids
+    compact['workflow_code']     = workflow_code
+    compact['workflow_ids']      = np.array([q[0] for q in workflow_keys], dtype=np.int64)
+    compact['workflow_versions'] = np.array([q[1] for q in workflow_keys], dtype=object)
+    # (a blank subject_data counts as a subject of its own, same as .unique() would count it)
+    compact['n_subjects']      = len(subject_ids) + int(np.any(subject_code < 0))
+    compact['n_meta_fallback']    = n_meta_fallback
+    compact['n_slow_timestamps']  = n_slow_timestamps
+    compact['n_subject_fallback'] = n_subject_fallback
+
+    return compact
+
+
+
+# The compact of a whole file from the compacts of consecutive pieces of it, in file order (e.g.
+# from compact_from_frame() on each range in read_compact()). Each piece's users, subjects and
+# workflows are numbered on their own, so each piece's codes are mapped onto the codes of the
+# whole file, which come out the same as compact_from_frame() on the whole file would give:
+# users in name order (with the user_id from their first piece), subjects in the order they
+# first turn up, and workflows sorted.
+# (n_subject_fallback is the sum over the pieces, so a subject_data string that needed
+# json.loads in more than one piece counts once for each.)
+def merge_compact(the_parts):
+    if len(the_parts) == 1:
+        return the_parts[0]
+
+    compact = {}
+    for the_col in ['created_at', 'started_at', 'finished_at']:
+        compact[the_col] = np.concatenate([q[the_col] for q in the_parts])
+
+    # the code of each piece's j'th user (subject, workflow) is at offsets[i] + j of the codes
+    # of all the pieces' ones put together
+    def piece_codes(the_key, whole_code):
+        offsets = np.r_[0, np.cumsum([len(q[the_key]) for q in the_parts])].astype(np.int64)
+        return [whole_code[offsets[i]:offsets[i+1]] for i in range(len(the_parts))]
+
+    user_code, user_names = pd.factorize(np.concatenate([q['user_names'] for q in the_parts]), sort=True)
+    # (the first piece a user is in has their first classification; see compact_from_frame())
+    first_piece = np.zeros(len(user_names), dtype=np.int64)
+    first_piece[user_code[::-1]] = np.arange(len(user_code) - 1, -1, -1)
+    compact['user_code']       = np.concatenate([r[q['user_code']] for q, r in zip(the_parts, piece_codes('user_names', user_code))]).astype(np.int32)
+    compact['user_names']      = np.asarray(user_names, dtype=object)
+    # (float if any piece's were, as reading the whole file would give)
+    compact['user_ids']        = np.concatenate([q['user_ids'] for q in the_parts])[first_piece]
+    compact['user_registered'] = is_registered(compact['user_names'])
+
+    # (-1, no subject, stays -1: it picks the -1 added on the end)
+    subject_code, subject_ids = pd.factorize(np.concatenate([q['subject_ids'] for q in the_parts]))
+    compact['subject_code'] = np.concatenate([np.r_[r, -1][q['subject_code']] for q, r in zip(the_parts, piece_codes('subject_ids', subject_code))]).astype(np.int32)
+    compact['subject_ids']  = np.asarray(subject_ids, dtype=np.int64)
+
+    workflow_code, workflow_keys = encode_partitions(np.concatenate([q['workflow_ids'] for q in the_parts]),
+                                                     np.concatenate([q['workflow_versions'] for q in the_parts]), 'workflow_version')
+    compact['workflow_code']     = np.concatenate([r[q['workflow_code']] for q, r in zip(the_parts, piece_codes('workflow_ids', workflow_code))])
+    compact['workflow_ids']      = np.array([q[0] for q in workflow_keys], dtype=np.int64)
+    compact['workflow_versions'] = np.array([q[1] for q in workflow_keys], dtype=object)
+
+    compact['n_subjects']         = len(subject_ids) + int(np.any(compact['subject_code'] < 0))
+    compact['n_meta_fallback']    = sum(q['n_meta_fallback'] for q in the_parts)
+    compact['n_slow_timestamps']  = dict((r, sum(q['n_slow_timestamps'][r] for q in the_parts)) for r in the_parts[0]['n_slow_timestamps'])
+    compact['n_subject_fallback'] = sum(q['n_subject_fallback'] for q in the_parts)
+
+    return compact
+
+
+
+# YYYY-MM-DD of an int64 nanosecond timestamp (UTC)
+def day_string(the_ts):
+    return str(np.datetime64(int(the_ts), 'ns').astype('datetime64[D]'))
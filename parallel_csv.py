@@ -0,0 +1,143 @@
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# Reading one (uncompressed) export with several processes at once (see
+# panoptes_io.read_compact() and --workers in both scripts).
+#
+# pd.read_csv only uses one core. Each process can parse its own byte range of the file, but
+# the ranges have to start and end at the start of a record, and the JSON columns (metadata,
+# annotations, subject_data) are quoted and can have newlines in them, so a newline isn't
+# always the end of a record. What is always true (as long as quotes inside fields are
+# doubled, as in any proper CSV) is that a newline ends a record if and only if there's an even
+# number of quotes before it in the file. So:
+#   1. each process counts the quotes in its share of the file, which gives the number of
+#      quotes before each of the split points (from the counts before it)
+#   2. each split point is moved forward to just after the first newline with an even number
+#      of quotes before it (only a little of the file has to be looked at for this)
+#   3. each process parses its (now whole-record) range with read_csv, with the same columns
+#      and dtypes as reading the whole file, and the results are put together in order
+# Both of the passes over the whole file are done in parallel.
+#
+# Sending a DataFrame back to the parent means pickling all of its object columns (JSON, user
+# names, timestamp strings), which costs about as much as parsing them. So map_csv_ranges()
+# hands each range's DataFrame to a function in the worker (e.g. panoptes_io.compact_from_frame(),
+# which turns it into a few numeric arrays) and only sends back what that returns.
+
+import io
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+
+# below this there's no point splitting the file up
+min_range_bytes = 4 << 20
+
+# how much to read at a time when counting quotes
+scan_block = 16 << 20
+
+# and when looking for a record boundary (doubled each time one isn't found)
+sync_block = 64 << 10
+
+quote_char = ord('"')
+newline_char = ord('\n')
+
+
+
+# the number of quotes in bytes start to end of the file
+def count_quotes(the_args):
+    classfile_in, start, end = the_args
+    the_file = np.memmap(classfile_in, dtype=np.uint8, mode='r')
+    n_quotes = 0
+    for the_start in range(start, end, scan_block):
+        n_quotes += int(np.count_nonzero(the_file[the_start:min(the_start + scan_block, end)] == quote_char))
+    return n_quotes
+
+
+
+# The byte offset just after the first newline at or after offset that ends a record (i.e.
+# with an even number of quotes before it, counting n_quotes_before up to offset), or the
+# length of the file if there isn't one.
+def next_record_start(the_file, offset, n_quotes_before):
+    the_parity = n_quotes_before % 2
+    the_block = sync_block
+    while offset < len(the_file):
+        the_bytes = np.asarray(the_file[offset:offset + the_block])
+        # the number of quotes before (and including) each byte
+        in_quotes = (the_parity + np.cumsum(the_bytes == quote_char)) % 2
+        ends = np.flatnonzero((the_bytes == newline_char) & (in_quotes == 0))
+        if len(ends) > 0:
+            return offset + int(ends[0]) + 1
+        the_parity = int(in_quotes[-1])
+        offset += len(the_bytes)
+        the_block *= 2
+    return len(the_file)
+
+
+
+# parse bytes start to end of the file (whole records, without the header) with read_csv, and
+# return the_function of the DataFrame (or the DataFrame itself if the_function is None)
+def parse_range(the_args):
+    classfile_in, start, end, names, read_csv_args, the_function = the_args
+    with open(classfile_in, 'rb') as f:
+        f.seek(start)
+        the_bytes = f.read(end - start)
+    the_frame = pd.read_csv(io.BytesIO(the_bytes), header=None, names=names, **read_csv_args)
+    return the_frame if the_function is None else the_function(the_frame)
+
+
+
+# Split the data part of the file (after the header, which ends at data_start) into n_ranges
+# ranges of whole records, counting the quotes with pool (or in this process if it's None).
+# Returns a list of (start, end) byte offsets.
+def record_ranges(classfile_in, data_start, n_ranges, pool=None):
+    the_file = np.memmap(classfile_in, dtype=np.uint8, mode='r')
+    the_splits = np.linspace(data_start, len(the_file), n_ranges + 1).astype(np.int64)
+    the_args = [(classfile_in, int(the_splits[i]), int(the_splits[i+1])) for i in range(n_ranges)]
+    the_counts = pool.map(count_quotes, the_args) if pool is not None else [count_quotes(q) for q in the_args]
+    n_quotes_before = np.r_[0, np.cumsum(the_counts)]
+
+    the_starts = [data_start]
+    for i in range(1, n_ranges):
+        the_starts.append(max(the_starts[-1], next_record_start(the_file, int(the_splits[i]), int(n_quotes_before[i]))))
+    the_ends = the_starts[1:] + [len(the_file)]
+    return [(q, r) for q, r in zip(the_starts, the_ends) if r > q]
+
+
+
+# Parse classfile_in in up to workers processes at once, each doing
+# the_function(pd.read_csv(its range, **read_csv_args)) (read_csv_args being e.g. usecols and
+# dtype; the_function has to be a module-level function, so it can be sent to the workers).
+# Returns what the_function returned for each range, in file order. (A file too small to be
+# worth splitting is one range, read in this process.)
+# Columns whose dtype depends on what's in them, like user_id, can come out differently in
+# each range (float in a range with a blank in it, int in one without), so the_function
+# shouldn't depend on that.
+def map_csv_ranges(classfile_in, workers, read_csv_args, the_function):
+    the_file = np.memmap(classfile_in, dtype=np.uint8, mode='r')
+    data_start = next_record_start(the_file, 0, 0)
+    # (the header as a row of data, as older pandas can't read 0 rows)
+    names = list(pd.read_csv(io.BytesIO(the_file[:data_start].tostring()), header=None, dtype=object).iloc[0])
+    n_ranges = int(min(workers, max(1, (len(the_file) - data_start) // min_range_bytes)))
+    del the_file
+    if n_ranges <= 1:
+        the_frame = pd.read_csv(classfile_in, **read_csv_args)
+        return [the_frame if the_function is None else the_function(the_frame)]
+
+    pool = multiprocessing.Pool(n_ranges)
+    try:
+        the_ranges = record_ranges(classfile_in, data_start, n_ranges, pool)
+        return pool.map(parse_range, [(classfile_in, q, r, names, read_csv_args, the_function) for q, r in the_ranges])
+    finally:
+        pool.close()
+        pool.join()
+
+
+
+# The same as pd.read_csv(classfile_in, **read_csv_args), parsed by up to workers processes at
+# once. This sends whole DataFrames back from the workers, so it's only faster for numeric
+# columns; use map_csv_ranges() to boil each range down in its worker first.
+# (Columns whose dtype depends on what's in them, like user_id, come out the same as reading
+# the whole file in one go: one part with a blank in it makes the whole column float.)
+def read_csv_parallel(classfile_in, workers, read_csv_args):
+    the_frames = map_csv_ranges(classfile_in, workers, read_csv_args, None)
+    return the_frames[0] if len(the_frames) == 1 else pd.concat(the_frames, ignore_index=True)
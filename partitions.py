@@ -0,0 +1,92 @@
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# Splitting the stats up by workflow (--by workflow_id) or by workflow version
+# (--by workflow_version) in both scripts.
+#
+# Rather than reading the file once per workflow, or looping over subsets of it, each
+# classification gets an integer partition code alongside its user (and subject) code, and
+# the counts are taken over (partition, user) pairs packed into a single integer. So the
+# per-partition counts come out of the same kind of factorize + bincount as the overall ones,
+# sorted by partition and then by user.
+#
+# Version numbers are only meaningful within a workflow, so --by workflow_version splits by
+# (workflow_id, workflow_version) pairs.
+
+import numpy as np
+import pandas as pd
+
+
+# what can go after --by, and the columns each one splits on
+partition_columns = {'workflow_id':      ['workflow_id'],
+                     'workflow_version': ['workflow_id', 'workflow_version']}
+
+
+
+# workflow versions sort as numbers, so 12.9 comes before 12.10 (anything odd goes at the end)
+def version_sort_key(the_version):
+    try:
+        return (0, tuple(int(q) for q in str(the_version).split('.')), '')
+    except ValueError:
+        return (1, (), str(the_version))
+
+
+
+# the order partitions are listed in: by workflow_id, then by workflow_version (see above)
+def partition_sort_key(the_key):
+    return (the_key[0],) + tuple(version_sort_key(q) for q in the_key[1:])
+
+
+
+# Integer codes for the partitions.
+# workflow_id and workflow_version are per classification (or per anything else: see
+# panoptes_io.compact_from_frame(), which keeps one code per (workflow_id, workflow_version)
+# pair); by is one of the keys of partition_columns. (workflow_version can be None for
+# --by workflow_id.)
+# Returns the int32 code of each element (in the order of the keys) and the keys, a list of
+# tuples of the values of partition_columns[by], sorted.
+def encode_partitions(workflow_id, workflow_version, by):
+    wf_code, wf_uniques = pd.factorize(np.asarray(workflow_id), sort=True)
+    if by == 'workflow_id':
+        return wf_code.astype(np.int32), [(q,) for q in wf_uniques]
+
+    # A missing version (or id) has a code of -1, so the codes are packed +1, with 0 for missing.
+    # Its key has np.nan itself, so that the keys from different chunks of a file match up (the
+    # same nan object is equal to itself in a tuple, and it's the same dict key).
+    v_code, v_uniques = pd.factorize(np.asarray(workflow_version, dtype=object))
+    n_v = len(v_uniques) + 1
+    pair_code, pair_uniques = pd.factorize((wf_code.astype(np.int64) + 1) * n_v + (v_code + 1))
+    wf_values = [np.nan] + list(wf_uniques)
+    v_values = [np.nan] + list(v_uniques)
+    the_keys = [(wf_values[q // n_v], v_values[q % n_v]) for q in pair_uniques]
+
+    # put the keys in order and renumber to match
+    order = sorted(range(len(the_keys)), key=lambda i: partition_sort_key(the_keys[i]))
+    renumber = np.empty(len(order), dtype=np.int32)
+    renumber[order] = np.arange(len(order))
+    return renumber[pair_code], [the_keys[i] for i in order]
+
+
+
+# e.g. "workflow_id 1234, workflow_version 12.34"
+def partition_label(the_key, by):
+    return ", ".join("%s %s" % (q, r) for q, r in zip(partition_columns[by], the_key))
+
+
+
+# The number of elements with each (partition, code) pair that occurs, where partition_code
+# is from encode_partitions() and code is from 0 to n_codes-1 (e.g. a user code). Codes of
+# -1 (e.g. a blank subject) count as a code of their own.
+# Returns arrays of the partition, code and count of each pair, sorted by partition and code.
+def counts_by_partition(partition_code, code, n_codes):
+    # (+1 so -1 fits)
+    the_pairs = np.asarray(partition_code, dtype=np.int64) * (n_codes + 1) + (np.asarray(code, dtype=np.int64) + 1)
+    pair_code, pair_uniques = pd.factorize(the_pairs, sort=True)
+    pair_uniques = np.asarray(pair_uniques, dtype=np.int64)
+    return pair_uniques // (n_codes + 1), pair_uniques % (n_codes + 1) - 1, np.bincount(pair_code, minlength=len(pair_uniques))
+
+
+
+# the slice of the sorted arrays from counts_by_partition() for each of n_parts partitions
+def partition_slices(the_parts, n_parts):
+    the_edges = np.searchsorted(the_parts, np.arange(n_parts + 1))
+    return [slice(the_edges[i], the_edges[i + 1]) for i in range(n_parts)]
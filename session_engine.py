@@ -0,0 +1,663 @@
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# Whole-frame session statistics for sessions_inproj_byuser.py
+#
+# The original version of this computed everything one user at a time, via
+# by_user.apply(sessionstats): for each user it built a new DataFrame, sorted it,
+# looped over the session start times to number the sessions and then did another
+# groupby on the session number. That's fine for a few thousand users but it's
+# ~90 seconds for 175,000 classifications, and exports with tens of millions of rows
+# would take days.
+#
+# Here instead we:
+#   1. sort the whole thing once, by (user, created_at)
+#   2. take one diff of created_at to find the gaps between classifications
+#   3. number every session in the file with a cumulative sum over the session starts
+#   4. compute all the per-session and per-user numbers with grouped reductions
+#      (np.add.reduceat and friends) over contiguous blocks of the sorted arrays
+# so there is no python-level loop over users or sessions anywhere.
+#
+# The results are kept as one typed array per output column (1 element per user) until the
+# output DataFrame is made, once, at the end. The one column that isn't a single number per
+# user, the list of classification counts in each of the user's sessions, is kept as the
+# counts of all the sessions one after another (grouped by user), with n_sessions saying how
+# many belong to each user, and only turned into "[n_1; n_2; ...]" strings at the end (see
+# sessionstats_to_frame()).
+#
+# The definitions of all the output columns are exactly the same as they were in
+# sessionstats(), including the slightly odd bits (e.g. the session break is truncated
+# to an integer number of minutes, and the mean/median classification lengths are
+# truncated to an integer number of nanoseconds before converting to minutes), so the
+# output file is the same as it was.
+
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+
+# timestamps & timediffs are in nanoseconds below but we want outputs in hours or minutes, depending
+ns2hours = 1.0 / (1.0e9*60.*60.)
+ns2mins  = 1.0 / (1.0e9*60.)
+ns_per_day = 24 * 60 * 60 * 10**9
+
+
+# The output columns, in the order they're written to the file.
+# (the index of the output is the user_name)
+col_order = ['user_id',
+        'n_class',
+        'n_sessions',
+        'n_days',
+        'first_day',
+        'last_day',
+        'tdiff_firstlast_hours',
+        'time_spent_classifying_total_minutes',
+        'class_per_session_min',
+        'class_per_session_max',
+        'class_per_session_med',
+        'class_per_session_mean',
+        'class_length_mean_overall',
+        'class_length_median_overall',
+        'session_length_mean',
+        'session_length_median',
+        'session_length_min',
+        'session_length_max',
+        'which_session_longest',
+        'mean_session_length_first2',
+        'mean_session_length_last2',
+        'mean_class_length_first2',
+        'mean_class_length_last2',
+        'class_count_session_list']
+
+
+
+
+# index of the first element of each run of identical values in an array that's
+# already grouped (i.e. sorted by group)
+def group_starts(sorted_codes):
+    if len(sorted_codes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    is_new = np.empty(len(sorted_codes), dtype=bool)
+    is_new[0] = True
+    np.not_equal(sorted_codes[1:], sorted_codes[:-1], out=is_new[1:])
+    return np.flatnonzero(is_new)
+
+
+
+# median of each group, where the groups are contiguous blocks starting at starts
+# values doesn't need to be sorted within each group; we do that here
+# (the median of an even-length group is the mean of the middle 2 values, same as np.median)
+def grouped_median(values, group_ids, starts, counts):
+    order = np.lexsort((values, group_ids))
+    v = values[order]
+    lo = starts + (counts - 1) // 2
+    hi = starts + counts // 2
+    return (v[lo] + v[hi]) / 2.0
+
+
+
+# sum of each group of floats, where the groups are contiguous blocks starting at starts.
+# Floating-point sums depend on the order you add things up in, and np.add.reduceat doesn't
+# add them up in the same order np.sum does, so the last decimal place can come out different
+# from what the per-user version of this code wrote. So: short groups are added up in order, one
+# position at a time across all groups (which is what np.sum does for < 8 values), and the few
+# long groups are handed to np.sum itself.
+def grouped_float_sum(values, starts, counts):
+    total = np.zeros(len(starts))
+    short = np.flatnonzero(counts < 8)
+    for k in range(int(counts[short].max()) if len(short) > 0 else 0):
+        sel = short[counts[short] > k]
+        total[sel] += values[starts[sel] + k]
+    for i in np.flatnonzero(counts >= 8):
+        total[i] = np.sum(values[starts[i]:starts[i]+counts[i]])
+    return total
+
+
+
+# Sort the classifications by user and then by created_at.
+# It's a stable sort, so classifications with identical created_at stay in the order they
+# were in the file.
+def sort_by_user(user_code, created_at):
+    return np.lexsort((created_at, user_code))
+
+
+
+# Split the classifications into sessions.
+#
+# Inputs are arrays with 1 element per classification:
+#   user_code   - integer code for the user (e.g. from pd.factorize(user_name, sort=True))
+#   created_at  - int64 nanoseconds (e.g. the created_at_ts column viewed as 'i8')
+#   started_at  - int64 nanoseconds (from the metadata)
+#   finished_at - int64 nanoseconds (from the metadata)
+# and session_break is the length of the break (in minutes) that starts a new session.
+#
+# Returns a dict with
+#   order - the order that sorts the classifications by (user, created_at)
+# then 1 element per user (in user_code order) of
+#   user_code, n_class, n_days, first_day & last_day (days since 1970), first_started_at,
+#   last_finished_at, last_created_at, class_length_sum & class_length_median (nanoseconds),
+#   n_sessions
+# and 1 element per session (grouped by user, and in time order within each user) of
+#   session_n_class, session_class_length (the sum of the classification lengths, ns),
+#   session_start & session_end (the created_at of the first and last classification)
+# plus, with with_sessions=True, session_class_length_median (ns), which takes another sort.
+#
+# With presorted=True the classifications are taken to be sorted by (user, created_at) already
+# (e.g. from session_intermediate.py), so there's no sort and the arrays aren't copied; order
+# is then slice(None).
+def sessionize(user_code, created_at, started_at, finished_at, session_break, with_sessions=False, presorted=False):
+    return sessionize_sweep(user_code, created_at, started_at, finished_at, [session_break], with_sessions, presorted)[0]
+
+
+
+# The same as sessionize(), for each of a list of session breaks at once; returns a list of
+# the dicts sessionize() returns, one per break.
+#
+# Almost all of the work (the sort, the gaps, and everything per user that doesn't depend on
+# where the sessions are, like the number of days and the median classification length) is
+# done once; each break then only costs the per-session reductions. The per-user arrays are
+# shared between the dicts, so don't change them in place.
+def sessionize_sweep(user_code, created_at, started_at, finished_at, session_breaks, with_sessions=False, presorted=False):
+
+    # 1 global sort, then everything below works on contiguous blocks
+    # (indexing with slice(None) is just a view)
+    order = slice(None) if presorted else sort_by_user(user_code, created_at)
+    u  = np.asarray(user_code)[order]
+    ts = np.asarray(created_at, dtype=np.int64)[order]
+    started_at  = np.asarray(started_at,  dtype=np.int64)[order]
+    finished_at = np.asarray(finished_at, dtype=np.int64)[order]
+    class_length = finished_at - started_at
+
+    n_rows = len(u)
+    ustart = group_starts(u)
+    uend   = np.r_[ustart[1:], n_rows] - 1
+    n_class = np.diff(np.r_[ustart, n_rows])
+
+    # the gaps between classifications; the first classification of each user starts a session
+    # no matter what, so its gap doesn't matter
+    duration = np.zeros(n_rows, dtype=np.int64)
+    duration[1:] = ts[1:] - ts[:-1]
+    user_first = np.zeros(n_rows, dtype=bool)
+    user_first[ustart] = True
+
+    # number of unique days on which each user classified
+    # created_at is sorted within each user so a new day is just a change of day
+    day = ts // ns_per_day
+    new_day = user_first.copy()
+    new_day[1:] |= (day[1:] != day[:-1])
+
+    per_user = {}
+    per_user['order']               = order
+    per_user['user_code']           = u[ustart]
+    per_user['n_class']             = n_class
+    per_user['n_days']              = grouped_sum(new_day.astype(np.int64), ustart)
+    per_user['first_day']           = day[ustart]
+    per_user['last_day']            = day[uend]
+    per_user['first_started_at']    = started_at[ustart]
+    per_user['last_finished_at']    = finished_at[uend]
+    per_user['last_created_at']     = ts[uend]
+    per_user['class_length_sum']    = grouped_sum(class_length, ustart)
+    per_user['class_length_median'] = grouped_median(class_length, np.repeat(np.arange(len(ustart)), n_class), ustart, n_class)
+
+    all_sessions = []
+    for session_break in session_breaks:
+        # Figure out where new sessions start: a break of at least session_break minutes.
+        # (whole minutes only, as in np.timedelta64(int(session_break), 'm'))
+        # Sessions are counted by their unique start times, so if the break is < 1 minute
+        # a classification at the same time as the one before it doesn't start another session.
+        thefirst = user_first | is_session_break(duration, session_break)
+
+        # sessions of the same user are contiguous
+        sstart = np.flatnonzero(thefirst)
+        send   = np.r_[sstart[1:], n_rows] - 1
+        user_sstart = group_starts(u[sstart])
+
+        sessions = dict(per_user)
+        sessions['n_sessions']           = np.diff(np.r_[user_sstart, len(sstart)])
+        sessions['session_n_class']      = np.diff(np.r_[sstart, n_rows])
+        sessions['session_class_length'] = grouped_sum(class_length, sstart)
+        sessions['session_start']        = ts[sstart]
+        sessions['session_end']          = ts[send]
+        if with_sessions:
+            sessions['session_class_length_median'] = grouped_median(class_length, np.cumsum(thefirst) - 1, sstart,
+                                                                     sessions['session_n_class'])
+        all_sessions.append(sessions)
+    return all_sessions
+
+
+
+# Which gaps between consecutive classifications by the same user start a new session
+# (see sessionize())
+def is_session_break(duration, session_break):
+    session_break_ns = int(session_break) * 60 * 10**9
+    return (duration >= session_break_ns) & (duration != 0)
+
+
+
+# np.add.reduceat, except it copes with there being no groups at all
+def grouped_sum(values, starts):
+    if len(starts) == 0:
+        return np.zeros(0, dtype=values.dtype)
+    return np.add.reduceat(values, starts)
+
+
+
+# first element of each group of lengths counts, for groups that are stored one after another
+# (plus one more at the end, for the end of the last group)
+def offsets_from_counts(counts):
+    return np.r_[0, np.cumsum(counts)].astype(np.int64)
+
+
+
+# the indices of all the elements of groups the_groups, where group i is offsets[i]:offsets[i+1]
+def group_rows(offsets, the_groups):
+    return range_rows(offsets[the_groups], offsets[the_groups + 1] - offsets[the_groups])
+
+
+
+# the indices starts[0]:starts[0]+counts[0], then starts[1]:starts[1]+counts[1], ... one after another
+def range_rows(starts, counts):
+    counts = np.asarray(counts, dtype=np.int64)
+    return np.repeat(np.asarray(starts, dtype=np.int64) - offsets_from_counts(counts)[:-1], counts) + np.arange(np.sum(counts))
+
+
+
+# Compute the output columns (except user_id) from the dict sessionize() returns.
+# (or anything else with the same per-user and per-session arrays; the order isn't needed)
+# Returns a dict of arrays with one element per user, in the same order, with the keys
+# in col_order (except class_count_session_list) plus 'user_code', which says which user each
+# element belongs to, and class_count_session, the classification count of every session
+# (see per_session_keys). If sessions has session_class_length_median (see sessionize()), the
+# rest of the per-session arrays are passed on too, for session_table().
+def userstats_from_sessions(sessions):
+
+    n_class    = sessions['n_class']
+    n_sessions = sessions['n_sessions']
+    n_sess_tot = int(np.sum(n_sessions))
+    user_sstart = np.r_[0, np.cumsum(n_sessions)[:-1]].astype(np.int64) if len(n_sessions) > 0 else np.zeros(0, dtype=np.int64)
+    user_slast  = user_sstart + n_sessions - 1
+    # each session's number within the user's sessions, counting from 1
+    session_in_user = np.arange(n_sess_tot) - np.repeat(user_sstart, n_sessions) + 1
+    session_user_idx = np.repeat(np.arange(len(user_sstart)), n_sessions)
+
+    # classification counts and total classification time (in minutes) for each session
+    class_count_session = sessions['session_n_class']
+    class_length_total  = sessions['session_class_length'] * ns2mins
+
+    first_day = (sessions['first_day'] * ns_per_day).astype('datetime64[ns]')
+    last_day  = (sessions['last_day']  * ns_per_day).astype('datetime64[ns]')
+
+    #front-end version; back-end version uses 'created_at'
+    tdiff_firstlast_hours = ((sessions['last_finished_at'] - sessions['first_started_at']) / 1.0e9) / 3600.
+
+    # timedeltas are just ints, but interpreted a certain way; the mean and median here are
+    # truncated to whole nanoseconds before converting, as they were when computed on timedeltas
+    class_length_mean_overall   = np.trunc(sessions['class_length_sum'] / n_class.astype(float)) * ns2mins
+    class_length_median_overall = np.trunc(sessions['class_length_median']) * ns2mins
+
+    # basic classification count stats per session
+    if n_sess_tot > 0:
+        count_min  = np.minimum.reduceat(class_count_session, user_sstart)
+        count_max  = np.maximum.reduceat(class_count_session, user_sstart)
+        count_mean = np.add.reduceat(class_count_session.astype(float), user_sstart) / n_sessions
+        session_length_min   = np.minimum.reduceat(class_length_total, user_sstart)
+        session_length_max   = np.maximum.reduceat(class_length_total, user_sstart)
+    else:
+        count_min = count_max = np.zeros(0, dtype=np.int64)
+        count_mean = session_length_min = session_length_max = np.zeros(0)
+    count_med = grouped_median(class_count_session, session_user_idx, user_sstart, n_sessions)
+    session_length_total  = grouped_float_sum(class_length_total, user_sstart, n_sessions)
+    session_length_mean   = session_length_total / n_sessions
+    session_length_median = grouped_median(class_length_total, session_user_idx, user_sstart, n_sessions)
+
+    # the first of the user's sessions that has the max length
+    is_longest = class_length_total == np.repeat(session_length_max, n_sessions)
+    longest_idx = np.where(is_longest, session_in_user, n_sess_tot + 1)
+    which_session_longest = np.minimum.reduceat(longest_idx, user_sstart) if n_sess_tot > 0 else np.zeros(0, dtype=np.int64)
+
+    # get durations of first 2 and last 2 sessions
+    # Note: this idea comes from Sauermann & Franzoni (2015) and their related work
+    # http://www.pnas.org/content/112/3/679.full
+    # You can use it to examine whether on average your classifiers are doing
+    # more or less work per session at the start vs end of their time spent on your project,
+    # as well as examine the classification duration to see if they are more efficient at
+    # classifying. Keep in mind the various assumptions you need to make about how the
+    # intrinsic difficulty of classifying a subject varies (or doesn't) over the length of your
+    # project in order to do this analysis, etc.
+    # These are only computed if the user has at least 4 sessions; otherwise they're 0.
+    has4 = n_sessions >= 4
+    i1 = np.where(has4, user_sstart, 0)
+    i2 = np.where(has4, user_sstart + 1, 0)
+    j1 = np.where(has4, user_slast, 0)
+    j2 = np.where(has4, user_slast - 1, 0)
+    if n_sess_tot > 0:
+        len_first2   = class_length_total[i1] + class_length_total[i2]
+        len_last2    = class_length_total[j1] + class_length_total[j2]
+        count_first2 = (class_count_session[i1] + class_count_session[i2]).astype(float)
+        count_last2  = (class_count_session[j1] + class_count_session[j2]).astype(float)
+    else:
+        len_first2 = len_last2 = count_first2 = count_last2 = np.ones(0)
+    mean_duration_first2       = np.where(has4, len_first2 / 2.0, 0.0)
+    mean_duration_last2        = np.where(has4, len_last2  / 2.0, 0.0)
+    mean_class_duration_first2 = np.where(has4, len_first2 / count_first2, 0.0)
+    mean_class_duration_last2  = np.where(has4, len_last2  / count_last2,  0.0)
+
+    session_stats = {}
+    session_stats['user_code']                            = sessions['user_code']
+    session_stats["n_class"]                              = n_class
+    session_stats["n_sessions"]                           = n_sessions
+    session_stats["n_days"]                               = sessions['n_days']
+    session_stats["first_day"]                            = first_day
+    session_stats["last_day"]                             = last_day
+    session_stats["tdiff_firstlast_hours"]                = tdiff_firstlast_hours             # hours
+    session_stats["time_spent_classifying_total_minutes"] = session_length_total              # minutes
+    session_stats["class_per_session_min"]                = count_min
+    session_stats["class_per_session_max"]                = count_max
+    session_stats["class_per_session_med"]                = count_med
+    session_stats["class_per_session_mean"]               = count_mean
+    session_stats["class_length_mean_overall"]            = class_length_mean_overall         # minutes
+    session_stats["class_length_median_overall"]          = class_length_median_overall       # minutes
+    session_stats["session_length_mean"]                  = session_length_mean               # minutes
+    session_stats["session_length_median"]                = session_length_median             # minutes
+    session_stats["session_length_min"]                   = session_length_min                # minutes
+    session_stats["session_length_max"]                   = session_length_max                # minutes
+    session_stats["which_session_longest"]                = which_session_longest
+    session_stats["mean_session_length_first2"]           = mean_duration_first2              # minutes
+    session_stats["mean_session_length_last2"]            = mean_duration_last2               # minutes
+    session_stats["mean_class_length_first2"]             = mean_class_duration_first2        # minutes
+    session_stats["mean_class_length_last2"]              = mean_class_duration_last2         # minutes
+    session_stats["class_count_session"]                  = class_count_session               # per session
+    if 'session_class_length_median' in sessions:
+        for the_key in ['session_start', 'session_end', 'session_class_length', 'session_class_length_median']:
+            session_stats[the_key] = sessions[the_key]
+
+    return session_stats
+
+
+
+# This computes the stats for every user at once.
+#
+# Inputs are the same as sessionize(), plus
+#   user_id     - the Zooniverse user id (float, NaN for not-logged-in users)
+# for each classification. user_id can be None if the caller already has it once per user
+# (see panoptes_io.read_compact()), in which case it's up to them to add it.
+#
+# Returns a dict of arrays with one element per user, in user_code order, with the keys
+# in col_order plus 'user_code', which says which user each element belongs to.
+#
+# With with_sessions=True, it also has the per-session arrays session_table() needs.
+#
+# presorted is as for sessionize().
+def sessionstats_arrays(user_code, created_at, started_at, finished_at, user_id, session_break, with_sessions=False, presorted=False):
+    return sessionstats_sweep(user_code, created_at, started_at, finished_at, user_id, [session_break], with_sessions, presorted)[0]
+
+
+
+# The same as sessionstats_arrays() for each of a list of session breaks, from one sort of the
+# classifications (see sessionize_sweep()); returns a list of the dicts, one per break.
+# Breaks are only ever whole minutes (see is_session_break()), so e.g. 30 and 30.5 are only
+# worked out once.
+def sessionstats_sweep(user_code, created_at, started_at, finished_at, user_id, session_breaks, with_sessions=False, presorted=False):
+    the_minutes = sorted(set(int(q) for q in session_breaks))
+    all_sessions = sessionize_sweep(user_code, created_at, started_at, finished_at, the_minutes, with_sessions, presorted)
+
+    # the user id of the user's first classification; blank (NaN) if they're not logged in
+    if user_id is not None and len(all_sessions) > 0:
+        n_class = all_sessions[0]['n_class']
+        ustart = np.r_[0, np.cumsum(n_class)[:-1]].astype(np.int64) if len(n_class) > 0 else np.zeros(0, dtype=np.int64)
+        user_id = np.asarray(user_id)[all_sessions[0]['order']][ustart] # note: username will be in the index, this is zooid
+
+    by_minutes = {}
+    for the_break, sessions in zip(the_minutes, all_sessions):
+        by_minutes[the_break] = userstats_from_sessions(sessions)
+        if user_id is not None:
+            by_minutes[the_break]["user_id"] = user_id
+
+    return [by_minutes[int(q)] for q in session_breaks]
+
+
+
+# the keys of the dict from sessionstats_arrays() that have 1 element per session (grouped by
+# user, with n_sessions of them for each user) rather than 1 per user
+per_session_keys = ['class_count_session', 'session_start', 'session_end', 'session_class_length', 'session_class_length_median']
+
+
+
+# The stats of just the users at positions the_users (in that order) of the dict from
+# sessionstats_arrays().
+def take_users(session_stats, the_users):
+    the_sessions = group_rows(offsets_from_counts(session_stats['n_sessions']), the_users)
+    return dict((q, session_stats[q][the_sessions if q in per_session_keys else the_users]) for q in session_stats)
+
+
+
+# The dicts from sessionstats_arrays() (e.g. for different users), one after another
+def concat_stats(all_stats):
+    return dict((q, np.concatenate([r[q] for r in all_stats])) for q in all_stats[0])
+
+
+
+# The classification counts in each session of each user, as "[n_1; n_2; ...]" (semicolons
+# because we don't want to break the eventual CSV output).
+# Rather than joining each user's counts separately, the whole column is made as one string,
+# with a newline (which can't be in any of them) between users, and split up again.
+def format_count_lists(class_count_session, n_sessions):
+    if len(n_sessions) == 0:
+        return np.zeros(0, dtype=object)
+    is_last = np.zeros(len(class_count_session), dtype=bool)
+    is_last[offsets_from_counts(n_sessions)[1:] - 1] = True
+    the_pieces = np.empty(2 * len(class_count_session), dtype=object)
+    the_pieces[0::2] = class_count_session.astype(str)
+    the_pieces[1::2] = np.where(is_last, ']\n[', '; ')
+    return np.array(('[' + ''.join(the_pieces.tolist()))[:-2].split('\n'), dtype=object)
+
+
+
+# The session-level table: one row per session of each user, from a dict from
+# sessionstats_arrays(..., with_sessions=True). Returns a dict of columns:
+#   user_code     - which user (the same codes as the dict's user_code)
+#   session_index - the session's number within the user's sessions, counting from 1
+#   start, end    - the created_at of the session's first and last classifications
+#   day           - the day the session started on
+#   n_class       - the number of classifications in the session
+#   class_length_total_minutes, class_length_median_minutes - the sum and median of the
+#                   lengths of its classifications (the median truncated to whole nanoseconds,
+#                   as class_length_median_overall is)
+# in the same order as the users in the dict, and in time order for each user.
+def session_table(session_stats):
+    n_sessions = session_stats['n_sessions']
+    the_offsets = offsets_from_counts(n_sessions)
+    the_table = {}
+    the_table['user_code']     = np.repeat(session_stats['user_code'], n_sessions).astype(np.int32)
+    the_table['session_index'] = np.arange(the_offsets[-1]) - np.repeat(the_offsets[:-1], n_sessions) + 1
+    the_table['start']         = session_stats['session_start'].astype('datetime64[ns]')
+    the_table['end']           = session_stats['session_end'].astype('datetime64[ns]')
+    the_table['day']           = (session_stats['session_start'] // ns_per_day).astype('datetime64[D]')
+    the_table['n_class']       = session_stats['class_count_session']
+    the_table['class_length_total_minutes']  = session_stats['session_class_length'] * ns2mins
+    the_table['class_length_median_minutes'] = np.trunc(session_stats['session_class_length_median']) * ns2mins
+    return the_table
+
+
+
+# Write the session table (see session_table()) to a numpy .npz file, one array per column,
+# plus user_names and user_ids, the name and user id of each user_code (user_names as UTF-8
+# bytes, so the file can be loaded without pickling). e.g. in pandas:
+#   f = np.load(filename); pd.DataFrame(dict((q, f[q]) for q in session_table_columns))
+session_table_columns = ['user_code', 'session_index', 'start', 'end', 'day', 'n_class',
+                         'class_length_total_minutes', 'class_length_median_minutes']
+
+def write_session_table(filename, session_stats, user_names, user_ids):
+    the_names = np.array([q if isinstance(q, bytes) else q.encode('utf-8') for q in user_names], dtype=bytes)
+    np.savez(filename, user_names=the_names, user_ids=np.asarray(user_ids), **session_table(session_stats))
+
+
+
+# turn the dict from sessionstats_arrays() into the output DataFrame, indexed by user_name
+def sessionstats_to_frame(session_stats, user_names):
+    the_index = pd.Index(np.asarray(user_names, dtype=object)[session_stats['user_code']], name='user_name')
+    the_columns = dict((q, session_stats[q]) for q in col_order if q in session_stats)
+    the_columns['class_count_session_list'] = format_count_lists(session_stats['class_count_session'], session_stats['n_sessions'])
+    return pd.DataFrame(the_columns, index=the_index, columns=col_order)
+
+
+
+# Split the users into n_parts partitions that have roughly the same number of classifications
+# in each, so that no one worker ends up with much more to do than the others.
+#
+# The number of classifications per user is very heavy-tailed, and a few power users can have
+# nearly a whole partition's worth each. So the heaviest users are handed out first, one at a
+# time, biggest first, each to whichever partition has the fewest classifications so far.
+# Everyone else is put in a random order (by a hash of their user code) and dealt out in
+# consecutive runs that top each partition up to an equal share of the total.
+#
+# n_class_byuser is the number of classifications for each user code; returns the partition
+# number for each user code.
+def partition_users(n_class_byuser, n_parts):
+    n_class_byuser = np.asarray(n_class_byuser, dtype=np.int64)
+    n_users = len(n_class_byuser)
+    which_part = np.zeros(n_users, dtype=np.int64)
+
+    # "heavy" is more than 1/64 of an evenly-split partition, so there are at most 64*n_parts of them
+    heavy_min = max(1, n_class_byuser.sum() // (64 * n_parts))
+    heavy_users = np.flatnonzero(n_class_byuser >= heavy_min)
+    part_load = np.zeros(n_parts)
+    for i in heavy_users[np.argsort(-n_class_byuser[heavy_users], kind='mergesort')]:
+        the_part = np.argmin(part_load)
+        which_part[i] = the_part
+        part_load[the_part] += n_class_byuser[i]
+
+    # Knuth's multiplicative hash, so the order doesn't depend on the user names
+    light_users = np.flatnonzero(n_class_byuser < heavy_min)
+    the_hash = (light_users.astype(np.uint64) * np.uint64(2654435761)) % np.uint64(2**32)
+    light_users = light_users[np.argsort(the_hash, kind='mergesort')]
+    light_load = np.cumsum(n_class_byuser[light_users])
+
+    # how much room each partition has left for the light users
+    room = np.maximum(n_class_byuser.sum() / float(n_parts) - part_load, 0.)
+    if len(light_load) > 0 and room.sum() > 0:
+        room_edges = np.cumsum(room) * (light_load[-1] / room.sum())
+        which_part[light_users] = np.minimum(np.searchsorted(room_edges, light_load - 0.5*n_class_byuser[light_users]), n_parts-1)
+
+    return which_part
+
+
+
+# For classifications that are already sorted by user (see sessionize()), the same kind of
+# split, but into runs of consecutive users, so each partition is one contiguous block of rows
+# (a view, not a copy). Power users can't be spread around, so the partitions are only as even
+# as the biggest user allows, and there can be fewer than n_parts of them (none are empty).
+# Returns the row offsets of the partitions (one more than the number of partitions).
+def contiguous_partitions(n_class_byuser, n_parts):
+    user_offsets = offsets_from_counts(n_class_byuser)
+    user_edges = np.searchsorted(user_offsets, np.arange(1, n_parts) * (user_offsets[-1] / float(n_parts)))
+    return np.unique(user_offsets[np.r_[0, user_edges, len(n_class_byuser)].astype(np.int64)])
+
+
+
+# The arrays for the workers to work on. With the default way of starting processes on
+# Linux/Mac the workers get a copy-on-write view of these rather than pickling them.
+_worker_arrays = None
+
+def _init_worker(arrays):
+    global _worker_arrays
+    _worker_arrays = arrays
+
+# (which_part is from partition_users(), or row_edges from contiguous_partitions() if the
+# classifications are presorted)
+def _sessionstats_partition(args):
+    the_part, session_breaks, with_sessions = args
+    user_code, created_at, started_at, finished_at, user_id, which_part, row_edges = _worker_arrays
+    if row_edges is not None:
+        rows = slice(row_edges[the_part], row_edges[the_part + 1])
+    else:
+        rows = np.flatnonzero(which_part[user_code] == the_part)
+    return sessionstats_sweep(user_code[rows], created_at[rows], started_at[rows],
+                              finished_at[rows], None if user_id is None else user_id[rows], session_breaks, with_sessions,
+                              presorted=row_edges is not None)
+
+
+
+# The same as sessionstats_arrays(), but with the users split into one partition (see above) per
+# worker process, all run at once. The results are the same as sessionstats_arrays(), in the
+# same (user_code) order.
+#
+# If progress is given, it's called as progress(n_users_done, n_users) as the users are done.
+# So that there's something to report, the users are then split into at least progress_batches
+# partitions (even with only 1 worker), which are handed out to the workers as they're free.
+progress_batches = 16
+
+def sessionstats_arrays_parallel(user_code, created_at, started_at, finished_at, user_id, session_break, workers, progress=None,
+                                 with_sessions=False, presorted=False):
+    return sessionstats_sweep_parallel(user_code, created_at, started_at, finished_at, user_id, [session_break], workers, progress,
+                                       with_sessions, presorted)[0]
+
+
+
+# The same as sessionstats_sweep(), with the users split between workers as above.
+# With presorted=True (see sessionize()) each worker gets a contiguous block of users.
+def sessionstats_sweep_parallel(user_code, created_at, started_at, finished_at, user_id, session_breaks, workers, progress=None,
+                                with_sessions=False, presorted=False):
+    user_code = np.asarray(user_code)
+    if len(user_code) == 0 or (workers <= 1 and progress is None):
+        return sessionstats_sweep(user_code, created_at, started_at, finished_at, user_id, session_breaks, with_sessions, presorted)
+
+    n_class_byuser = np.bincount(user_code)
+    n_users = int(np.sum(n_class_byuser > 0))
+    n_parts = workers if progress is None else max(workers, progress_batches)
+    if presorted:
+        which_part, row_edges = None, contiguous_partitions(n_class_byuser, n_parts)
+        n_parts = len(row_edges) - 1
+    else:
+        which_part, row_edges = partition_users(n_class_byuser, n_parts), None
+    arrays = (user_code, np.asarray(created_at), np.asarray(started_at), np.asarray(finished_at),
+              None if user_id is None else np.asarray(user_id), which_part, row_edges)
+    the_args = [(q, list(session_breaks), with_sessions) for q in range(n_parts)]
+
+    results = []
+    def add_result(the_result):
+        results.append(the_result)
+        if progress is not None:
+            progress(sum(len(q[0]['user_code']) for q in results), n_users)
+
+    if workers <= 1:
+        _init_worker(arrays)
+        try:
+            for the_arg in the_args:
+                add_result(_sessionstats_partition(the_arg))
+        finally:
+            _init_worker(None)
+    else:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(arrays,))
+        try:
+            for the_result in pool.imap_unordered(_sessionstats_partition, the_args):
+                add_result(the_result)
+        finally:
+            pool.close()
+            pool.join()
+
+    # each partition's results are in user_code order, so put them all together and re-sort
+    # (for each break)
+    results = [q for q in results if len(q[0]['user_code']) > 0]
+    all_merged = []
+    for i in range(len(session_breaks)):
+        merged = concat_stats([r[i] for r in results])
+        all_merged.append(take_users(merged, np.argsort(merged['user_code'], kind='mergesort')))
+    return all_merged
+
+
+
+# Compute the session stats for each user from a classifications DataFrame with (at least)
+# user_name, user_id, created_at_ts, started_at and finished_at columns,
+# where the last 3 are datetimes.
+# This is the drop-in replacement for by_user.apply(sessionstats).
+# With workers > 1 the users are split up between that many processes.
+def sessionstats_frame(classifications, session_break, workers=1):
+    user_code, user_names = pd.factorize(classifications.user_name.values, sort=True)
+    session_stats = sessionstats_arrays_parallel(user_code,
+                                        classifications.created_at_ts.values.view('i8'),
+                                        classifications.started_at.values.view('i8'),
+                                        classifications.finished_at.values.view('i8'),
+                                        classifications.user_id.values,
+                                        session_break, workers)
+    return sessionstats_to_frame(session_stats, user_names)
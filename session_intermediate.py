@@ -0,0 +1,133 @@
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# A compact on-disk copy of just what the session stats need from an export, for
+# sessions_inproj_byuser.py (--write-intermediate dir, and then dir in place of the export).
+#
+# Once the export's been parsed, the session stats only need 4 numbers per classification:
+# the user code (int32) and created_at, started_at and finished_at (int64 nanoseconds). Here
+# those are saved as one .npy file each, already sorted by (user, created_at), along with the
+# offset of each user's first classification and the per-user bits (names, ids, registered or
+# not) and the handful of totals the script prints. That's 28 bytes per classification,
+# against the hundreds (or thousands) in the CSV.
+#
+# Reading it back is just memory-mapping the files: nothing is parsed or copied, the session
+# engine skips its sort (see presorted in session_engine.sessionize()), each worker's block of
+# users is a view of the same pages, and so is any one user's classifications (see
+# user_rows()). Several runs on the same intermediate (e.g. with different session breaks)
+# share one copy of it in the page cache.
+#
+# Unlike export_cache.py, which keeps everything read_compact() returns, keyed on the export,
+# this is a file you make and name yourself, and it only has what the session stats use (no
+# subjects or workflows, so no --by).
+#
+# The directory has
+#   manifest.json       - what's in it, where it came from, and the totals
+#   user_code.npy       - int32, sorted
+#   created_at.npy, started_at.npy, finished_at.npy
+#                       - int64 ns, sorted by created_at within each user
+#   user_offsets.npy    - int64, the first row of each user (plus the number of rows at the end)
+#   user_names.npy, user_ids.npy, user_registered.npy
+#                       - one per user, in user code order
+
+import os
+import json
+import shutil
+import tempfile
+import datetime
+
+import numpy as np
+
+from session_engine import sort_by_user, offsets_from_counts
+
+
+# what's in manifest.json, so a directory of something else isn't taken for one of these
+intermediate_kind = 'session_intermediate'
+
+# bump this if what's stored changes
+intermediate_version = 1
+
+per_class_arrays = ('user_code', 'created_at', 'started_at', 'finished_at')
+per_user_arrays  = ('user_offsets', 'user_names', 'user_ids', 'user_registered')
+
+# the values from panoptes_io.read_compact() that are kept as they are
+kept_values = ('n_subjects', 'n_meta_fallback', 'n_slow_timestamps')
+
+
+
+def is_intermediate(the_path):
+    manifest_file = os.path.join(the_path, 'manifest.json')
+    if not os.path.isfile(manifest_file):
+        return False
+    with open(manifest_file) as f:
+        return json.load(f).get('kind') == intermediate_kind
+
+
+
+# Save the session stats' part of compact (from panoptes_io.read_compact(), or this file's
+# read_intermediate()) to the directory out_dir, replacing whatever intermediate is there
+# already. classfile_in is just recorded in the manifest (as the export it came from, unless
+# compact is itself from an intermediate).
+def write_intermediate(out_dir, compact, classfile_in):
+    if os.path.exists(out_dir) and not is_intermediate(out_dir):
+        raise IOError("%s is already there and isn't a session intermediate" % out_dir)
+
+    # as in export_cache.save_compact(), everything goes somewhere else first and is then
+    # moved into place, so an interrupted run never leaves half of one behind
+    parent = os.path.dirname(os.path.abspath(out_dir))
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix='.tmp_')
+
+    n_users = len(compact['user_names'])
+    order = sort_by_user(compact['user_code'], compact['created_at'])
+    for the_key in per_class_arrays:
+        np.save(os.path.join(tmp_dir, the_key + '.npy'), np.asarray(compact[the_key])[order])
+    np.save(os.path.join(tmp_dir, 'user_offsets.npy'), offsets_from_counts(np.bincount(compact['user_code'], minlength=n_users)))
+    np.save(os.path.join(tmp_dir, 'user_names.npy'),
+            np.array([q if isinstance(q, bytes) else q.encode('utf-8') for q in compact['user_names']], dtype=bytes))
+    np.save(os.path.join(tmp_dir, 'user_ids.npy'), np.asarray(compact['user_ids']))
+    np.save(os.path.join(tmp_dir, 'user_registered.npy'), np.asarray(compact['user_registered'], dtype=bool))
+
+    manifest = {'kind': intermediate_kind,
+                'version': intermediate_version,
+                'source': compact.get('source', os.path.abspath(classfile_in)),
+                'saved': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'n_class': len(compact['user_code']),
+                'n_users': n_users,
+                'values': dict((q, compact[q]) for q in kept_values)}
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+    if os.path.exists(out_dir):
+        shutil.rmtree(out_dir)
+    os.rename(tmp_dir, out_dir)
+
+
+
+# The intermediate in in_dir as a dict with the same keys as panoptes_io.read_compact() (apart
+# from the subjects and workflows), plus user_offsets. The per-classification arrays are
+# read-only memory maps, sorted by (user, created_at).
+def read_intermediate(in_dir):
+    with open(os.path.join(in_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest.get('kind') != intermediate_kind or manifest.get('version') != intermediate_version:
+        raise IOError("%s isn't a session intermediate this version can read" % in_dir)
+
+    compact = dict(manifest['values'])
+    for the_key in per_class_arrays:
+        compact[the_key] = np.load(os.path.join(in_dir, the_key + '.npy'), mmap_mode='r')
+    # (the per-user ones are small, and user_ids can be objects, which can't be mapped)
+    for the_key in per_user_arrays:
+        compact[the_key] = np.load(os.path.join(in_dir, the_key + '.npy'))
+    # (python 2 strings are already bytes)
+    if str is bytes:
+        compact['user_names'] = np.array(compact['user_names'], dtype=object)
+    else:
+        compact['user_names'] = np.array([q.decode('utf-8') for q in compact['user_names']], dtype=object)
+    compact['source'] = manifest['source']
+    return compact
+
+
+
+# The rows of the user with code the_user, as a slice (so e.g. compact['created_at'][the_slice]
+# is a view of their classifications, in time order)
+def user_rows(compact, the_user):
+    return slice(int(compact['user_offsets'][the_user]), int(compact['user_offsets'][the_user + 1]))
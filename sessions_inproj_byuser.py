@@ -1,47 +1,43 @@
-#Python 2.7.9 (default, Apr  5 2015, 22:21:35) 
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# Classification and session stats for each classifier in a project, from its classifications
+# export. Run it without any inputs to see the usage.
+#
+# Everything it does is also here as functions, which don't print anything and return what
+# they work out, so it can be used from a notebook or a long-running process without parsing
+# the export (or starting python) again each time, e.g.
+#   import panoptes_io, sessions_inproj_byuser
+#   compact = panoptes_io.read_compact('classifications.csv')
+#   the_results = sessions_inproj_byuser.analyze(compact, session_break=30.)
+#   the_results['session_stats']      # a DataFrame, the same as the stats file
+# analyze_frame() does the same from a DataFrame that's already been read (with at least the
+# columns in panoptes_io.compact_cols_read). analyze_sweep(), analyze_gaps(),
+# analyze_incremental() and analyze_out_of_core() are --sweep, --gaps, --incremental and
+# --out-of-core, and write_stats() writes the stats files. main() is the command line version,
+# which just calls these and prints what they return.
 import sys
-
-# file with raw classifications (csv)
-# put this way up here so if there are no inputs we exit quickly before even trying to load everything else
-default_statstart = "session_stats"
-try:
-    classfile_in = sys.argv[1]
-except:
-    #classfile_in = 'data/2e3d12a2-56ca-4d1f-930a-9ecc7fd39885.csv'
-    print "\nUsage: "+sys.argv[0]+" classifications_infile [stats_outfile add_dates_to_file session_break_length]"
-    print "      classifications_infile is a Zooniverse (Panoptes) classifications data export CSV."
-    print "      stats_outfile is the name of an outfile you'd like to write."
-    print "           if you don't specify one it will be "+default_statstart+"_[date]_to_[date].csv"
-    print "           where the dates show the first & last classification date."
-    print "      add_dates_to_file is 1 if you want to add \"_[date]_to_[date]\" to the output filename, as"
-    print "           described above, even if you did specify a stats_outfile name."
-    print "      A new session is defined to start when 2 classifications by the same classifier are"
-    print "           separated by at least session_break_length minutes (default value: 60)"
-    print "\nOnly the classifications_infile is a required input.\n"
-    sys.exit(0)
-
-
+import os
+import datetime
 
 import numpy as np  # using 1.10.1
 import pandas as pd  # using 0.13.1
-import datetime
-import dateutil.parser
-import json
-
-
-
-# timestamps & timediffs are in nanoseconds below but we want outputs in hours or minutes, depending
-# Note: I'd like to keep units in days but then a session length etc in seconds is ~1e-5 and that's too
-#       close to floating-point errors for my liking (because this might be read into Excel)
-# we will use either this below, or
-# /datetime.timedelta(hours=1)
-# depending on whether the output is in a timedelta (use above) or in float (use below).
-ns2hours = 1.0 / (1.0e9*60.*60.)
-ns2mins  = 1.0 / (1.0e9*60.)
-
 
-
-# columns currently in an exported Panoptes classification file: 
+from cmdline_flags import pop_flag, pop_option
+from panoptes_io import read_compact, compact_from_frame, day_string
+from export_cache import read_compact_cached
+from session_intermediate import read_intermediate, write_intermediate
+# the whole-frame version of the per-user session stats
+import session_engine
+import incremental_sessions
+import external_sort
+from inequality import inequality_stats, top_share_lines, write_lorenz_csv
+from gap_report import gap_histograms, gap_report_lines, write_gap_csv
+from topk import top_k_series, default_k
+from partitions import partition_columns, encode_partitions, partition_label, counts_by_partition, partition_slices
+from stage_profiler import new_profile, stage, format_profile, write_profile_json, progress_printer
+
+
+# columns currently in an exported Panoptes classification file:
 # user_name,user_id,user_ip,workflow_id,workflow_name,workflow_version,created_at,gold_standard,expert,metadata,annotations,subject_data
 
 # user_name is either their registered name or "not-logged-in"+their hashed IP
@@ -54,7 +50,7 @@ ns2mins  = 1.0 / (1.0e9*60.)
 # created_at is the date the entry for the classification was recorded
 # gold_standard is 1 if this classification was done in gold standard mode
 # expert is 1 if this classification was done in expert mode... I think
-# metadata (json) is the data the browser sent along with the classification. 
+# metadata (json) is the data the browser sent along with the classification.
 #       Includes browser information, language, started_at and finished_at
 #       note started_at and finished_at are perhaps the easiest way to calculate the length of a classification
 #       (the duration elapsed between consecutive created_at by the same user is another way)
@@ -65,45 +61,28 @@ ns2mins  = 1.0 / (1.0e9*60.)
 #       here we will ignore this too, except to count subjects once.
 # we'll also ignore user_ip, workflow information, gold_standard, and expert.
 #
-# some of these will be defined further down, but before we actually use this list.
-cols_used = ["created_at_ts", "user_name", "user_id", "created_at", "started_at", "finished_at"]
+# The only columns we read from the file are user_name, user_id, created_at, metadata and
+# subject_data (see compact_cols_read in panoptes_io.py); the rest (including the annotations,
+# which are usually most of the file) are skipped while reading it.
 
 
-# Check for the other inputs on the command line
+default_statstart = "session_stats"
+# the stats file when none is given, which then has the dates added (see dated_statsfile())
+default_statsfile = default_statstart + ".csv"
 
-# Output file
-try:
-    statsfile_out = sys.argv[2]
-    # If it's given on the command line, don't add the dates to the filename later
-    modstatsfile = False
-except:
-    statsfile_out = default_statstart+".csv"
-    modstatsfile = True
+# The separation between 2 classifications, in minutes, that defines the start of a new session for a classifier
+default_break = 60.
 
-try: 
-    add_date_temp = int(sys.argv[3])
-    if add_date_temp == 1:
-        modstatsfile = True
-    # else nothing, just keep whatever modstatsfile is already defined as    
-except:
-    # ignore this as you'll have already defined modstatsfile above
-    pass
 
 
-# The separation between 2 classifications, in minutes, that defines the start of a new session for a classifier
-try:
-    session_break = float(sys.argv[4])
-except:
-    session_break = 60.
-    
-# Print out the input parameters just as a sanity check    
-print "Computing session stats using:"
-print "   infile:",classfile_in
-# If we're adding the dates to the output file, we can't print it out here because we don't yet know the dates
-if not modstatsfile:
-    print "   outfile:",statsfile_out
-print "   new session starts after classifier break of",session_break,"minutes\n"
+#################################################################################
+#################################################################################
+#################################################################################
+
+
 
+# The Gini coefficient, Lorenz curve and top classifiers' shares are in inequality.py,
+# along with some notes on how to interpret them.
 
 
 
@@ -114,387 +93,681 @@ print "   new session starts after classifier break of",session_break,"minutes\n
 
 
 
-# This is the function that will compute the stats for each user
+# Read classfile_in, which can be an export or an intermediate from --write-intermediate.
 #
-def sessionstats(grp):
-    
-    # groups and dataframes behave a bit differently; life is a bit easier if we DF the group
-    # also sort each individual group rather than sort the whole classification dataframe; should be much faster
-    user_class = pd.DataFrame(grp).sort('created_at_ts', ascending=True)
-    
-    # If the user id is a number, great; if it's blank, keep it blank and don't force it to NaN
-    try:
-        theuserid = int(user_class.user_id.iloc[0])
-    except:
-        theuserid = user_class.user_id.iloc[0]
-    
-    # the next 2 lines are why we converted into datetime
-    user_class['duration'] = user_class.created_at_ts.diff()
-    user_class['class_length'] = user_class.finished_at - user_class.started_at
-    # set up the session count
-    user_class['session'] = [0 for q in user_class.duration]
-    # because aggregate('count') has a weird bug (sometimes returns n-1 instead), just make a "count" column
-    # and then aggregate('sum')
-    user_class['count'] = [1 for q in user_class.duration] 
-    # YYYY-MM-DD only
-    user_class['created_day'] = [q[:10] for q in user_class.created_at]
-
-    n_class    = len(user_class)    
-    n_days     = len(user_class.created_day.unique())
-    first_day  = user_class.created_day.iloc[0]
-    last_day   = user_class.created_day.iloc[-1]
-
-    #front-end version; back-end version uses 'created_at'
-    tdiff_firstlast_hours = (user_class.finished_at[user_class.index[-1]] - user_class.started_at[user_class.index[0]]).total_seconds() / 3600.
-    
-    
-    i_firstclass = user_class.index[0]  
-    i_lastclass  = user_class.index[-1]  
-
-    # Figure out where new sessions start, manually dealing with the first classification of the session
-    thefirst = (user_class.duration >= np.timedelta64(int(session_break), 'm')) | (user_class.index == i_firstclass)
-    
-    # insession is more useful if for some reason you don't trust started_at and finished_at
-    # and instead you need to do calculations using 'duration'
-    insession = np.invert(thefirst)
-    # start times for each session
-    starttimes = user_class.created_at_ts[thefirst]
-    # start dates for each session
-    startdays  = user_class.created_day[thefirst]
-    # session count; could also do sum(thefirst) but len takes less time than sum
-    n_sessions = len(starttimes.unique())
-    
-
-    # timedeltas are just ints, but interpreted a certain way. So force them to int as needed.
-    # By default they're in nanoseconds
-    class_length_mean_overall   = np.mean(user_class.class_length).astype(int) * ns2mins
-    class_length_median_overall = np.median(user_class.class_length).astype(int) * ns2mins
-    
-    
-    # index this into a timeseries
-    # this means the index might no longer be unique, but it has many advantages
-    user_class.set_index('created_at_ts', inplace=True, drop=False)
-    
-    
-    # now, keep the session count by adding 1 to each element of the timeseries with t > each start time
-    # not sure how to do this without a loop
-    for the_start in starttimes.unique():
-        user_class.session[the_start:] += 1
-    
-    
-    # Now that we've defined the sessions let's do some calculations
-    bysession = user_class.groupby('session')
-    
-    # get classification counts, total session durations, median classification length for each session
-    # time units in minutes here
-    # this may give a warning for 1-entry sessions but whatevs
-    class_length_median = bysession.class_length.apply(lambda x: np.median(x))/datetime.timedelta(minutes=1)
-    class_length_total  = bysession.class_length.aggregate('sum') * ns2mins
-    class_count_session = bysession['count'].aggregate('sum')
-    
-    # make commas into semicolons because we don't want to break the eventual CSV output
-    class_count_session_list = str(class_count_session.tolist()).replace(',',';')
-
-    # below is the back-end version; use if you don't have or don't trust started_at and finished_at
-#     # ignore the first duration, which isn't a real classification duration but a time between sessions
-#     dur_median = bysession.duration.apply(lambda x: np.median(x[1:])) /datetime.timedelta(hours=1)
-#     dur_total = bysession.duration.apply(lambda x: np.sum(x[1:]))  # in nanoseconds
-#     ses_count = bysession.duration.aggregate('count')
-# #    ses_nproj = bysession.project_name.aggregate(lambda x:x.nunique())
-    
-    # basic classification count stats per session
-    count_mean = np.nanmean(class_count_session.astype(float))
-    count_med  = np.median(class_count_session)
-    count_min  = np.min(class_count_session)
-    count_max  = np.max(class_count_session)
-    
-    session_length_mean    = np.nanmean(class_length_total).astype(float)
-    session_length_median  = np.median(class_length_total).astype(float)
-    session_length_min     = np.min(class_length_total)
-    session_length_max     = np.max(class_length_total)
-    session_length_total = np.sum(class_length_total)
-     
-    class_length_mean  = class_length_total / class_count_session.astype(float)
-    
-#     nproj_session_med  = np.median(ses_nproj)
-#     nproj_session_mean = np.nanmean(ses_nproj.astype(float))
-#     nproj_session_min  = np.min(ses_nproj)
-#     nproj_session_max  = np.max(ses_nproj)
-    
-
-    which_session_longest = class_length_total[class_length_total == np.max(class_length_total)].index[0]    
-
-    
-    if n_sessions >= 4:
-        # get durations of first 2 and last 2 sessions
-        # Note: this idea comes from Sauermann & Franzoni (2015) and their related work
-        # http://www.pnas.org/content/112/3/679.full
-        # You can use it to examine whether on average your classifiers are doing
-        # more or less work per session at the start vs end of their time spent on your project,
-        # as well as examine the classification duration to see if they are more efficient at
-        # classifying. Keep in mind the various assumptions you need to make about how the
-        # intrinsic difficulty of classifying a subject varies (or doesn't) over the length of your
-        # project in order to do this analysis, etc.
-        mean_duration_first2 = (class_length_total[1]+class_length_total[2])/2.0
-        mean_duration_last2  = (class_length_total[n_sessions]+class_length_total[n_sessions-1])/2.0
-        mean_class_duration_first2 = (class_length_total[1]+class_length_total[2])/(class_count_session[1]+class_count_session[2]).astype(float)
-        mean_class_duration_last2  = (class_length_total[n_sessions]+class_length_total[n_sessions-1])/(class_count_session[n_sessions]+class_count_session[n_sessions-1]).astype(float)
+# This reads the columns we need, extracts started_at and finished_at from the metadata column
+# (without decoding all the JSON unless we have to) and parses the dates into actual
+# datetimes (as int64 nanoseconds), parsing each distinct timestamp string only once.
+# What we get back is a dict of arrays with 1 element per classification; see panoptes_io.py.
+# With use_cache, all that is only done the first time, and saved for next time.
+# From an intermediate (see session_intermediate.py), the arrays are just memory-mapped, already
+# sorted by user and time.
+# Returns the dict, and where it came from: 'file', 'cache' or 'intermediate'.
+def read_input(classfile_in, use_cache=False, workers=1, profile=None):
+    if os.path.isdir(classfile_in):
+        with stage(profile, 'read intermediate') as the_stage:
+            classifications = read_intermediate(classfile_in)
+            the_stage['rows'] = len(classifications['user_code'])
+        return classifications, 'intermediate'
+    if use_cache:
+        classifications, from_cache = read_compact_cached(classfile_in, profile, workers)
+        return classifications, 'cache' if from_cache else 'file'
+    return read_compact(classfile_in, profile, workers), 'file'
+
+
+
+# The project-wide numbers: totals, the leaderboard, the median and mean classifications per
+# user and the Gini coefficient.
+# nclass_counts is the number of classifications by each user, in the order of user_names, and
+# user_registered says which of them are logged in. Returns a dict.
+def classifier_stats(nclass_counts, user_names, user_registered, n_subjects, top_n=default_k, profile=None):
+    n_class_tot = int(np.sum(nclass_counts))
+
+    # for the leaderboard, which I recommend project builders never make public because
+    # Just Say No to gamification
+    # But it's still interesting to see who your most prolific classifiers are, and
+    # e.g. whether they're also your most prolific Talk users
+    with stage(profile, 'groupby', n_class_tot):
+        nclass_byuser = pd.Series(nclass_counts, index=pd.Index(user_names, name='user_name'))
+        # (without sorting everyone; see topk.py)
+        nclass_byuser_ranked = top_k_series(nclass_byuser, top_n)
+
+        # very basic stats
+        nclass_med    = np.median(nclass_byuser)
+        nclass_mean   = np.mean(nclass_byuser)
+
+        # Gini coefficient - see the comments in inequality.py for more notes
+        # (the Lorenz curve and the top classifiers' shares come from the same sort of the counts)
+        nclass_ineq   = inequality_stats(nclass_byuser.values)
+
+    n_reg = int(np.sum(user_registered))
+    return {'n_class_tot': n_class_tot,
+            'n_subj_tot': n_subjects,
+            'n_users_tot': len(user_names),
+            'n_reg': n_reg,
+            'n_unreg': len(user_names) - n_reg,
+            'nclass_byuser': nclass_byuser,
+            'nclass_byuser_ranked': nclass_byuser_ranked,
+            'nclass_med': nclass_med,
+            'nclass_mean': nclass_mean,
+            'nclass_ineq': nclass_ineq,
+            'nclass_gini': nclass_ineq['gini']}
+
+
+
+# The classifications, subjects, classifiers (and how many are registered) and Gini
+# coefficient on each workflow (or version; see partitions.py). The partition is added to the
+# key, so it's one more factorize and bincount rather than a loop over subsets.
+# Returns the partition code of each classification, the partition keys, and a list of dicts,
+# one per partition.
+def partition_summary(classifications, partition_by, profile=None):
+    n_users_tot = len(classifications['user_names'])
+    with stage(profile, 'groupby', len(classifications['user_code'])):
+        partition_code, partition_keys = encode_partitions(classifications['workflow_ids'], classifications['workflow_versions'], partition_by)
+        partition_code = partition_code[classifications['workflow_code']]
+        partition_users = counts_by_partition(partition_code, classifications['user_code'], n_users_tot)
+        partition_subjects = counts_by_partition(partition_code, classifications['subject_code'], len(classifications['subject_ids']))
+
+    the_parts, the_users, the_counts = partition_users
+    n_subj_bypart = np.bincount(partition_subjects[0], minlength=len(partition_keys))
+    the_summary = []
+    for i, the_slice in enumerate(partition_slices(the_parts, len(partition_keys))):
+        the_summary.append({'key': partition_keys[i],
+                            'label': partition_label(partition_keys[i], partition_by),
+                            'n_class': np.sum(the_counts[the_slice]),
+                            'n_subjects': n_subj_bypart[i],
+                            'n_users': len(the_counts[the_slice]),
+                            'n_registered': int(np.sum(classifications['user_registered'][the_users[the_slice]])),
+                            'gini': inequality_stats(the_counts[the_slice])['gini']})
+    return partition_code, partition_keys, the_summary
+
+
+
+# compute the per-user stats
+# This used to be by_user.apply(sessionstats), one user at a time, which took just under 90 seconds
+# for a test file with 175,000 classifications and ~4,500 users.
+# Now it's done for all users at once with one sort of the whole frame; see session_engine.py.
+#
+# classifications is the dict from read_input(), with presorted=True if it's from an
+# intermediate. Returns the stats as a DataFrame (what's written to the stats file) and as the
+# dict of arrays it was made from (which, with with_sessions, has the per-session numbers too;
+# see session_engine.session_table()).
+def session_stats(classifications, session_break=default_break, workers=1, progress=None, with_sessions=False, presorted=False):
+    session_arrays = session_engine.sessionstats_arrays_parallel(classifications['user_code'],
+                                        classifications['created_at'],
+                                        classifications['started_at'],
+                                        classifications['finished_at'],
+                                        None,
+                                        session_break, workers,
+                                        progress=progress,
+                                        with_sessions=with_sessions,
+                                        presorted=presorted)
+    # (the user id is the same for all of a user's classifications, so it's only kept once per user)
+    session_arrays['user_id'] = classifications['user_ids'][session_arrays['user_code']]
+    return session_engine.sessionstats_to_frame(session_arrays, classifications['user_names']), session_arrays
+
+
+
+# The same for each of a list of session breaks; the sort and the gaps between classifications
+# are shared by all the breaks, and only the per-session numbers are redone for each one (see
+# session_engine.sessionstats_sweep()). Returns a list of DataFrames, one per break.
+def sweep_session_stats(classifications, session_breaks, workers=1, progress=None, presorted=False):
+    sweep_stats = session_engine.sessionstats_sweep_parallel(classifications['user_code'],
+                                        classifications['created_at'],
+                                        classifications['started_at'],
+                                        classifications['finished_at'],
+                                        None,
+                                        session_breaks, workers,
+                                        progress=progress,
+                                        presorted=presorted)
+    for i, the_stats in enumerate(sweep_stats):
+        the_stats['user_id'] = classifications['user_ids'][the_stats['user_code']]
+        sweep_stats[i] = session_engine.sessionstats_to_frame(the_stats, classifications['user_names'])
+    return sweep_stats
+
+
+
+# The stats of each classifier on each workflow (or version) they've classified on, with
+# partition_code and partition_keys from partition_summary(): the "users" are (partition, user)
+# pairs instead, numbered in that order. Returns a DataFrame with the workflow (and version) as
+# the first columns.
+def partition_session_stats(classifications, partition_code, partition_keys, partition_by, session_break=default_break, workers=1):
+    n_users_tot = len(classifications['user_names'])
+    pair_code, pair_uniques = pd.factorize(partition_code.astype(np.int64) * n_users_tot + classifications['user_code'], sort=True)
+    pair_uniques = np.asarray(pair_uniques, dtype=np.int64)
+    pair_stats = session_engine.sessionstats_arrays_parallel(pair_code,
+                                    classifications['created_at'],
+                                    classifications['started_at'],
+                                    classifications['finished_at'],
+                                    None,
+                                    session_break, workers)
+    pair_user = pair_uniques[pair_stats['user_code']] % n_users_tot
+    pair_part = pair_uniques[pair_stats['user_code']] // n_users_tot
+    pair_stats['user_id'] = classifications['user_ids'][pair_user]
+    pair_stats['user_code'] = np.arange(len(pair_user))
+    partition_stats = session_engine.sessionstats_to_frame(pair_stats, classifications['user_names'][pair_user])
+    for i, the_col in enumerate(partition_columns[partition_by]):
+        partition_stats.insert(i, the_col, [partition_keys[q][i] for q in pair_part])
+    return partition_stats
+
+
+
+# The project-wide numbers for one export, from the dict read_input() (or
+# panoptes_io.read_compact()) returns, or from the totals external_sort.sessionstats_from_file()
+# returns: a dict with
+#   classifications - the classifications (or totals) themselves
+#   overall         - classifier_stats()
+#   first_class_day, last_class_day - YYYY-MM-DD
+# and with partition_by, partition_by itself and partition_summary, partition_code and
+# partition_keys (see partition_summary()).
+# The add_...() functions below add the session stats (or the gaps) to it.
+def project_stats(classifications, top_n=default_k, partition_by=None, profile=None):
+    if 'n_class_byuser' in classifications:
+        # (--out-of-core never has all the classifications at once, just the totals)
+        first_created_at = classifications['first_created_at']
+        last_created_at  = classifications['last_created_at']
+        nclass_counts    = classifications['n_class_byuser']
     else:
-        mean_duration_first2 = 0.0
-        mean_duration_last2  = 0.0
-        mean_class_duration_first2 = 0.0
-        mean_class_duration_last2  = 0.0
-    
-    
-    # now set up the DF to return
-    # but keep it as a list until later, which is about 30s shorter when running this function over ~4500 users
-    # versus setting the Series earlier, so for large classification exports with many thousands of users this will 
-    # make a significant difference.
-    session_stats = {}
-    session_stats["user_id"]                              = theuserid # note: username will be in the index, this is zooid
-    #session_stats = pd.Series(session_stats)              # so the subsequent column ordering is preserved, make it a series now
-    session_stats["n_class"]                              = n_class
-    session_stats["n_sessions"]                           = n_sessions
-    session_stats["n_days"]                               = n_days
-    session_stats["first_day"]                            = first_day[:10]
-    session_stats["last_day"]                             = last_day[:10]
-    session_stats["tdiff_firstlast_hours"]                = tdiff_firstlast_hours             # hours
-    session_stats["time_spent_classifying_total_minutes"] = session_length_total              # minutes
-    session_stats["class_per_session_min"]                = count_min
-    session_stats["class_per_session_max"]                = count_max
-    session_stats["class_per_session_med"]                = count_med
-    session_stats["class_per_session_mean"]               = count_mean
-    session_stats["class_length_mean_overall"]            = float(class_length_mean_overall)  # minutes
-    session_stats["class_length_median_overall"]          = class_length_median_overall       # minutes
-    session_stats["session_length_mean"]                  = session_length_mean               # minutes
-    session_stats["session_length_median"]                = session_length_median             # minutes
-    session_stats["session_length_min"]                   = session_length_min                # minutes
-    session_stats["session_length_max"]                   = session_length_max                # minutes
-    session_stats["which_session_longest"]                = which_session_longest
-    session_stats["mean_session_length_first2"]           = mean_duration_first2              # minutes
-    session_stats["mean_session_length_last2"]            = mean_duration_last2               # minutes
-    session_stats["mean_class_length_first2"]             = mean_class_duration_first2        # minutes
-    session_stats["mean_class_length_last2"]              = mean_class_duration_last2         # minutes   
-    session_stats["class_count_session_list"]             = class_count_session_list          # semicolon-separated
-
-
-    # lists don't preserve column order so let's manually order
-    col_order = ['user_id',
-            'n_class',
-            'n_sessions',
-            'n_days',
-            'first_day',
-            'last_day',
-            'tdiff_firstlast_hours',
-            'time_spent_classifying_total_minutes',
-            'class_per_session_min',
-            'class_per_session_max',
-            'class_per_session_med',
-            'class_per_session_mean',
-            'class_length_mean_overall',
-            'class_length_median_overall',
-            'session_length_mean',
-            'session_length_median',
-            'session_length_min',
-            'session_length_max',
-            'which_session_longest',
-            'mean_session_length_first2',
-            'mean_session_length_last2',
-            'mean_class_length_first2',
-            'mean_class_length_last2',
-            'class_count_session_list']
-
-
-    return pd.Series(session_stats)[col_order]
-    #return session_stats
+        first_created_at = np.min(classifications['created_at'])
+        last_created_at  = np.max(classifications['created_at'])
+        nclass_counts    = np.bincount(classifications['user_code'], minlength=len(classifications['user_names']))
 
+    the_results = {'classifications': classifications}
+    the_results['first_class_day'] = day_string(first_created_at)
+    the_results['last_class_day']  = day_string(last_created_at)
+    the_results['overall'] = classifier_stats(nclass_counts, classifications['user_names'], classifications['user_registered'],
+                                              classifications['n_subjects'], top_n, profile)
 
+    if partition_by is not None:
+        the_results['partition_by'] = partition_by
+        the_results['partition_code'], the_results['partition_keys'], the_results['partition_summary'] = partition_summary(classifications,
+                                                                                                          partition_by, profile)
+    return the_results
 
 
-#################################################################################
-#################################################################################
-#################################################################################
 
+# Add the per-user session stats (see session_stats()) to the_results from project_stats(), as
+# session_stats and session_arrays, and with partition_by, the stats on each partition as
+# partition_stats (see partition_session_stats()).
+def add_session_stats(the_results, classifications, session_break=default_break, workers=1, with_sessions=False, presorted=False,
+                      profile=None, progress=None):
+    with stage(profile, 'per-user stats', the_results['overall']['n_class_tot']):
+        the_results['session_stats'], the_results['session_arrays'] = session_stats(classifications, session_break, workers, progress,
+                                                                                   with_sessions, presorted)
+        if 'partition_by' in the_results:
+            the_results['partition_stats'] = partition_session_stats(classifications, the_results['partition_code'], the_results['partition_keys'],
+                                                                     the_results['partition_by'], session_break, workers)
+    return the_results
 
-# Get the Gini coefficient - https://en.wikipedia.org/wiki/Gini_coefficient
-# 
-# The Gini coefficient measures inequality in distributions of things.
-# It was originally conceived for economics (e.g. where is the wealth in a country?
-#  in the hands of many citizens or a few?), but it's just as applicable to many
-#  other fields. In this case we'll use it to see how classifications are
-#  distributed among classifiers.
-# G = 0 is a completely even distribution (everyone does the same number of 
-#  classifications), and ~1 is uneven (~all the classifications are done
-#  by one classifier). 
-# Typical values of the Gini for healthy Zooniverse projects (Cox et al. 2015) are
-#  in the range of 0.7-0.9.
-#  That range is generally indicative of a project with a loyal core group of 
-#    volunteers who contribute the bulk of the classification effort, but balanced
-#    out by a regular influx of new classifiers trying out the project, from which
-#    you continue to draw to maintain a core group of prolific classifiers.
-# Once your project is fairly well established, you can compare it to past Zooniverse
-#  projects to see how you're doing. 
-#  If your G is << 0.7, you may be having trouble recruiting classifiers into a loyal 
-#    group of volunteers. People are trying it, but not many are staying.
-#  If your G is > 0.9, it's a little more complicated. If your total classification
-#    count is lower than you'd like it to be, you may be having trouble recruiting
-#    classifiers to the project, such that your classification counts are
-#    dominated by a few people.
-#  But if you have G > 0.9 and plenty of classifications, this may be a sign that your
-#    loyal users are -really- committed, so a very high G is not necessarily a bad thing.
-#
-# Of course the Gini coefficient is a simplified measure that doesn't always capture
-#  subtle nuances and so forth, but it's still a useful broad metric.
 
-def gini(list_of_values):
-    sorted_list = sorted(list_of_values)
-    height, area = 0, 0
-    for value in sorted_list:
-        height += value
-        area += height - value / 2.
-    fair_area = height * len(list_of_values) / 2
-    return (fair_area - area) / fair_area
-    
-    
 
+# Add the stats for each of session_breaks (see sweep_session_stats()) to the_results from
+# project_stats(), as sweep_stats (a list of DataFrames), with the breaks as session_breaks.
+def add_sweep_stats(the_results, classifications, session_breaks, workers=1, presorted=False, profile=None, progress=None):
+    with stage(profile, 'per-user stats', the_results['overall']['n_class_tot']):
+        the_results['sweep_stats'] = sweep_session_stats(classifications, session_breaks, workers, progress, presorted)
+    the_results['session_breaks'] = list(session_breaks)
+    return the_results
 
-#################################################################################
-#################################################################################
-#################################################################################
 
 
+# Add the histograms of the gaps between classifications (see gap_report.py) to the_results
+# from project_stats(), as gap_report.
+def add_gap_report(the_results, classifications, profile=None):
+    with stage(profile, 'gaps', the_results['overall']['n_class_tot']):
+        the_results['gap_report'] = gap_histograms(classifications['user_code'], classifications['created_at'], classifications['user_registered'])
+    return the_results
 
 
-# Begin the main stuff
 
+# Why the saved sessions (state, from incremental_sessions.load_state(state_dir)) can't be
+# carried on from for an export of n_class_tot classifications, or None if they can.
+def incremental_restart_reason(state, state_dir, session_break, n_class_tot):
+    if state is None:
+        return "no saved sessions in %s yet" % state_dir
+    if state['session_break'] != session_break:
+        return "saved sessions are for a break of %s minutes" % state['session_break']
+    if state['n_class_tot'] > n_class_tot:
+        return "saved sessions are for %d classifications, more than this export has" % state['n_class_tot']
+    return None
 
-print "Reading classifications from "+classfile_in
 
-classifications = pd.read_csv(classfile_in)
 
-# first, extract the started_at and finished_at from the annotations column
-classifications['meta_json'] = [json.loads(q) for q in classifications.metadata]
+# Add the stats from the sessions saved in state_dir, updated with the classifications since
+# then (see incremental_sessions.py), to the_results from project_stats(), as
+#   state                    - the updated state (not saved yet; write_stats() saves it)
+#   state_dir
+#   n_class_new, n_users_new - how many classifications were new, and how many users' stats changed
+#   restart_reason           - why it started from scratch (see incremental_restart_reason()), or None
+def add_incremental_stats(the_results, classifications, state_dir, session_break=default_break, profile=None):
+    with stage(profile, 'per-user stats', the_results['overall']['n_class_tot']):
+        state = incremental_sessions.load_state(state_dir)
+        the_results['restart_reason'] = incremental_restart_reason(state, state_dir, session_break, the_results['overall']['n_class_tot'])
+        the_results['state'], the_results['n_class_new'], the_results['n_users_new'] = incremental_sessions.update_state(state, classifications,
+                                                                                                                      session_break)
+    the_results['state_dir'] = state_dir
+    return the_results
 
 
-classifications['started_at_str']  = [q['started_at']  for q in classifications.meta_json]
-classifications['finished_at_str'] = [q['finished_at'] for q in classifications.meta_json]
 
-classifications['created_day'] = [q[:10] for q in classifications.created_at]
+# Everything the script works out for one export, from the dict read_input() (or
+# panoptes_io.read_compact()) returns: project_stats() with add_session_stats().
+def analyze(classifications, session_break=default_break, top_n=default_k, partition_by=None, workers=1, with_sessions=False,
+            presorted=False, profile=None, progress=None):
+    the_results = project_stats(classifications, top_n, partition_by, profile)
+    return add_session_stats(the_results, classifications, session_break, workers, with_sessions, presorted, profile, progress)
+
+
+
+# The same as analyze(), from a DataFrame of (at least) the panoptes_io.compact_cols_read
+# columns that's already been read.
+def analyze_frame(classifications, session_break=default_break, top_n=default_k, partition_by=None, workers=1, with_sessions=False):
+    return analyze(compact_from_frame(classifications), session_break, top_n, partition_by, workers, with_sessions)
+
+
+
+# The same as analyze() for each of a list of session breaks (--sweep); see add_sweep_stats().
+def analyze_sweep(classifications, session_breaks, top_n=default_k, workers=1, presorted=False, profile=None, progress=None):
+    the_results = project_stats(classifications, top_n, None, profile)
+    return add_sweep_stats(the_results, classifications, session_breaks, workers, presorted, profile, progress)
 
-first_class_day = min(classifications.created_day).replace(' ', '')
-last_class_day  = max(classifications.created_day).replace(' ', '')
 
 
-# The next thing we need to do is parse the dates into actual datetimes
+# The project-wide numbers and the gaps between classifications (--gaps), instead of the
+# session stats; see add_gap_report().
+def analyze_gaps(classifications, top_n=default_k, profile=None):
+    return add_gap_report(project_stats(classifications, top_n, None, profile), classifications, profile)
 
-# I don't remember why this is needed but I think it's faster to use this below than a for loop on the actual column
-ca_temp = classifications['created_at'].copy()
-sa_temp = classifications['started_at_str'].copy().str.replace('T',' ').str.replace('Z', '')
-fa_temp = classifications['finished_at_str'].copy().str.replace('T',' ').str.replace('Z', '')
 
-print "Creating timeseries..."#,datetime.datetime.now().strftime('%H:%M:%S.%f')
 
-# Do these separately so you can track errors to a specific line
-# Try the format-specified ones first (because it's faster, if it works)
-try:
-    classifications['created_at_ts'] = pd.to_datetime(ca_temp, format='%Y-%m-%d %H:%M:%S %Z')
-except Exception as the_error:
-    print "Oops:\n", the_error
-    try:
-        classifications['created_at_ts'] = pd.to_datetime(ca_temp, format='%Y-%m-%d %H:%M:%S')
-    except Exception as the_error:
-        print "Oops:\n", the_error
-        classifications['created_at_ts'] = pd.to_datetime(ca_temp)
+# The same as analyze(), carrying on from the sessions saved in state_dir (--incremental); see
+# add_incremental_stats().
+def analyze_incremental(classifications, state_dir, session_break=default_break, top_n=default_k, profile=None):
+    the_results = project_stats(classifications, top_n, None, profile)
+    return add_incremental_stats(the_results, classifications, state_dir, session_break, profile)
 
 
-try:
-    classifications['started_at'] = pd.to_datetime(sa_temp, format='%Y-%m-%d %H:%M:%S.%f')
-except Exception as the_error:
-    print "Oops:\n", the_error
-    try:
-        classifications['started_at'] = pd.to_datetime(sa_temp, format='%Y-%m-%d %H:%M:%S %Z')
-    except Exception as the_error:
-        print "Oops:\n", the_error
-        classifications['started_at'] = pd.to_datetime(sa_temp)
 
+# The same as analyze() for an export too big to fit in memory (--out-of-core), straight from
+# the file, which is read chunksize rows at a time and sorted on disk (in tmp_dir) as it goes;
+# see external_sort.py. The classifications in the results are just the totals.
+def analyze_out_of_core(classfile_in, session_break=default_break, top_n=default_k, chunksize=external_sort.default_chunksize, tmp_dir=None,
+                        with_sessions=False, profile=None, progress=None, read_progress=None):
+    session_arrays, totals = external_sort.sessionstats_from_file(classfile_in, session_break, chunksize, tmp_dir, profile,
+                                                                  progress=progress, read_progress=read_progress, with_sessions=with_sessions)
+    the_results = project_stats(totals, top_n, None, profile)
+    with stage(profile, 'per-user stats'):
+        the_results['session_stats'] = session_engine.sessionstats_to_frame(session_arrays, totals['user_names'])
+    the_results['session_arrays'] = session_arrays
+    return the_results
 
-try:
-    classifications['finished_at'] = pd.to_datetime(fa_temp, format='%Y-%m-%d %H:%M:%S.%f')
-except Exception as the_error:
-    print "Oops:\n", the_error
-    try:
-        classifications['finished_at'] = pd.to_datetime(fa_temp, format='%Y-%m-%d %H:%M:%S %Z')
-    except Exception as the_error:
-        print "Oops:\n", the_error
-        classifications['finished_at'] = pd.to_datetime(fa_temp)
 
 
+# The files the stats go to from statsfile_out: one per break for a sweep (unless it's all in
+# one long table), and one for the stats on each partition
+def sweep_statsfiles(statsfile_out, session_breaks):
+    the_root, the_ext = os.path.splitext(statsfile_out)
+    return [the_root + '_break%g' % q + the_ext for q in session_breaks]
 
+def partition_statsfile(statsfile_out, partition_by):
+    the_root, the_ext = os.path.splitext(statsfile_out)
+    return the_root + '_by_' + partition_by + the_ext
 
 
 
-# save processing time and memory; only keep the columns we're going to use
-# though before we do that, grab the subject count
-n_subj_tot  = len(classifications.subject_data.unique())
-classifications = classifications[cols_used]
+# Write the stats in the_results (from analyze(), analyze_sweep(), analyze_incremental() or
+# analyze_out_of_core(), or project_stats() with one of the add_...() functions) to statsfile_out,
+# and the files named after it (see sweep_statsfiles() and partition_statsfile()).
+# With sweep_long, a sweep goes to statsfile_out as one table, with a session_break column
+# first. With sessions_out, the per-session table goes there too (see session_engine.session_table();
+# the session stats have to be from with_sessions=True). The incremental state is saved after
+# the stats file is written.
+def write_stats(the_results, statsfile_out, sweep_long=False, sessions_out=None, profile=None):
+    n_breaks = len(the_results.get('session_breaks', [None]))
+    with stage(profile, 'write', the_results['overall']['n_users_tot'] * n_breaks):
+        if 'state' in the_results:
+            with open(statsfile_out, 'wb') as f:
+                f.write(incremental_sessions.stats_header())
+                f.write(the_results['state']['stats_lines'])
+            incremental_sessions.save_state(the_results['state_dir'], the_results['state'])
+        elif 'sweep_stats' in the_results and sweep_long:
+            # one table, the break first and then the usual columns
+            the_table = pd.concat(the_results['sweep_stats'])
+            the_table.insert(0, 'session_break', np.repeat(the_results['session_breaks'], [len(q) for q in the_results['sweep_stats']]))
+            the_table.to_csv(statsfile_out)
+        elif 'sweep_stats' in the_results:
+            for the_file, the_frame in zip(sweep_statsfiles(statsfile_out, the_results['session_breaks']), the_results['sweep_stats']):
+                the_frame.to_csv(the_file)
+        else:
+            the_results['session_stats'].to_csv(statsfile_out)
+        if 'partition_stats' in the_results:
+            the_results['partition_stats'].to_csv(partition_statsfile(statsfile_out, the_results['partition_by']))
+        if sessions_out is not None:
+            session_engine.write_session_table(sessions_out, the_results['session_arrays'], the_results['classifications']['user_names'],
+                                               the_results['classifications']['user_ids'])
 
-# index by created_at as a timeseries
-# note: this means things might not be uniquely indexed
-# but it makes a lot of things easier and faster.
-# update: it's not really needed in the main bit, but will do it on each group later.
-#classifications.set_index('created_at_ts', inplace=True)
 
 
-all_users = classifications.user_name.unique()
-by_user = classifications.groupby('user_name')
+def print_classifier_stats(the_stats, top_n=default_k, with_shares=False):
+    print "\nOverall:\n\n",the_stats['n_class_tot'],"classifications of",the_stats['n_subj_tot'],"subjects by",the_stats['n_users_tot'],"classifiers,"
+    print the_stats['n_reg'],"registered and",the_stats['n_unreg'],"unregistered.\n"
+    print "Median number of classifications per user:",the_stats['nclass_med']
+    print "Mean number of classifications per user: %.2f" % the_stats['nclass_mean']
+    print "\nTop %d most prolific classifiers:\n" % top_n,the_stats['nclass_byuser_ranked']
+    print "\n\nGini coefficient for classifications by user: %.2f\n" % the_stats['nclass_gini']
+    if with_shares:
+        for the_line in top_share_lines(the_stats['nclass_ineq'], the_stats['n_users_tot']):
+            print the_line
+        print ""
 
 
-# get total classification and user counts
-n_class_tot = len(classifications)
-n_users_tot = len(all_users)
 
-unregistered = [q.startswith("not-logged-in") for q in all_users]
-n_unreg = sum(unregistered)
-n_reg   = n_users_tot - n_unreg
+def print_profile(profile, profile_json):
+    print "\nTime and memory used by each stage:\n"
+    print format_profile(profile)
+    if profile_json is not None:
+        write_profile_json(profile, profile_json)
+        print "\n(saved to",profile_json+")"
 
-# for the leaderboard, which I recommend project builders never make public because 
-# Just Say No to gamification
-# But it's still interesting to see who your most prolific classifiers are, and
-# e.g. whether they're also your most prolific Talk users
-nclass_byuser = by_user.created_at.aggregate('count')
-nclass_byuser_ranked = nclass_byuser.copy()
-nclass_byuser_ranked.sort(ascending=False)
 
-# very basic stats
-nclass_med    = np.median(nclass_byuser)
-nclass_mean   = np.mean(nclass_byuser)
 
-# Gini coefficient - see the comments above the gini() function for more notes
-nclass_gini   = gini(nclass_byuser)
+# statsfile_out with the days of the first and last classifications added before the .csv, as
+# it's written when no stats_outfile is given (or add_dates_to_file is 1)
+def dated_statsfile(statsfile_out, first_class_day, last_class_day):
+    return statsfile_out.replace('.csv', '_'+first_class_day+'_to_'+last_class_day+'.csv')
 
-print "\nOverall:\n\n",n_class_tot,"classifications of",n_subj_tot,"subjects by",n_users_tot,"classifiers,"
-print n_reg,"registered and",n_unreg,"unregistered.\n"
-print "Median number of classifications per user:",nclass_med
-print "Mean number of classifications per user: %.2f" % nclass_mean
-print "\nTop 10 most prolific classifiers:\n",nclass_byuser_ranked.head(10)
-print "\n\nGini coefficient for classifications by user: %.2f\n" % nclass_gini
 
 
-# compute the per-user stats
-# alas I don't know of a way to print a progress bar or similar for group.apply() functions
-#     addition: apparently there's "pip install progressbar", but I haven't tried it yet, feel free to hack
-# For a small classification file this is fast, but if you have > 1,000,000 this may be slow
-#  (albeit still much faster than a loop or similar)
-# For a test file with 175,000 classifications and ~4,500 users it takes just under 90 seconds.
-print "\nComputing session stats for each user...",datetime.datetime.now().strftime('%H:%M:%S.%f')
-session_stats = by_user.apply(sessionstats)
+# The argv for main() to write the stats of classfile_in to statsfile_out (with the dates added,
+# if add_dates) with a session break of session_break minutes, for running the script from
+# other code. (repr() so the break main() reads back is exactly the same float.)
+def main_args(classfile_in, statsfile_out=default_statsfile, add_dates=True, session_break=default_break):
+    return ['sessions_inproj_byuser.py', classfile_in, statsfile_out, '1' if add_dates else '0', repr(float(session_break))]
+
+
+
+def print_usage(script_name):
+    print "\nUsage: "+script_name+" classifications_infile [stats_outfile add_dates_to_file session_break_length] [--workers N] [--cache] [--incremental state_dir] [--lorenz lorenz_outfile] [--shares] [--profile] [--profile-json json_outfile] [--progress] [--out-of-core [--chunksize N] [--tmpdir dir]] [--sweep b1,b2,... [--sweep-long]] [--gaps gaps_outfile] [--by workflow_id|workflow_version] [--top K] [--sessions sessions_outfile] [--write-intermediate dir]"
+    print "      classifications_infile is a Zooniverse (Panoptes) classifications data export CSV, or a"
+    print "           directory written by --write-intermediate."
+    print "      stats_outfile is the name of an outfile you'd like to write."
+    print "           if you don't specify one it will be "+default_statstart+"_[date]_to_[date].csv"
+    print "           where the dates show the first & last classification date."
+    print "      add_dates_to_file is 1 if you want to add \"_[date]_to_[date]\" to the output filename, as"
+    print "           described above, even if you did specify a stats_outfile name."
+    print "      A new session is defined to start when 2 classifications by the same classifier are"
+    print "           separated by at least session_break_length minutes (default value: 60)"
+    print "      --workers N parses classifications_infile (unless it's compressed) and computes the"
+    print "           session stats in N processes at once (default 1)."
+    print "      --cache keeps a parsed copy of classifications_infile so it loads much faster next time"
+    print "           (see export_cache.py to list or clear the cache)."
+    print "      --incremental state_dir saves where each classifier's sessions got to in state_dir, and"
+    print "           next time only computes the stats of classifiers with new classifications since then"
+    print "           (for a newer export of the same project; see incremental_sessions.py)."
+    print "      --lorenz writes the Lorenz curve of classifications by user (the fraction of all"
+    print "           classifications done by the least prolific fraction of classifiers) to lorenz_outfile."
+    print "      --shares also prints the share of the classifications done by the top 1%, 10% and 50% of"
+    print "           classifiers."
+    print "      --profile prints the wall time, CPU time, memory and rows/s of each stage at the end;"
+    print "           --profile-json also saves them to json_outfile."
+    print "      --progress shows a running count of the users whose session stats are done."
+    print "      --out-of-core is for exports too big to fit in memory: the file is read N rows at a time"
+    print "           (default 1000000) and sorted on disk (in dir, default the system temporary directory)."
+    print "           The output is the same. It can't be used with --cache, --incremental or --workers."
+    print "      --sweep b1,b2,... computes the stats for each of the session break lengths b1, b2, ... (minutes)"
+    print "           instead of session_break_length, all from one pass over the classifications. Each one"
+    print "           goes to its own file, stats_outfile with _break[b] added to the name; with --sweep-long"
+    print "           they all go to stats_outfile, with a session_break column. Not with --incremental or --out-of-core."
+    print "      --gaps writes log-binned histograms of the gaps between consecutive classifications by the"
+    print "           same classifier (all, registered and unregistered) to gaps_outfile and suggests a"
+    print "           session break, instead of computing the session stats. Not with --out-of-core,"
+    print "           --incremental or --sweep."
+    print "      --by workflow_id (or workflow_version) also writes the stats of each classifier on each"
+    print "           workflow (or each version of each workflow) to stats_outfile with _by_workflow_id"
+    print "           (or _by_workflow_version) added to the name, with the workflow (and version) as the"
+    print "           first columns, and prints a summary of each. Not with --out-of-core, --incremental,"
+    print "           --sweep or --gaps."
+    print "      --top K lists the K most prolific classifiers (default 10)."
+    print "      --sessions also writes one row per session of each classifier (its number, start, end, day,"
+    print "           classification count and total and median classification length) to sessions_outfile,"
+    print "           a numpy .npz file with one array per column. Not with --incremental, --sweep or --gaps."
+    print "      --write-intermediate saves the user and the 3 timestamps of each classification, sorted by"
+    print "           user and time, to the directory dir. Giving dir as classifications_infile next time"
+    print "           skips the parsing and the sort, and memory-maps it instead. Runs on an intermediate"
+    print "           can't use --cache, --incremental, --out-of-core or --by."
+    print "\nOnly the classifications_infile is a required input.\n"
+
+
 
-# If no stats file was supplied, add the start and end dates in the classification file to the output filename
-if modstatsfile:
-    statsfile_out = statsfile_out.replace('.csv', '_'+first_class_day+'_to_'+last_class_day+'.csv')
+# The command line version (argv is sys.argv, or the same kind of list). It prints as it goes
+# and writes the stats file(s), and returns the dict from analyze() (or whichever of
+# analyze_sweep(), analyze_gaps(), analyze_incremental() and analyze_out_of_core() the options
+# call for), plus statsfile_out. Without a classifications_infile it prints the usage and
+# returns None.
+# If the options don't make sense it raises ValueError, saying why, before reading anything.
+def main(argv=None):
+    argv = list(sys.argv if argv is None else argv)
+
+    # optional flags can go anywhere on the command line, so take them out first
+    # --workers N parses the file and splits the users between N processes for the session stats
+    # --cache saves the parsed file so the next run on it doesn't have to parse it again
+    # --incremental state_dir keeps the per-user sessions in state_dir and only works out the new ones next time
+    workers   = pop_option(argv, '--workers', 1, int)
+    use_cache = pop_flag(argv, '--cache')
+    state_dir = pop_option(argv, '--incremental')
+    # --lorenz file.csv writes the Lorenz curve of classifications by user
+    lorenz_out = pop_option(argv, '--lorenz')
+    # --shares also prints the share of the classifications done by the top 1%, 10% and 50% of classifiers
+    show_shares = pop_flag(argv, '--shares')
+    # --profile prints the time, memory etc. of each stage at the end, and --profile-json file saves it
+    # --progress shows how many users' stats have been done so far
+    profile_json  = pop_option(argv, '--profile-json')
+    show_profile  = pop_flag(argv, '--profile') or profile_json is not None
+    show_progress = pop_flag(argv, '--progress')
+    # --out-of-core sorts the classifications on disk instead of in memory, for exports bigger than RAM,
+    # reading --chunksize N rows at a time and keeping the temporary files in --tmpdir dir
+    out_of_core = pop_flag(argv, '--out-of-core')
+    chunksize   = pop_option(argv, '--chunksize', external_sort.default_chunksize, int)
+    tmp_dir     = pop_option(argv, '--tmpdir')
+    # --sweep 5,15,30,60 computes the stats for each of those session breaks in one go, writing one
+    # file per break, or with --sweep-long, one file with a session_break column
+    session_breaks = pop_option(argv, '--sweep', None, lambda q: [float(r) for r in q.split(',')])
+    sweep_long     = pop_flag(argv, '--sweep-long')
+    # --gaps file.csv just writes the histograms of the gaps between classifications (for picking a
+    # session break) instead of the session stats
+    gaps_out = pop_option(argv, '--gaps')
+    # --by workflow_id (or workflow_version) also writes each classifier's stats for each workflow
+    # (or version) they've classified on
+    partition_by = pop_option(argv, '--by')
+    # --top K lists the K most prolific classifiers instead of 10
+    top_n = pop_option(argv, '--top', default_k, int)
+    # --sessions file.npz also writes a table with one row per session of each user
+    sessions_out = pop_option(argv, '--sessions')
+    # --write-intermediate dir saves just what the session stats need, sorted, to dir, which can then
+    # be given instead of the export (see session_intermediate.py)
+    intermediate_out = pop_option(argv, '--write-intermediate')
+
+    # file with raw classifications (csv)
+    try:
+        classfile_in = argv[1]
+    except:
+        #classfile_in = 'data/2e3d12a2-56ca-4d1f-930a-9ecc7fd39885.csv'
+        print_usage(argv[0])
+        return None
+
+    if out_of_core and (use_cache or state_dir is not None or workers > 1):
+        raise ValueError("--out-of-core can't be used with --cache, --incremental or --workers.")
+    if session_breaks is not None and (out_of_core or state_dir is not None):
+        raise ValueError("--sweep can't be used with --out-of-core or --incremental.")
+    if gaps_out is not None and (out_of_core or state_dir is not None or session_breaks is not None):
+        raise ValueError("--gaps can't be used with --out-of-core, --incremental or --sweep.")
+    if partition_by is not None and (out_of_core or state_dir is not None or session_breaks is not None or gaps_out is not None):
+        raise ValueError("--by can't be used with --out-of-core, --incremental, --sweep or --gaps.")
+    if partition_by is not None and partition_by not in partition_columns:
+        raise ValueError("--by can only be " + ' or '.join(sorted(partition_columns)))
+    if sessions_out is not None and (state_dir is not None or session_breaks is not None or gaps_out is not None):
+        raise ValueError("--sessions can't be used with --incremental, --sweep or --gaps.")
+    # (an intermediate from --write-intermediate is a directory)
+    from_intermediate = os.path.isdir(classfile_in)
+    if from_intermediate and (use_cache or state_dir is not None or out_of_core or partition_by is not None):
+        raise ValueError("An intermediate (from --write-intermediate) can't be used with --cache, --incremental, --out-of-core or --by.")
+    if intermediate_out is not None and out_of_core:
+        raise ValueError("--write-intermediate can't be used with --out-of-core.")
+    if sweep_long and session_breaks is None:
+        raise ValueError("--sweep-long needs --sweep.")
+
+
+    # Check for the other inputs on the command line
+
+    # Output file
+    try:
+        statsfile_out = argv[2]
+        # If it's given on the command line, don't add the dates to the filename later
+        modstatsfile = False
+    except:
+        statsfile_out = default_statsfile
+        modstatsfile = True
 
-print "Writing to file", statsfile_out,"...",datetime.datetime.now().strftime('%H:%M:%S.%f')
-session_stats.to_csv(statsfile_out)
+    try:
+        add_date_temp = int(argv[3])
+        if add_date_temp == 1:
+            modstatsfile = True
+        # else nothing, just keep whatever modstatsfile is already defined as
+    except:
+        # ignore this as you'll have already defined modstatsfile above
+        pass
 
 
-            
+    try:
+        session_break = float(argv[4])
+    except:
+        session_break = default_break
+
+    # Print out the input parameters just as a sanity check
+    print "Computing session stats using:"
+    print "   infile:",classfile_in
+    # If we're adding the dates to the output file, we can't print it out here because we don't yet know the dates
+    if not modstatsfile:
+        print "   outfile:",statsfile_out
+    if session_breaks is None:
+        print "   new session starts after classifier break of",session_break,"minutes"
+    else:
+        print "   new session starts after classifier break of",", ".join("%g" % q for q in session_breaks),"minutes (one set of stats for each)"
+    if workers > 1:
+        print "   using",workers,"worker processes"
+    if state_dir is not None:
+        print "   updating the saved sessions in",state_dir
+    if out_of_core:
+        print "   sorting on disk,",chunksize,"rows at a time"
+    if partition_by is not None:
+        print "   split by",partition_by
+    print ""
+
+
+    # Begin the main stuff
+
+    # the time & memory used by each stage, if we're keeping track (see stage_profiler.py)
+    profile = new_profile(argv[0]) if show_profile else None
+    progress = progress_printer('session stats', 'users') if show_progress else None
+
+    print "Reading classifications from "+classfile_in
+
+    # See read_input().
+    # With --out-of-core we never have all of that at once; the file is read a chunk at a time and
+    # sorted on disk, and the session stats are computed straight away as the sorted classifications
+    # come back off the disk (see analyze_out_of_core()). What we get back then is just the totals.
+    if out_of_core:
+        the_results = analyze_out_of_core(classfile_in, session_break, top_n, chunksize, tmp_dir, sessions_out is not None, profile,
+                                          progress, progress_printer('reading', 'rows') if show_progress else None)
+        classifications = the_results['classifications']
+    else:
+        classifications, the_source = read_input(classfile_in, use_cache, workers, profile)
+        if the_source == 'intermediate':
+            print "  (an intermediate of",classifications['source']+")"
+        elif the_source == 'cache':
+            print "  (read from the cache)"
+        if intermediate_out is not None:
+            print "Writing the intermediate to",intermediate_out
+            with stage(profile, 'write intermediate', len(classifications['user_code'])):
+                write_intermediate(intermediate_out, classifications, classfile_in)
+        the_results = project_stats(classifications, top_n, partition_by, profile)
+
+    if classifications['n_meta_fallback'] > 0:
+        print "  (had to fully decode the metadata for",classifications['n_meta_fallback'],"classifications)"
+    for the_col in ['created_at', 'started_at', 'finished_at']:
+        if classifications['n_slow_timestamps'][the_col] > 0:
+            print "  ",classifications['n_slow_timestamps'][the_col],"of the",the_col,"values weren't in a format we know; parsed them the slow way"
+
+    overall = the_results['overall']
+    print_classifier_stats(overall, top_n, show_shares)
+
+    if lorenz_out is not None:
+        print "Writing the Lorenz curve of classifications by user to",lorenz_out
+        write_lorenz_csv(lorenz_out, overall['nclass_ineq'])
+
+    # With --by, the same counts for each partition (see partitions.py)
+    if partition_by is not None:
+        print "\nBy",partition_by+":\n"
+        for the_part in the_results['partition_summary']:
+            print "%s: %d classifications of %d subjects by %d classifiers (%d registered), Gini coefficient %.2f" % (the_part['label'],
+                        the_part['n_class'], the_part['n_subjects'], the_part['n_users'], the_part['n_registered'], the_part['gini'])
+
+
+    # With --gaps, the distribution of the gaps between classifications is all we want
+    # (see gap_report.py)
+    if gaps_out is not None:
+        add_gap_report(the_results, classifications, profile)
+        print "\nGaps between classifications:\n"
+        for the_line in gap_report_lines(the_results['gap_report'], session_break):
+            print the_line
+        print "\nWriting the gap histograms to",gaps_out
+        write_gap_csv(gaps_out, the_results['gap_report'])
+        if profile is not None:
+            print_profile(profile, profile_json)
+        return the_results
+
+
+    # compute the per-user stats (see session_stats())
+    # With --incremental, only the classifications since the last run are sessionized, and only the
+    # users who made them get their stats recomputed; see incremental_sessions.py.
+    # With --out-of-core they've already been done, above.
+    print "\nComputing session stats for each user...",datetime.datetime.now().strftime('%H:%M:%S.%f')
+    if session_breaks is not None:
+        add_sweep_stats(the_results, classifications, session_breaks, workers, from_intermediate, profile, progress)
+    elif state_dir is not None:
+        add_incremental_stats(the_results, classifications, state_dir, session_break, profile)
+        if the_results['restart_reason'] is not None:
+            print "  ("+the_results['restart_reason']+"; starting from scratch)"
+        print "  ",the_results['n_class_new'],"new classifications;",the_results['n_users_new'],"classifiers' stats updated"
+    elif not out_of_core:
+        add_session_stats(the_results, classifications, session_break, workers, sessions_out is not None, from_intermediate, profile, progress)
+
+    # If no stats file was supplied, add the start and end dates in the classification file to the output filename
+    if modstatsfile:
+        statsfile_out = dated_statsfile(statsfile_out, the_results['first_class_day'], the_results['last_class_day'])
+    the_results['statsfile_out'] = statsfile_out
+
+    if session_breaks is not None and not sweep_long:
+        print "Writing to files", ", ".join(sweep_statsfiles(statsfile_out, session_breaks)),"...",datetime.datetime.now().strftime('%H:%M:%S.%f')
+    else:
+        print "Writing to file", statsfile_out,"...",datetime.datetime.now().strftime('%H:%M:%S.%f')
+    if partition_by is not None:
+        print "Writing the stats for each",partition_by,"to", partition_statsfile(statsfile_out, partition_by)
+    if sessions_out is not None:
+        print "Writing the",int(np.sum(the_results['session_arrays']['n_sessions'])),"sessions to",sessions_out
+    write_stats(the_results, statsfile_out, sweep_long, sessions_out, profile)
+
+    if profile is not None:
+        print_profile(profile, profile_json)
+
+    return the_results
+
+
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except ValueError as the_error:
+        print "\n%s\n" % the_error
+        sys.exit(1)
@@ -0,0 +1,187 @@
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# Small fixed-size summaries ("sketches") of the users and subjects in an export, for
+# basic_project_stats.py --approx: a quick health check of exports too big to count exactly.
+#
+# Both kinds here are mergeable: a sketch of two chunks of a file (or of two halves read by
+# two workers) is just the merge of the sketches of each, and comes out the same whatever
+# order they're merged in. So the file can be read a chunk at a time and nothing has to
+# grow with the number of users or subjects.
+#
+#   HyperLogLog (hll_*)        - the number of distinct users or subjects, to within about
+#                                1.04/sqrt(2**precision) (0.8% for the default precision of 14),
+#                                in 16 kB
+#   bottom-k samples (sample_*) - the k users (or subjects) whose hashes are smallest, i.e. a
+#                                random sample of them that doesn't depend on the order they
+#                                turn up in, with their classification counts. Any user in the
+#                                sample of the whole file is in the sample of every chunk they
+#                                appear in, so their counts are exact, not estimates. The
+#                                median (or any quantile) of the counts in the sample is then
+#                                an estimate of the median over all users, with a bound on
+#                                how far off in rank it can be (see sample_quantile()), and
+#                                the fraction of them with some flag set (e.g. registered
+#                                users) estimates the fraction of all of them (see
+#                                sample_fraction()).
+# (An ordinary quantile sketch like t-digest or KLL needs each user's final count to be fed
+# to it, which means counting every user exactly first; sampling the users is what avoids that.)
+#
+# Everything is keyed on a 64-bit hash that's the same in every process and python version
+# (see hash_strings() and hash_ints()), so sketches from different runs or workers can be
+# merged.
+
+import hashlib
+
+import numpy as np
+
+
+default_precision = 14
+default_sample_size = 65536
+
+# for the error bounds: 95%
+default_confidence = 0.95
+
+
+
+# 64-bit hashes of strings (e.g. user names): the first 8 bytes of their MD5
+def hash_strings(the_strings):
+    the_digests = [hashlib.md5(q if isinstance(q, bytes) else q.encode('utf-8')).digest()[:8] for q in the_strings]
+    return np.frombuffer(b''.join(the_digests), dtype='<u8').astype(np.uint64)
+
+
+
+# 64-bit hashes of integers (e.g. subject ids), with the splitmix64 finalizer, which spreads
+# consecutive ids all over the range
+def hash_ints(the_ints):
+    z = np.asarray(the_ints, dtype=np.int64).astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+
+# the number of bits needed for each element of an array of uint64 (0 for 0)
+def bit_length(the_values):
+    w = np.asarray(the_values, dtype=np.uint64).copy()
+    n_bits = np.zeros(len(w), dtype=np.int64)
+    for the_shift in (32, 16, 8, 4, 2, 1):
+        shifted = w >> np.uint64(the_shift)
+        has_more = shifted > 0
+        n_bits += the_shift * has_more
+        w = np.where(has_more, shifted, w)
+    return n_bits + (w > 0)
+
+
+
+def new_hll(precision=default_precision):
+    return np.zeros(2**precision, dtype=np.uint8)
+
+
+
+# Add the hashes to an HLL (in place): the first precision bits pick a register, which keeps
+# the most leading zeros (+1) seen in the rest of the bits.
+def hll_add(hll, the_hashes):
+    precision = int(np.log2(len(hll)))
+    the_hashes = np.asarray(the_hashes, dtype=np.uint64)
+    the_register = (the_hashes >> np.uint64(64 - precision)).astype(np.int64)
+    the_rest = the_hashes & np.uint64(2**(64 - precision) - 1)
+    the_rank = (64 - precision + 1 - bit_length(the_rest)).astype(np.uint8)
+    np.maximum.at(hll, the_register, the_rank)
+    return hll
+
+
+
+def hll_merge(hll_a, hll_b):
+    return np.maximum(hll_a, hll_b)
+
+
+
+# The estimated number of distinct things added to hll, and its relative standard error.
+# (Small counts use linear counting on the empty registers, as in the original paper.)
+def hll_count(hll):
+    m = float(len(hll))
+    the_alpha = 0.7213 / (1. + 1.079 / m)
+    estimate = the_alpha * m * m / np.sum(2. ** -hll.astype(np.float64))
+    n_empty = int(np.sum(hll == 0))
+    if estimate <= 2.5 * m and n_empty > 0:
+        estimate = m * np.log(m / n_empty)
+    return estimate, 1.04 / np.sqrt(m)
+
+
+
+def new_sample(size=default_sample_size):
+    return {'size': size, 'hashes': np.zeros(0, dtype=np.uint64), 'counts': np.zeros(0, dtype=np.int64),
+            'flags': np.zeros(0, dtype=bool)}
+
+
+
+# Merge a bottom-k sample with some more (hash, count) pairs (e.g. the users in one chunk and
+# how many classifications each did in it, or another sample), adding up the counts of the
+# same hash, and keep the size smallest hashes. Returns the new sample.
+# the_flags is an optional flag for each hash (e.g. whether the user is registered), which has
+# to be the same every time the same hash turns up.
+def sample_add(sample, the_hashes, the_counts, the_flags=None):
+    if the_flags is None:
+        the_flags = np.zeros(len(the_hashes), dtype=bool)
+    all_hashes = np.r_[sample['hashes'], np.asarray(the_hashes, dtype=np.uint64)]
+    all_counts = np.r_[sample['counts'], np.asarray(the_counts, dtype=np.int64)]
+    the_uniques, the_codes = np.unique(all_hashes, return_inverse=True)
+    the_sums = np.bincount(the_codes, weights=all_counts, minlength=len(the_uniques)).astype(np.int64)
+    unique_flags = np.zeros(len(the_uniques), dtype=bool)
+    unique_flags[the_codes] = np.r_[sample['flags'], np.asarray(the_flags, dtype=bool)]
+    # (np.unique sorts them, so the smallest are first)
+    return {'size': sample['size'], 'hashes': the_uniques[:sample['size']], 'counts': the_sums[:sample['size']],
+            'flags': unique_flags[:sample['size']]}
+
+
+
+def sample_merge(sample_a, sample_b):
+    return sample_add(sample_a, sample_b['hashes'], sample_b['counts'], sample_b['flags'])
+
+
+
+# Whether the sample holds everything that was added (i.e. there were fewer than size
+# distinct hashes), in which case anything worked out from it is exact.
+def sample_is_complete(sample):
+    return len(sample['hashes']) < sample['size']
+
+
+
+# The q quantile of the counts in the sample, and the range the true quantile (over everything,
+# not just the sample) is in with the given confidence. By the Dvoretzky-Kiefer-Wolfowitz
+# inequality, the sample's distribution is within eps = sqrt(ln(2/(1-confidence))/(2n)) of the
+# true one everywhere, so the true q quantile is between the sample's q-eps and q+eps quantiles.
+def sample_quantile(sample, q, confidence=default_confidence):
+    the_counts = np.sort(sample['counts'])
+    n = len(the_counts)
+    if n == 0:
+        return np.nan, np.nan, np.nan
+    eps = np.sqrt(np.log(2. / (1. - confidence)) / (2. * n))
+    # (the sample's f quantile is its ceil(f*n)'th smallest count)
+    lo, hi = [int(np.clip(np.ceil(f * n) - 1, 0, n - 1)) for f in (q - eps, q + eps)]
+    return np.percentile(the_counts, 100. * q), the_counts[lo], the_counts[hi]
+
+
+
+# The fraction of the sample with its flag set, and the range the fraction of everything is in
+# with the given confidence (the normal approximation to sampling without replacement from a
+# lot of them; 0 to 1 if the sample's too small for that to mean much).
+def sample_fraction(sample, confidence=default_confidence):
+    n = len(sample['flags'])
+    if n == 0:
+        return np.nan, np.nan, np.nan
+    p = np.mean(sample['flags'])
+    if n < 30:
+        return p, 0., 1.
+    z = normal_quantile(0.5 + confidence / 2.)
+    eps = z * np.sqrt(p * (1. - p) / n)
+    return p, max(p - eps, 0.), min(p + eps, 1.)
+
+
+
+# The p quantile of the standard normal distribution (to about 4.5e-4, from Abramowitz &
+# Stegun 26.2.23, which is plenty for error bounds)
+def normal_quantile(p):
+    if p < 0.5:
+        return -normal_quantile(1. - p)
+    t = np.sqrt(-2. * np.log(1. - p))
+    return t - (2.515517 + 0.802853 * t + 0.010328 * t * t) / (1. + 1.432788 * t + 0.189269 * t * t + 0.001308 * t * t * t)
@@ -0,0 +1,158 @@
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# Where does the time (and memory) go? This records, for each stage of a script (reading the
+# file, decoding the metadata, parsing the timestamps, grouping, the per-user stats, writing
+# the output):
+#   - wall time and CPU time
+#   - resident memory at the end of the stage, and the peak so far (of this process, and of
+#     any worker processes it has started)
+#   - how many rows it handled, and so rows per second
+# Used by both scripts with --profile (print a summary at the end) and --profile-json file
+# (save it), and by benchmark.py.
+#
+# A profile is just a dict; stages are recorded with
+#     with stage(profile, 'read') as the_stage:
+#         ...
+#         the_stage['rows'] = n_rows
+# and if the profile is None nothing is recorded at all, so library code can take an
+# optional profile without caring whether anyone is looking. A stage with the same name as
+# one already recorded (e.g. once per chunk of a file) is added on to that one.
+#
+# There's also a live progress line, for the parts that take long enough to want one.
+
+import os
+import sys
+import json
+import time
+import platform
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# resident memory of this process right now, in MB (Linux only; None elsewhere)
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1048576.
+    except (IOError, OSError, ValueError):
+        return None
+
+
+
+# ru_maxrss is in kB on Linux and bytes on a Mac
+def maxrss_mb(the_usage):
+    if sys.platform == 'darwin':
+        return the_usage.ru_maxrss / 1048576.
+    return the_usage.ru_maxrss / 1024.
+
+
+
+# peak resident memory so far of this process (or, with children=True, of the largest of
+# the child processes that have finished), in MB
+def peak_rss_mb(children=False):
+    if resource is None:
+        return None
+    return maxrss_mb(resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF))
+
+
+
+def cpu_seconds():
+    the_times = os.times()
+    # this process plus any children that have finished
+    return the_times[0] + the_times[1] + the_times[2] + the_times[3]
+
+
+
+def new_profile(script=None):
+    return {'script': script,
+            'started': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'stages': []}
+
+
+
+@contextlib.contextmanager
+def stage(profile, name, rows=None):
+    the_stage = {'stage': name, 'rows': rows}
+    if profile is None:
+        yield the_stage
+        return
+
+    cpu0 = cpu_seconds()
+    t0 = time.time()
+    yield the_stage
+    wall = time.time() - t0
+    cpu = cpu_seconds() - cpu0
+
+    # add on to an earlier stage with the same name, if there was one
+    the_previous = [q for q in profile['stages'] if q['stage'] == name]
+    if len(the_previous) > 0:
+        the_previous = the_previous[0]
+        wall += the_previous['wall_s']
+        cpu += the_previous['cpu_s']
+        if the_stage['rows'] is None:
+            the_stage['rows'] = the_previous['rows']
+        elif the_previous['rows'] is not None:
+            the_stage['rows'] += the_previous['rows']
+    else:
+        the_previous = {}
+        profile['stages'].append(the_previous)
+
+    the_previous.update({'stage': name,
+                         'wall_s': wall,
+                         'cpu_s': cpu,
+                         'rows': the_stage['rows'],
+                         'rows_per_s': the_stage['rows'] / wall if (the_stage['rows'] is not None and wall > 0) else None,
+                         'rss_mb': current_rss_mb(),
+                         'peak_rss_mb': peak_rss_mb(),
+                         'peak_rss_children_mb': peak_rss_mb(children=True)})
+
+
+
+def format_profile(profile):
+    the_lines = ["%-22s %10s %10s %12s %14s %10s %10s" % ('stage', 'wall (s)', 'cpu (s)', 'rows', 'rows/s', 'rss (MB)', 'peak (MB)')]
+    for q in profile['stages']:
+        # the peak of any worker processes too, if that's bigger
+        peak = max([r for r in (q['peak_rss_mb'], q['peak_rss_children_mb']) if r is not None] or [None])
+        the_lines.append("%-22s %10.3f %10.3f %12s %14s %10s %10s" % (q['stage'], q['wall_s'], q['cpu_s'],
+                         '-' if q['rows'] is None else '%d' % q['rows'],
+                         '-' if q['rows_per_s'] is None else '%.0f' % q['rows_per_s'],
+                         '-' if q['rss_mb'] is None else '%.0f' % q['rss_mb'],
+                         '-' if peak is None else '%.0f' % peak))
+    the_lines.append("%-22s %10.3f %10.3f" % ('total', sum(q['wall_s'] for q in profile['stages']), sum(q['cpu_s'] for q in profile['stages'])))
+    return '\n'.join(the_lines)
+
+
+
+def write_profile_json(profile, filename):
+    with open(filename, 'w') as f:
+        json.dump(profile, f, indent=1, sort_keys=True)
+
+
+
+# A function to call as progress(n_done, n_total) that keeps a progress line updated on
+# stderr (so it doesn't end up in anything that's reading stdout). n_total can be None if
+# we don't know how much there is. It only redraws every min_interval seconds.
+def progress_printer(label, units, min_interval=0.5):
+    state = {'last': 0., 'width': 0}
+    def progress(n_done, n_total=None):
+        now = time.time()
+        is_done = n_total is not None and n_done >= n_total
+        if not is_done and now - state['last'] < min_interval:
+            return
+        state['last'] = now
+        if n_total:
+            the_line = "  %s: %d of %d %s (%.0f%%)" % (label, n_done, n_total, units, 100. * n_done / n_total)
+        else:
+            the_line = "  %s: %d %s" % (label, n_done, units)
+        # (blank out whatever's left of the last one)
+        sys.stderr.write("\r" + the_line + " " * max(0, state['width'] - len(the_line)))
+        state['width'] = len(the_line)
+        if is_done:
+            sys.stderr.write("\n")
+        sys.stderr.flush()
+    return progress
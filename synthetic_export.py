@@ -0,0 +1,204 @@
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# Make a fake Panoptes classification export, for testing and benchmarking the scripts here
+# on files of any size (see benchmark.py) without needing a real project's data.
+#
+# The file has exactly the columns of a real export:
+# classification_id,user_name,user_id,user_ip,workflow_id,workflow_name,workflow_version,created_at,gold_standard,expert,metadata,annotations,subject_data
+# and tries to look like one where it matters to the analysis:
+#   - the number of classifications per user is heavy-tailed: user k (in a random order) is
+#     picked with a weight of 1/k**alpha, so a few users do most of the work and most users
+#     only do a few
+#   - a fraction of the users are not logged in ("not-logged-in-" + a hashed IP, no user_id)
+#   - classifications come in sessions: a user turns up at a random time, does a
+#     (geometrically distributed) number of classifications a few tens of seconds apart,
+#     then leaves
+#   - the metadata JSON has started_at and finished_at (plus the other things the browser
+#     sends, so the field isn't unrealistically short)
+#   - the annotations JSON is padded out to roughly annotation_bytes, since in real exports
+#     it's usually most of the file
+# The rows come out in created_at order, with consecutive classification_ids, same as an export.
+#
+# The file is written a chunk of time at a time, so memory use doesn't depend on n_rows
+# and 1e8-row files are fine (if slow: expect roughly a minute per few million rows).
+#
+# Usage:
+#   python synthetic_export.py outfile n_rows [--users N] [--unregistered F] [--alpha A]
+#                              [--subjects N] [--days N] [--annotation-bytes N] [--seed N]
+
+import sys
+
+import numpy as np
+
+from cmdline_flags import pop_option
+
+
+# the header of a real export (see the scripts)
+export_columns = ['classification_id', 'user_name', 'user_id', 'user_ip', 'workflow_id', 'workflow_name',
+                  'workflow_version', 'created_at', 'gold_standard', 'expert', 'metadata', 'annotations',
+                  'subject_data']
+
+# the columns of a row, with the JSON ones already quoted for CSV (" doubled) and the rest
+# filled in per row
+row_template = ('%d,%s,%s,%s,1234,Synthetic workflow,%s,%s UTC,,,'
+                '"{""source"": ""api"", ""session"": ""%s"", ""viewport"": {""width"": 1280, ""height"": 800}, '
+                '""started_at"": ""%sZ"", ""user_agent"": ""Mozilla/5.0 (X11; Linux x86_64; rv:45.0) Gecko/20100101 Firefox/45.0"", '
+                '""utc_offset"": ""0"", ""finished_at"": ""%sZ"", ""user_language"": ""en""}",'
+                '"[{""task"": ""T0"", ""task_label"": ""What do you see?"", ""value"": ""%s""}]",'
+                '"{""%d"": {""retired"": null, ""Filename"": ""subject_%d.jpg""}}"\n')
+
+workflow_versions = np.array(['12.34', '12.35', '14.2'], dtype=object)
+
+# seconds
+mean_gap = 40.
+min_class_length, max_class_length = 5., 90.
+mean_session_n_class = 10.
+
+ns_per_s = 10**9
+
+
+
+def make_users(n_users, unregistered, alpha, rng):
+    is_unreg = rng.random_sample(n_users) < unregistered
+    names = np.empty(n_users, dtype=object)
+    ids = np.empty(n_users, dtype=object)
+    hashes = rng.randint(0, 2**31, size=n_users)
+    for i in range(n_users):
+        if is_unreg[i]:
+            names[i] = 'not-logged-in-%08x' % hashes[i]
+            ids[i] = ''
+        else:
+            names[i] = 'synthetic_user_%d' % i
+            ids[i] = str(100000 + i)
+    ips = np.array(['%08x%08x' % (q, q ^ 0x5bd1e995) for q in hashes], dtype=object)
+
+    # heavy-tailed weights, in a random order so they aren't tied to the names
+    weights = 1. / np.arange(1, n_users + 1) ** alpha
+    weights = weights[rng.permutation(n_users)]
+    return names, ids, ips, weights / weights.sum()
+
+
+
+# All the classifications of the sessions that start between t0 and t1 (ns), for n_rows
+# classifications in total (the last session is cut short to fit).
+# Returns arrays of user, created_at (ns), session number.
+def make_sessions(n_rows, t0, t1, user_weights, rng):
+    n_sessions = int(np.ceil(n_rows / mean_session_n_class)) + 1
+    session_n_class = rng.geometric(1. / mean_session_n_class, size=n_sessions)
+    # enough sessions to cover n_rows
+    while session_n_class.sum() < n_rows:
+        session_n_class = np.r_[session_n_class, rng.geometric(1. / mean_session_n_class, size=n_sessions)]
+    last = np.searchsorted(np.cumsum(session_n_class), n_rows)
+    session_n_class = session_n_class[:last + 1]
+    session_n_class[-1] -= session_n_class.sum() - n_rows
+
+    n_sessions = len(session_n_class)
+    session_user = rng.choice(len(user_weights), size=n_sessions, p=user_weights)
+    session_start = t0 + (rng.random_sample(n_sessions) * (t1 - t0)).astype(np.int64)
+
+    # the time of each classification is the session start plus the gaps before it in the session
+    which_session = np.repeat(np.arange(n_sessions), session_n_class)
+    gaps = (rng.exponential(mean_gap, size=n_rows) * ns_per_s).astype(np.int64) + ns_per_s
+    first = np.r_[0, np.cumsum(session_n_class)[:-1]]
+    gaps[first] = 0
+    offset = np.cumsum(gaps)
+    offset -= np.repeat(offset[first], session_n_class)
+    return session_user[which_session], session_start[which_session] + offset, which_session
+
+
+
+def write_export(outfile, n_rows, n_users=None, unregistered=0.3, alpha=1.1, n_subjects=None,
+                 n_days=90, annotation_bytes=200, seed=42, start='2016-01-01', chunk_rows=500000):
+    rng = np.random.RandomState(seed)
+    if n_users is None:
+        n_users = max(10, n_rows // 40)
+    if n_subjects is None:
+        n_subjects = max(10, n_rows // 20)
+
+    names, ids, ips, user_weights = make_users(n_users, unregistered, alpha, rng)
+    # varied but cheap annotation text: slices of one long random string
+    filler = ''.join(rng.choice(list('abcdefghijklmnopqrstuvwxyz      '), size=annotation_bytes + 4096))
+
+    t_start = np.datetime64(start, 'ns').astype(np.int64)
+    t_end = t_start + n_days * 24 * 3600 * ns_per_s
+    n_chunks = max(1, int(np.ceil(n_rows / float(chunk_rows))))
+    chunk_edges = np.linspace(t_start, t_end, n_chunks + 1).astype(np.int64)
+    chunk_sizes = np.diff(np.linspace(0, n_rows, n_chunks + 1).astype(np.int64))
+
+    # classifications from sessions that carry on past the end of their chunk of time are
+    # held over and written with the next one, so the whole file is in created_at order
+    held = (np.zeros(0, dtype=np.int64),) * 3
+    next_id = 10000000
+    n_sessions_so_far = 0
+
+    with open(outfile, 'w') as f:
+        f.write(','.join(export_columns) + '\n')
+        for i_chunk in range(n_chunks):
+            user, created_at, session = make_sessions(chunk_sizes[i_chunk], chunk_edges[i_chunk], chunk_edges[i_chunk + 1], user_weights, rng)
+            session = session + n_sessions_so_far
+            n_sessions_so_far = session.max() + 1 if len(session) > 0 else n_sessions_so_far
+            user, created_at, session = [np.r_[q, r] for q, r in zip(held, (user, created_at, session))]
+
+            order = np.argsort(created_at, kind='mergesort')
+            user, created_at, session = user[order], created_at[order], session[order]
+            if i_chunk < n_chunks - 1:
+                n_now = np.searchsorted(created_at, chunk_edges[i_chunk + 1])
+                held = (user[n_now:], created_at[n_now:], session[n_now:])
+                user, created_at, session = user[:n_now], created_at[:n_now], session[:n_now]
+
+            next_id = write_rows(f, next_id, user, created_at, session, names, ids, ips, n_subjects, filler, annotation_bytes, rng)
+
+    return next_id - 10000000
+
+
+
+def write_rows(f, next_id, user, created_at, session, names, ids, ips, n_subjects, filler, annotation_bytes, rng):
+    n = len(user)
+    if n == 0:
+        return next_id
+    # finished_at is a little before created_at (it's the browser's clock, then the upload),
+    # and started_at is the classification length before that
+    finished_at = created_at - (rng.random_sample(n) * 2 * ns_per_s).astype(np.int64)
+    started_at = finished_at - ((min_class_length + rng.random_sample(n) * (max_class_length - min_class_length)) * ns_per_s).astype(np.int64)
+
+    created_str  = [q.replace('T', ' ') for q in created_at.astype('datetime64[ns]').astype('datetime64[s]').astype(str)]
+    started_str  = started_at.astype('datetime64[ns]').astype('datetime64[ms]').astype(str)
+    finished_str = finished_at.astype('datetime64[ns]').astype('datetime64[ms]').astype(str)
+    subject = rng.randint(1, n_subjects + 1, size=n)
+    version = workflow_versions[rng.randint(0, len(workflow_versions), size=n)]
+    fill_at = rng.randint(0, len(filler) - annotation_bytes, size=n)
+
+    f.writelines([row_template % (next_id + i, names[user[i]], ids[user[i]], ips[user[i]], version[i], created_str[i],
+                                  '%x' % session[i], started_str[i], finished_str[i],
+                                  filler[fill_at[i]:fill_at[i] + annotation_bytes], subject[i], subject[i])
+                  for i in range(n)])
+    return next_id + n
+
+
+
+
+if __name__ == '__main__':
+    n_users          = pop_option(sys.argv, '--users', None, int)
+    unregistered     = pop_option(sys.argv, '--unregistered', 0.3, float)
+    alpha            = pop_option(sys.argv, '--alpha', 1.1, float)
+    n_subjects       = pop_option(sys.argv, '--subjects', None, int)
+    n_days           = pop_option(sys.argv, '--days', 90, int)
+    annotation_bytes = pop_option(sys.argv, '--annotation-bytes', 200, int)
+    seed             = pop_option(sys.argv, '--seed', 42, int)
+    try:
+        outfile = sys.argv[1]
+        n_rows = int(float(sys.argv[2]))
+    except:
+        print "\nUsage: " + sys.argv[0] + " outfile n_rows [--users N] [--unregistered F] [--alpha A] [--subjects N] [--days N] [--annotation-bytes N] [--seed N]"
+        print "      n_rows can be given like 1e6."
+        print "      --users is the number of distinct classifiers (default n_rows/40)"
+        print "      --unregistered is the fraction of them that aren't logged in (default 0.3)"
+        print "      --alpha sets how heavy-tailed the classifications per user are (default 1.1; bigger is more unequal)"
+        print "      --subjects is the number of distinct subjects (default n_rows/20)"
+        print "      --days is how long the project has been running (default 90)"
+        print "      --annotation-bytes is about how long each annotation is (default 200)\n"
+        sys.exit(0)
+
+    n_written = write_export(outfile, n_rows, n_users=n_users, unregistered=unregistered, alpha=alpha,
+                             n_subjects=n_subjects, n_days=n_days, annotation_bytes=annotation_bytes, seed=seed)
+    print "Wrote %d classifications to %s" % (n_written, outfile)
@@ -0,0 +1,62 @@
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# Checks that batch_stats.py runs sessions_inproj_byuser.py the way it's run by hand.
+# Run with python -m unittest discover (or pytest) from this directory.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import batch_stats
+import sessions_inproj_byuser
+import synthetic_export
+
+
+
+class BatchStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.the_dir = tempfile.mkdtemp()
+        self.classfile_in = os.path.join(self.the_dir, 'project.csv')
+        synthetic_export.write_export(self.classfile_in, 2000, annotation_bytes=20)
+
+    def tearDown(self):
+        shutil.rmtree(self.the_dir, ignore_errors=True)
+
+    # the script's main() with argv, with what it prints thrown away
+    def run_main(self, argv):
+        old_stdout = sys.stdout
+        try:
+            with open(os.devnull, 'w') as sys.stdout:
+                return sessions_inproj_byuser.main(argv)
+        finally:
+            sys.stdout = old_stdout
+
+    def test_same_as_the_script(self):
+        for session_break in [0.5, 1. / 3, 30.]:
+            project_dir = os.path.join(self.the_dir, 'batch_%r' % session_break)
+            the_row = batch_stats.run_export((self.classfile_in, project_dir, session_break))[0]
+            self.assertEqual(the_row['error'], '')
+            with open(os.path.join(project_dir, 'log.txt')) as f:
+                self.assertIn("classifier break of %s minutes" % session_break, f.read())
+
+            # named as the script names it with no stats_outfile
+            by_hand = self.run_main(['sessions_inproj_byuser.py', self.classfile_in, os.path.join(self.the_dir, 'by_hand.csv'), '0', repr(session_break)])
+            self.assertEqual(the_row['statsfile'], os.path.join(project_dir, sessions_inproj_byuser.dated_statsfile(
+                sessions_inproj_byuser.default_statsfile, by_hand['first_class_day'], by_hand['last_class_day'])))
+            with open(the_row['statsfile'], 'rb') as f:
+                batch_stats_file = f.read()
+            with open(by_hand['statsfile_out'], 'rb') as f:
+                self.assertEqual(batch_stats_file, f.read())
+
+    def test_break_reaches_main(self):
+        the_args = sessions_inproj_byuser.main_args(self.classfile_in, 'out.csv', True, 0.5)
+        self.assertEqual(float(the_args[4]), 0.5)
+        self.assertEqual(float(sessions_inproj_byuser.main_args(self.classfile_in, session_break=1. / 3)[4]), 1. / 3)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# Checks that incremental_sessions.py gives the same stats file as a full run.
+# Run with python -m unittest discover (or pytest) from this directory.
+
+import os
+import shutil
+import tempfile
+import unittest
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import numpy as np
+import pandas as pd
+
+import incremental_sessions
+import sessions_inproj_byuser
+
+
+# one classification: (user_name, created_at, seconds spent on it), with created_at to the
+# second, as it is in the exports
+def make_compact(the_rows):
+    user_names = [q[0] for q in the_rows]
+    created_at = pd.to_datetime([q[1] for q in the_rows]).values.view('i8')
+    lengths = np.array([q[2] for q in the_rows], dtype=np.int64) * 10**9
+    user_code, the_names = pd.factorize(np.array(user_names, dtype=object), sort=True)
+    return {'user_code':   user_code.astype(np.int32),
+            'user_names':  np.asarray(the_names, dtype=object),
+            'user_ids':    np.arange(len(the_names), dtype=np.int64) + 100,
+            'created_at':  created_at,
+            'started_at':  created_at - lengths,
+            'finished_at': created_at}
+
+
+# the stats file a full run would write
+def full_run(compact, session_break):
+    the_frame = sessions_inproj_byuser.session_stats(compact, session_break)[0]
+    the_buffer = StringIO()
+    the_frame.to_csv(the_buffer)
+    the_lines = the_buffer.getvalue()
+    return the_lines if isinstance(the_lines, bytes) else the_lines.encode('utf-8')
+
+
+def stats_file(state):
+    return incremental_sessions.stats_header() + state['stats_lines']
+
+
+
+class IncrementalSessionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.state_dir, ignore_errors=True)
+
+    # update, save and load, as the script does
+    def run_update(self, compact, session_break):
+        state = incremental_sessions.load_state(self.state_dir)
+        state, n_class_new, n_users_new = incremental_sessions.update_state(state, compact, session_break)
+        incremental_sessions.save_state(self.state_dir, state)
+        return state, n_class_new
+
+    def test_rows_in_checkpoint_second(self):
+        # the old export ends part way through 12:00:05, and the new one carries on in it
+        old_rows = [('alice', '2016-01-01 11:59:00', 20),
+                    ('bob',   '2016-01-01 12:00:00', 30),
+                    ('alice', '2016-01-01 12:00:05', 10),
+                    ('bob',   '2016-01-01 12:00:05', 5)]
+        new_rows = [('alice', '2016-01-01 12:00:05', 15),
+                    ('carol', '2016-01-01 12:00:05', 40),
+                    ('bob',   '2016-01-01 12:00:05', 25),
+                    ('bob',   '2016-01-01 14:00:00', 12)]
+        session_break = 60
+
+        state, n_class_new = self.run_update(make_compact(old_rows), session_break)
+        self.assertEqual(n_class_new, 4)
+        self.assertEqual(stats_file(state), full_run(make_compact(old_rows), session_break))
+
+        new_export = make_compact(old_rows + new_rows)
+        state, n_class_new = self.run_update(new_export, session_break)
+        self.assertEqual(n_class_new, 4)
+        self.assertEqual(state['n_class_tot'], 8)
+        self.assertEqual(stats_file(state), full_run(new_export, session_break))
+
+        # and nothing new the time after that
+        state, n_class_new = self.run_update(new_export, session_break)
+        self.assertEqual(n_class_new, 0)
+        self.assertEqual(stats_file(state), full_run(new_export, session_break))
+
+    def test_many_updates(self):
+        # a few users, one much busier than the rest, with classifications a few minutes apart
+        # and the odd long break
+        the_random = np.random.RandomState(8)
+        the_users = the_random.choice(['alice', 'bob', 'carol', 'dave', 'erin'], 400, p=[0.6, 0.1, 0.1, 0.1, 0.1])
+        the_gaps = np.where(the_random.rand(400) < 0.05, 3 * 3600, the_random.randint(0, 300, 400))
+        the_times = pd.Timestamp('2016-01-01') + pd.to_timedelta(np.cumsum(the_gaps), unit='s')
+        the_rows = [(q, str(r), l) for q, r, l in zip(the_users, the_times, the_random.randint(1, 120, 400))]
+
+        for n_rows in [30, 31, 100, 180, 181, 260, 400]:
+            the_export = make_compact(the_rows[:n_rows])
+            state = self.run_update(the_export, 30)[0]
+            self.assertEqual(stats_file(state), full_run(the_export, 30))
+            # what an interrupted run would leave on the end of a log
+            with open(os.path.join(self.state_dir, 'class_lengths.bin'), 'ab') as f:
+                f.write(b'\xff' * 24)
+
+    def test_shorter_export_starts_again(self):
+        the_rows = [('alice', '2016-01-01 11:59:00', 20),
+                    ('bob',   '2016-01-01 12:00:00', 30),
+                    ('alice', '2016-01-01 12:30:05', 10)]
+        self.run_update(make_compact(the_rows), 30)
+        state, n_class_new = self.run_update(make_compact(the_rows[:2]), 30)
+        self.assertEqual(n_class_new, 2)
+        self.assertEqual(stats_file(state), full_run(make_compact(the_rows[:2]), 30))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
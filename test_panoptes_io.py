@@ -0,0 +1,76 @@
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# Checks that read_compact() in panoptes_io.py gives the same arrays when the file is split
+# between workers as when it's read in one go.
+# Run with python -m unittest discover (or pytest) from this directory.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import parallel_csv
+import synthetic_export
+from panoptes_io import read_compact
+
+
+
+class ReadCompactTest(unittest.TestCase):
+
+    def setUp(self):
+        self.the_dir = tempfile.mkdtemp()
+        self.old_min_range_bytes = parallel_csv.min_range_bytes
+
+    def tearDown(self):
+        parallel_csv.min_range_bytes = self.old_min_range_bytes
+        shutil.rmtree(self.the_dir, ignore_errors=True)
+
+    def check_same(self, classfile_in, workers):
+        serial = read_compact(classfile_in)
+        # small enough ranges that every worker gets one
+        parallel_csv.min_range_bytes = 1024
+        merged = read_compact(classfile_in, workers=workers)
+        parallel_csv.min_range_bytes = self.old_min_range_bytes
+
+        self.assertEqual(sorted(merged.keys()), sorted(serial.keys()))
+        for the_key in ['created_at', 'started_at', 'finished_at', 'user_code', 'user_registered', 'subject_code',
+                        'subject_ids', 'workflow_code', 'workflow_ids']:
+            self.assertEqual(merged[the_key].dtype, serial[the_key].dtype, the_key)
+            self.assertTrue(np.array_equal(merged[the_key], serial[the_key]), the_key)
+        # (compared as strings, for the NaNs)
+        for the_key in ['user_names', 'user_ids', 'workflow_versions']:
+            self.assertEqual(merged[the_key].dtype, serial[the_key].dtype, the_key)
+            self.assertEqual([str(q) for q in merged[the_key]], [str(q) for q in serial[the_key]], the_key)
+        for the_key in ['n_subjects', 'n_meta_fallback', 'n_slow_timestamps']:
+            self.assertEqual(merged[the_key], serial[the_key], the_key)
+
+    def test_same_as_serial(self):
+        classfile_in = os.path.join(self.the_dir, 'project.csv')
+        synthetic_export.write_export(classfile_in, 3000, n_users=200, annotation_bytes=50, seed=3)
+        for workers in [2, 3, 7]:
+            self.check_same(classfile_in, workers)
+
+    def test_blank_versions_and_subjects(self):
+        # some classifications with no workflow_version or subject_data, and some of the other
+        # versions only in one part of the file
+        classfile_in = os.path.join(self.the_dir, 'project.csv')
+        synthetic_export.write_export(classfile_in, 3000, n_users=200, annotation_bytes=50, seed=4)
+        with open(classfile_in, 'rb') as f:
+            the_lines = f.read().decode('utf-8').split('\n')
+        for i in range(1, len(the_lines) - 1):
+            if i % 7 == 0:
+                the_lines[i] = the_lines[i].replace(',Synthetic workflow,12.34,', ',Synthetic workflow,,')
+            elif i % 11 == 0:
+                the_lines[i] = the_lines[i][:the_lines[i].rindex(',"{')] + ','
+            elif i > 2000:
+                the_lines[i] = the_lines[i].replace(',Synthetic workflow,14.2,', ',Synthetic workflow,15.0,')
+        with open(classfile_in, 'wb') as f:
+            f.write('\n'.join(the_lines).encode('utf-8'))
+        self.check_same(classfile_in, 4)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# Checks that parallel_csv.py only ever splits an export between records, with quoted JSON
+# that has newlines and doubled quotes in it.
+# Run with python -m unittest discover (or pytest) from this directory.
+
+import os
+import shutil
+import tempfile
+import unittest
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import numpy as np
+import pandas as pd
+
+import parallel_csv
+from parallel_csv import next_record_start, record_ranges, parse_range, read_csv_parallel
+
+
+
+# A CSV field: quoted (with quotes doubled) if it has a comma, quote or newline in it.
+def csv_field(the_value):
+    if any(q in the_value for q in ',"\n'):
+        return '"' + the_value.replace('"', '""') + '"'
+    return the_value
+
+
+# An export-like file of n_rows classifications, whose annotations and subject_data are JSON
+# with newlines, commas and (escaped) quotes in the strings. Returns the byte offset of the
+# start of every record (the first being the end of the header) and of the end of the file.
+def write_export(classfile_in, n_rows, the_random):
+    the_lines = ['classification_id,user_name,user_id,annotations,subject_data\n']
+    for i in range(n_rows):
+        the_text = ''.join(the_random.choice(['a', 'b', ' ', ',', '\n', '\\"', '"', '{}'], the_random.randint(0, 30)))
+        annotations = '[{"task":"T0","value":"%s"}]' % the_text.replace('"', '\\"')
+        subject_data = '{"%d":{"retired":null,\n"Filename":"x%d.jpg"}}' % (i, i)
+        user_id = '' if the_random.rand() < 0.3 else str(1000 + i % 7)
+        the_lines.append(','.join([str(i), 'user %d' % (i % 7), user_id, csv_field(annotations), csv_field(subject_data)]) + '\n')
+
+    with open(classfile_in, 'wb') as f:
+        f.write(''.join(the_lines).encode('utf-8'))
+    return list(np.cumsum([len(q) for q in the_lines]))
+
+
+def frame_text(the_frame):
+    the_buffer = StringIO()
+    the_frame.to_csv(the_buffer, index=False)
+    return the_buffer.getvalue()
+
+
+
+class ParallelCsvTest(unittest.TestCase):
+
+    def setUp(self):
+        self.the_dir = tempfile.mkdtemp()
+        self.classfile_in = os.path.join(self.the_dir, 'project.csv')
+        self.boundaries = write_export(self.classfile_in, 60, np.random.RandomState(20))
+        self.the_file = np.memmap(self.classfile_in, dtype=np.uint8, mode='r')
+        self.old_globals = (parallel_csv.sync_block, parallel_csv.min_range_bytes)
+
+    def tearDown(self):
+        parallel_csv.sync_block, parallel_csv.min_range_bytes = self.old_globals
+        del self.the_file
+        shutil.rmtree(self.the_dir, ignore_errors=True)
+
+    def test_next_record_start(self):
+        # the number of quotes before each byte
+        n_quotes = np.r_[0, np.cumsum(np.asarray(self.the_file) == parallel_csv.quote_char)]
+        self.assertEqual(next_record_start(self.the_file, 0, 0), self.boundaries[0])
+
+        # from every byte, inside quotes or not, and reading a few bytes at a time as well
+        for the_block in [self.old_globals[0], 3]:
+            parallel_csv.sync_block = the_block
+            for offset in range(len(self.the_file)):
+                the_next = min(q for q in self.boundaries if q > offset)
+                self.assertEqual(next_record_start(self.the_file, offset, int(n_quotes[offset])), the_next)
+
+    def test_record_ranges(self):
+        data_start = self.boundaries[0]
+        the_whole = frame_text(pd.read_csv(self.classfile_in))
+        names = list(pd.read_csv(self.classfile_in, nrows=1).columns)
+
+        for n_ranges in list(range(1, 40)) + [200, len(self.the_file)]:
+            the_ranges = record_ranges(self.classfile_in, data_start, n_ranges)
+            self.assertEqual(the_ranges[0][0], data_start)
+            self.assertEqual(the_ranges[-1][1], len(self.the_file))
+            for (start, end), (next_start, next_end) in zip(the_ranges[:-1], the_ranges[1:]):
+                self.assertEqual(end, next_start)
+            for start, end in the_ranges:
+                self.assertIn(start, self.boundaries)
+                self.assertIn(end, self.boundaries)
+
+            the_frames = [parse_range((self.classfile_in, q, r, names, {}, None)) for q, r in the_ranges]
+            self.assertEqual(frame_text(pd.concat(the_frames, ignore_index=True)), the_whole)
+
+    def test_read_csv_parallel(self):
+        # small enough ranges that this file is split
+        parallel_csv.min_range_bytes = 256
+        read_csv_args = {'usecols': ['user_name', 'user_id', 'annotations']}
+        self.assertEqual(frame_text(read_csv_parallel(self.classfile_in, 3, read_csv_args)),
+                         frame_text(pd.read_csv(self.classfile_in, **read_csv_args)))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
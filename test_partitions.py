@@ -0,0 +1,39 @@
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# Checks the partition codes of partitions.py.
+# Run with python -m unittest discover (or pytest) from this directory.
+
+import unittest
+
+import numpy as np
+
+from partitions import encode_partitions
+
+
+
+class EncodePartitionsTest(unittest.TestCase):
+
+    def test_missing_versions(self):
+        # workflow 2 with no version mustn't get the code of workflow 1's last version
+        workflow_id      = np.array([1, 1, 2, 2, 2, 3, 1])
+        workflow_version = np.array(['1.1', '1.2', np.nan, '2.1', '1.2', np.nan, '1.2'], dtype=object)
+        the_codes, the_keys = encode_partitions(workflow_id, workflow_version, 'workflow_version')
+
+        self.assertEqual(len(the_keys), 6)
+        self.assertEqual([q[0] for q in the_keys], [1, 1, 2, 2, 2, 3])
+        self.assertEqual([q[1] for q in the_keys][:4], ['1.1', '1.2', '1.2', '2.1'])
+        self.assertTrue(the_keys[4][1] is np.nan and the_keys[5][1] is np.nan)
+        # each classification's key is its own (workflow_id, workflow_version)
+        for the_code, the_id, the_version in zip(the_codes, workflow_id, workflow_version):
+            self.assertEqual(the_keys[the_code][0], the_id)
+            self.assertEqual(str(the_keys[the_code][1]), str(the_version))
+
+    def test_keys_match_across_chunks(self):
+        the_keys_1 = encode_partitions(np.array([5, 6]), np.array([np.nan, '1.0'], dtype=object), 'workflow_version')[1]
+        the_keys_2 = encode_partitions(np.array([5]), np.array([np.nan], dtype=object), 'workflow_version')[1]
+        self.assertIn(the_keys_2[0], set(the_keys_1))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
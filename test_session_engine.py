@@ -0,0 +1,160 @@
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# Checks sessionize() and sessionstats_arrays() in session_engine.py against a plain loop over
+# each user's classifications.
+# Run with python -m unittest discover (or pytest) from this directory.
+
+import unittest
+
+import numpy as np
+
+from session_engine import sessionize, sessionstats_arrays, ns_per_day, ns2mins
+
+
+ns_per_s = 10**9
+
+
+
+# The sessions of each user the slow way: each user's classifications in created_at order
+# (ties in the order they came), with a new session at the first one and after any gap of at
+# least int(session_break) minutes that isn't 0. Returns a dict by user_code of the
+# classifications (row numbers) in each of their sessions.
+def reference_sessions(user_code, created_at, session_break):
+    the_rows = {}
+    for i in range(len(user_code)):
+        the_rows.setdefault(user_code[i], []).append(i)
+
+    break_ns = int(session_break) * 60 * ns_per_s
+    the_sessions = {}
+    for the_user in the_rows:
+        the_sessions[the_user] = []
+        last_created = None
+        for i in sorted(the_rows[the_user], key=lambda j: created_at[j]):
+            gap = None if last_created is None else created_at[i] - last_created
+            if gap is None or (gap >= break_ns and gap != 0):
+                the_sessions[the_user].append([])
+            the_sessions[the_user][-1].append(i)
+            last_created = created_at[i]
+    return the_sessions
+
+
+def median(values):
+    return float(np.median(np.array(values, dtype=np.int64)))
+
+
+
+class SessionEngineTest(unittest.TestCase):
+
+    # user 0 has one classification; user 1 has several at the same second (and some in the
+    # wrong order), and gaps of a few seconds; user 2 has a session either side of midnight and
+    # gaps of whole minutes; user 3 has 5 sessions, some of them a single classification.
+    # (user_code, seconds after the start, seconds spent on it, user_id)
+    the_rows = [(1, 100, 10, 11), (2, 86100, 30, -1), (0, 50, 5, 10), (1, 100, 20, 11),
+                (1, 95, 3, 11),   (3, 0, 7, 13),      (1, 100, 0, 11),  (2, 86160, 12, -1),
+                (1, 130, 8, 11),  (3, 60, 9, 13),     (2, 86460, 4, -1), (3, 1800, 2, 13),
+                (1, 130, 6, 11),  (3, 1830, 20, 13),  (3, 5400, 1, 13),  (3, 9000, 6, 13),
+                (2, 88200, 50, -1), (3, 12600, 3, 13), (1, 190, 15, 11)]
+
+    def columns(self, the_rows):
+        start = 16800 * ns_per_day
+        user_code   = np.array([q[0] for q in the_rows], dtype=np.int32)
+        created_at  = np.array([q[1] for q in the_rows], dtype=np.int64) * ns_per_s + start
+        started_at  = created_at - np.array([q[2] for q in the_rows], dtype=np.int64) * ns_per_s
+        finished_at = created_at.copy()
+        user_id     = np.array([q[3] for q in the_rows], dtype=np.int64)
+        return user_code, created_at, started_at, finished_at, user_id
+
+    def check_sessionize(self, user_code, created_at, started_at, finished_at, session_break, presorted=False):
+        sessions = sessionize(user_code, created_at, started_at, finished_at, session_break, with_sessions=True, presorted=presorted)
+        reference = reference_sessions(user_code, created_at, session_break)
+        class_length = finished_at - started_at
+
+        the_users = sorted(reference)
+        self.assertEqual(list(sessions['user_code']), the_users)
+        self.assertEqual(list(sessions['n_sessions']), [len(reference[q]) for q in the_users])
+        all_sessions = [r for q in the_users for r in reference[q]]
+        all_rows = [i for q in the_users for r in reference[q] for i in r]
+        self.assertEqual(list(np.arange(len(user_code))[sessions['order']]), all_rows)
+        self.assertEqual(list(sessions['session_n_class']), [len(q) for q in all_sessions])
+        self.assertEqual(list(sessions['session_start']), [created_at[q[0]] for q in all_sessions])
+        self.assertEqual(list(sessions['session_end']), [created_at[q[-1]] for q in all_sessions])
+        self.assertEqual(list(sessions['session_class_length']), [sum(class_length[q]) for q in all_sessions])
+        self.assertEqual(list(sessions['session_class_length_median']), [median(class_length[q]) for q in all_sessions])
+
+        for k, the_user in enumerate(the_users):
+            the_rows = [i for q in reference[the_user] for i in q]
+            the_days = [created_at[i] // ns_per_day for i in the_rows]
+            self.assertEqual(sessions['n_class'][k], len(the_rows))
+            self.assertEqual(sessions['n_days'][k], len(set(the_days)))
+            self.assertEqual(sessions['first_day'][k], the_days[0])
+            self.assertEqual(sessions['last_day'][k], the_days[-1])
+            self.assertEqual(sessions['first_started_at'][k], started_at[the_rows[0]])
+            self.assertEqual(sessions['last_finished_at'][k], finished_at[the_rows[-1]])
+            self.assertEqual(sessions['last_created_at'][k], created_at[the_rows[-1]])
+            self.assertEqual(sessions['class_length_sum'][k], sum(class_length[the_rows]))
+            self.assertEqual(sessions['class_length_median'][k], median(class_length[the_rows]))
+        return sessions, reference
+
+    def test_sessionize(self):
+        user_code, created_at, started_at, finished_at, user_id = self.columns(self.the_rows)
+        for session_break in [0, 0.5, 1, 2.9, 30, 60]:
+            sessions, reference = self.check_sessionize(user_code, created_at, started_at, finished_at, session_break)
+
+            # the same from classifications that are already in order
+            order = sessions['order']
+            self.check_sessionize(user_code[order], created_at[order], started_at[order], finished_at[order], session_break, presorted=True)
+
+        # a break under a minute is a break of 0: every gap that isn't 0 starts a session, but the
+        # classifications at the same second stay together
+        sessions = sessionize(user_code, created_at, started_at, finished_at, 0.5)
+        self.assertEqual(list(sessions['n_sessions']), [1, 4, 4, 7])
+        self.assertEqual(list(sessions['session_n_class'][1:5]), [1, 3, 2, 1])
+
+    def test_random(self):
+        # lots of ties and gaps of 0, with the users all mixed up
+        the_random = np.random.RandomState(1)
+        n_rows = 500
+        user_code = the_random.randint(0, 12, n_rows).astype(np.int32)
+        created_at = (the_random.randint(0, 40, n_rows) * 30 + the_random.randint(0, 2, n_rows) * 86400).astype(np.int64) * ns_per_s
+        started_at = created_at - the_random.randint(0, 5, n_rows).astype(np.int64) * ns_per_s
+        for session_break in [0, 1, 5, 30]:
+            self.check_sessionize(user_code, created_at, started_at, created_at, session_break)
+
+    def test_sessionstats_arrays(self):
+        user_code, created_at, started_at, finished_at, user_id = self.columns(self.the_rows)
+        for session_break in [0, 1, 30]:
+            stats = sessionstats_arrays(user_code, created_at, started_at, finished_at, user_id, session_break)
+            reference = reference_sessions(user_code, created_at, session_break)
+            class_length = finished_at - started_at
+
+            for k, the_user in enumerate(sorted(reference)):
+                the_sessions = reference[the_user]
+                n_class_session = [len(q) for q in the_sessions]
+                length_session = [sum(class_length[q]) * ns2mins for q in the_sessions]
+                the_rows = [i for q in the_sessions for i in q]
+
+                self.assertEqual(stats['user_id'][k], user_id[the_rows[0]])
+                self.assertEqual(stats['n_sessions'][k], len(the_sessions))
+                self.assertEqual(list(stats['class_count_session'][sum(stats['n_sessions'][:k]):][:len(the_sessions)]), n_class_session)
+                self.assertEqual(stats['class_per_session_min'][k], min(n_class_session))
+                self.assertEqual(stats['class_per_session_max'][k], max(n_class_session))
+                self.assertEqual(stats['class_per_session_med'][k], np.median(n_class_session))
+                self.assertAlmostEqual(stats['class_per_session_mean'][k], np.mean(n_class_session))
+                self.assertAlmostEqual(stats['time_spent_classifying_total_minutes'][k], sum(length_session))
+                self.assertAlmostEqual(stats['session_length_median'][k], np.median(length_session))
+                self.assertEqual(stats['which_session_longest'][k], length_session.index(max(length_session)) + 1)
+                self.assertAlmostEqual(stats['tdiff_firstlast_hours'][k],
+                                       (finished_at[the_rows[-1]] - started_at[the_rows[0]]) / 1.0e9 / 3600.)
+                if len(the_sessions) >= 4:
+                    self.assertAlmostEqual(stats['mean_session_length_first2'][k], (length_session[0] + length_session[1]) / 2.)
+                    self.assertAlmostEqual(stats['mean_session_length_last2'][k], (length_session[-1] + length_session[-2]) / 2.)
+                    self.assertAlmostEqual(stats['mean_class_length_first2'][k],
+                                           (length_session[0] + length_session[1]) / (n_class_session[0] + n_class_session[1]))
+                else:
+                    self.assertEqual(stats['mean_session_length_first2'][k], 0.)
+                    self.assertEqual(stats['mean_class_length_last2'][k], 0.)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# Checks that what sessions_inproj_byuser.py does from the command line can be done by calling
+# its functions, without going through argv.
+# Run with python -m unittest discover (or pytest) from this directory.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import sessions_inproj_byuser
+import synthetic_export
+from panoptes_io import read_compact
+
+
+def frame_text(the_frame):
+    the_buffer = StringIO()
+    the_frame.to_csv(the_buffer)
+    return the_buffer.getvalue()
+
+
+
+class SessionsInprojByuserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.the_dir = tempfile.mkdtemp()
+        self.classfile_in = os.path.join(self.the_dir, 'project.csv')
+        synthetic_export.write_export(self.classfile_in, 2000, annotation_bytes=20)
+        self.compact = read_compact(self.classfile_in)
+
+    def tearDown(self):
+        shutil.rmtree(self.the_dir, ignore_errors=True)
+
+    # the script's main() with argv, with what it prints thrown away
+    def run_main(self, argv):
+        old_stdout = sys.stdout
+        try:
+            with open(os.devnull, 'w') as sys.stdout:
+                return sessions_inproj_byuser.main(['sessions_inproj_byuser.py'] + argv)
+        finally:
+            sys.stdout = old_stdout
+
+    def test_bad_options_raise(self):
+        for the_args in [['--sweep', '5,30', '--incremental', self.the_dir],
+                         ['--gaps', 'gaps.csv', '--by', 'workflow_id'],
+                         ['--by', 'nonsense'],
+                         ['--sweep-long']]:
+            self.assertRaises(ValueError, self.run_main, [self.classfile_in, os.path.join(self.the_dir, 'x.csv'), '0'] + the_args)
+        self.assertEqual(self.run_main([]), None)
+
+    def test_sweep(self):
+        the_results = sessions_inproj_byuser.analyze_sweep(self.compact, [5., 30.])
+        for the_break, the_frame in zip([5., 30.], the_results['sweep_stats']):
+            the_single = sessions_inproj_byuser.analyze(self.compact, the_break)['session_stats']
+            self.assertEqual(frame_text(the_frame), frame_text(the_single))
+
+        # and the same files as the command line writes
+        sessions_inproj_byuser.write_stats(the_results, os.path.join(self.the_dir, 'api.csv'), sweep_long=True)
+        self.run_main([self.classfile_in, os.path.join(self.the_dir, 'cli.csv'), '0', '--sweep', '5,30', '--sweep-long'])
+        with open(os.path.join(self.the_dir, 'api.csv')) as f, open(os.path.join(self.the_dir, 'cli.csv')) as g:
+            self.assertEqual(f.read(), g.read())
+
+    def test_gaps(self):
+        the_results = sessions_inproj_byuser.analyze_gaps(self.compact)
+        from_main = self.run_main([self.classfile_in, os.path.join(self.the_dir, 'x.csv'), '0', '--gaps', os.path.join(self.the_dir, 'gaps.csv')])
+        self.assertEqual(sorted(the_results['gap_report'].keys()), sorted(from_main['gap_report'].keys()))
+        self.assertEqual(the_results['overall']['n_class_tot'], 2000)
+
+    def test_incremental(self):
+        state_dir = os.path.join(self.the_dir, 'state')
+        the_results = sessions_inproj_byuser.analyze_incremental(self.compact, state_dir, 30.)
+        self.assertEqual(the_results['n_class_new'], 2000)
+        self.assertTrue(the_results['restart_reason'].startswith('no saved sessions'))
+        sessions_inproj_byuser.write_stats(the_results, os.path.join(self.the_dir, 'inc.csv'))
+
+        # the state was saved, so the next run has nothing new, and its stats are a full run's
+        the_results = sessions_inproj_byuser.analyze_incremental(self.compact, state_dir, 30.)
+        self.assertEqual(the_results['n_class_new'], 0)
+        self.assertEqual(the_results['restart_reason'], None)
+        with open(os.path.join(self.the_dir, 'inc.csv')) as f:
+            self.assertEqual(f.read(), frame_text(sessions_inproj_byuser.analyze(self.compact, 30.)['session_stats']))
+
+    def test_out_of_core(self):
+        the_results = sessions_inproj_byuser.analyze_out_of_core(self.classfile_in, 30., chunksize=300, tmp_dir=self.the_dir)
+        the_full = sessions_inproj_byuser.analyze(self.compact, 30.)
+        self.assertEqual(the_results['overall']['n_users_tot'], the_full['overall']['n_users_tot'])
+        self.assertTrue((the_results['session_stats']['n_sessions'] == the_full['session_stats']['n_sessions']).all())
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#Python 2.7.9 (default, Apr  5 2015, 22:21:35)
+#
+# The "Top 10 most prolific classifiers" leaderboard in both scripts (or the top K; see --top).
+#
+# When there's an exact count for every user, sorting all of them just to take the first 10
+# is wasted work: np.argpartition finds the K biggest in linear time, and only those (plus
+# any that tie with the smallest of them) are sorted. See top_k().
+#
+# basic_project_stats.py --approx never has a count for every user, so there it's a
+# Space-Saving summary (Metwally, Agrawal & El Abbadi 2005): a fixed number of counters, each
+# with a user, an upper bound on their count and how much of that might be overcount.
+# A user who isn't being counted takes over the counter with the smallest count, and carries
+# that count on as possible overcount. This version takes a batch of (user, count) pairs at
+# a time (e.g. one chunk of the file) and two summaries can be merged (e.g. from two workers);
+# in both cases a user missing from one side is assumed to have had up to that side's "floor":
+# the most any user it isn't counting can have. The guarantees are
+#   - every user's true count is between count - error and count
+#   - every user with a true count above the floor (which is at most n_class/capacity) has a counter
+# so with a capacity well above K the top K come out right, with their error bounds.
+
+import numpy as np
+import pandas as pd
+
+
+default_k = 10
+
+# counters per place in the leaderboard
+default_capacity_per_k = 100
+
+
+
+# The positions of the k biggest counts, biggest first. Ties are in reverse order of
+# position (e.g. reverse alphabetical, for counts in user name order), which is what the
+# old sort of the whole Series did as long as it was a stable one.
+def top_k(counts, k=default_k):
+    counts = np.asarray(counts)
+    k = min(k, len(counts))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    the_kth = counts[np.argpartition(counts, len(counts) - k)[len(counts) - k]]
+    # everything at least as big as the k'th biggest, which can be more than k if there are ties
+    candidates = np.flatnonzero(counts >= the_kth)
+    return candidates[np.lexsort((-candidates, -counts[candidates]))][:k]
+
+
+
+# The leaderboard as a Series of counts indexed by user name (the same as sorting the whole of
+# nclass_byuser and taking .head(k))
+def top_k_series(nclass_byuser, k=default_k):
+    the_top = top_k(nclass_byuser.values, k)
+    return pd.Series(nclass_byuser.values[the_top], index=nclass_byuser.index[the_top])
+
+
+
+def new_space_saving(capacity):
+    return {'capacity': capacity, 'floor': 0,
+            'keys': np.zeros(0, dtype=object), 'counts': np.zeros(0, dtype=np.int64), 'errors': np.zeros(0, dtype=np.int64)}
+
+
+
+# Merge 2 Space-Saving summaries (see above), keeping the capacity of the first.
+def space_saving_merge(summary_a, summary_b):
+    n_a = len(summary_a['keys'])
+    the_codes, the_keys = pd.factorize(np.r_[summary_a['keys'], summary_b['keys']])
+    the_keys = np.asarray(the_keys, dtype=object)
+
+    # (a user one side isn't counting might have had up to its floor)
+    the_counts = np.zeros(len(the_keys), dtype=np.int64)
+    the_errors = np.zeros(len(the_keys), dtype=np.int64)
+    for the_summary, the_rows in ((summary_a, the_codes[:n_a]), (summary_b, the_codes[n_a:])):
+        side_counts = np.zeros(len(the_keys), dtype=np.int64) + the_summary['floor']
+        side_errors = np.zeros(len(the_keys), dtype=np.int64) + the_summary['floor']
+        side_counts[the_rows] = the_summary['counts']
+        side_errors[the_rows] = the_summary['errors']
+        the_counts += side_counts
+        the_errors += side_errors
+
+    the_floor = summary_a['floor'] + summary_b['floor']
+    the_capacity = summary_a['capacity']
+    if len(the_keys) > the_capacity:
+        the_kept = top_k(the_counts, the_capacity)
+        # the ones that are dropped can't have had more than the biggest of them
+        the_dropped = np.ones(len(the_keys), dtype=bool)
+        the_dropped[the_kept] = False
+        the_floor = max(the_floor, int(the_counts[the_dropped].max()))
+        the_keys, the_counts, the_errors = the_keys[the_kept], the_counts[the_kept], the_errors[the_kept]
+
+    return {'capacity': the_capacity, 'floor': the_floor, 'keys': the_keys, 'counts': the_counts, 'errors': the_errors}
+
+
+
+# Add a batch of users and their exact counts in it (each user once) to a Space-Saving summary.
+def space_saving_add(summary, the_keys, the_counts):
+    the_batch = {'capacity': len(the_keys), 'floor': 0, 'keys': np.asarray(the_keys, dtype=object),
+                 'counts': np.asarray(the_counts, dtype=np.int64), 'errors': np.zeros(len(the_keys), dtype=np.int64)}
+    return space_saving_merge(summary, the_batch)
+
+
+
+# The top k of a Space-Saving summary, as a DataFrame indexed by user name with the count
+# (an upper bound) and the lower bound on it, plus the number of them that are certainly in
+# the true top k (their lower bound is at least as big as the most anyone outside the top k
+# could have).
+def space_saving_top(summary, k=default_k):
+    the_top = top_k(summary['counts'], k)
+    the_rest = np.ones(len(summary['counts']), dtype=bool)
+    the_rest[the_top] = False
+    outside_max = max(summary['floor'], int(summary['counts'][the_rest].max()) if the_rest.any() else 0)
+    lower = summary['counts'][the_top] - summary['errors'][the_top]
+
+    the_frame = pd.DataFrame({'n_class': summary['counts'][the_top], 'at_least': lower},
+                             index=pd.Index(summary['keys'][the_top], name='user_name'), columns=['n_class', 'at_least'])
+    return the_frame, int(np.sum(lower >= outside_max))